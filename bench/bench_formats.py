@@ -0,0 +1,78 @@
+"""Snapshot format benchmark: size and load time of JSON vs binary columnar.
+
+Usage: python bench/bench_formats.py [N ...]   (default: 10000 100000 1000000)
+
+Synthetic suites use realistic node ids: nested package paths, test classes
+and parametrized names, so prefixes repeat the way they do in large repos.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pytest_snap.columnar import read_columns, write_columnar  # noqa: E402
+from pytest_snap.snapio import load_snapshot  # noqa: E402
+
+
+def make_snapshot(n: int) -> dict:
+	rnd = random.Random(n)
+	results = []
+	for i in range(n):
+		mod = i // 200
+		cls = (i // 20) % 10
+		nodeid = f"tests/pkg_{mod % 37}/sub_{mod % 11}/test_module_{mod}.py::TestGroup{cls}::test_case_{i % 20}[param-{i % 7}]"
+		d = int(rnd.expovariate(1 / 5e6))
+		results.append({
+			"nodeid": nodeid,
+			"outcome": "passed" if rnd.random() > 0.01 else "failed",
+			"dur_ns": d,
+			"setup_ns": d // 10,
+			"call_ns": d,
+			"teardown_ns": d // 20,
+		})
+	return {"started_ns": 0, "finished_ns": 1, "env": {"pytest_version": "8"}, "results": results}
+
+
+def timed(fn, repeat: int = 3) -> float:
+	best = float("inf")
+	for _ in range(repeat):
+		t0 = time.perf_counter()
+		fn()
+		best = min(best, time.perf_counter() - t0)
+	return best
+
+
+def main(sizes) -> None:
+	print(f"{'tests':>9} {'json MB':>8} {'bin MB':>7} {'json load':>10} {'bin load':>9} {'bin cols':>9} {'bin+dicts':>10}")
+	with tempfile.TemporaryDirectory() as tmp:
+		for n in sizes:
+			snap = make_snapshot(n)
+			jp = os.path.join(tmp, "s.json"); bp = os.path.join(tmp, "s.bin")
+			with open(jp, "w", encoding="utf-8") as f:
+				json.dump(snap, f, indent=2)
+			write_columnar(bp, snap)
+			del snap
+			repeat = 1 if n >= 1_000_000 else 3
+			t_json = timed(lambda: load_snapshot(jp), repeat)
+			t_bin = timed(lambda: load_snapshot(bp), repeat)
+
+			def cols():
+				with open(bp, "rb") as f:
+					read_columns(f.read()).durations()
+			t_cols = timed(cols, repeat)
+			t_dicts = timed(lambda: list(load_snapshot(bp)["results"]), repeat)
+			print(
+				f"{n:>9} {os.path.getsize(jp)/1e6:>8.2f} {os.path.getsize(bp)/1e6:>7.2f} "
+				f"{t_json:>9.3f}s {t_bin:>8.3f}s {t_cols:>8.3f}s {t_dicts:>9.3f}s"
+			)
+
+
+if __name__ == "__main__":
+	main([int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
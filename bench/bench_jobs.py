@@ -0,0 +1,74 @@
+"""Multi-snapshot loading benchmark: ``timeline`` wall time vs ``--jobs``.
+
+Usage: python bench/bench_jobs.py [SNAPSHOTS [TESTS]]   (default: 500 2000)
+
+Writes SNAPSHOTS synthetic plugin snapshots of TESTS results each, then
+times a cold ``timeline`` (no ``.index.json``) for 1, 2, 4, ... up to the
+CPU count worker processes, ``timeline --perf`` at the same job counts, and
+finally a warm ``timeline`` served from the summary cache.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pytest_snap.cli import main as cli  # noqa: E402
+from pytest_snap.summary import INDEX_NAME, default_jobs  # noqa: E402
+
+
+def write_snapshots(art: str, n_snaps: int, n_tests: int) -> None:
+	rnd = random.Random(0)
+	for s in range(n_snaps):
+		results = []
+		for i in range(n_tests):
+			mod = i // 200
+			d = int(rnd.expovariate(1 / 5e6))
+			results.append({
+				"nodeid": f"tests/pkg_{mod % 37}/test_module_{mod}.py::TestGroup{(i // 20) % 10}::test_case_{i % 20}[p{i % 7}]",
+				"outcome": "passed" if rnd.random() > 0.01 else "failed",
+				"dur_ns": d, "setup_ns": d // 10, "call_ns": d, "teardown_ns": d // 20,
+			})
+		path = os.path.join(art, f"snap_r{s:05d}.json")
+		with open(path, "w", encoding="utf-8") as f:
+			json.dump({"started_ns": 0, "finished_ns": 1, "env": {"pytest_version": "8"}, "results": results}, f, indent=2)
+		os.utime(path, (1e9 + s, 1e9 + s))
+
+
+def timed(argv) -> float:
+	t0 = time.perf_counter()
+	with contextlib.redirect_stdout(io.StringIO()):
+		cli(argv)
+	return time.perf_counter() - t0
+
+
+def main(n_snaps: int, n_tests: int) -> None:
+	cpus = default_jobs()
+	jobs = sorted({1, *(j for j in (2, 4, 8, 16, 32, 64) if j <= cpus), cpus})
+	with tempfile.TemporaryDirectory() as art:
+		write_snapshots(art, n_snaps, n_tests)
+		index = os.path.join(art, INDEX_NAME)
+		print(f"{n_snaps} snapshots x {n_tests} tests, {cpus} CPU(s)")
+		print(f"{'jobs':>5} {'timeline':>9} {'speedup':>8} {'--perf':>8} {'speedup':>8}")
+		base = base_perf = 0.0
+		for j in jobs:
+			if os.path.exists(index):
+				os.unlink(index)
+			t = timed(["timeline", "--artifacts", art, "--json", "--jobs", str(j)])
+			t_perf = timed(["timeline", "--artifacts", art, "--json", "--perf", "--jobs", str(j)])
+			base, base_perf = base or t, base_perf or t_perf
+			print(f"{j:>5} {t:>8.2f}s {base / t:>7.2f}x {t_perf:>7.2f}s {base_perf / t_perf:>7.2f}x")
+		print(f"warm (.index.json): {timed(['timeline', '--artifacts', art, '--json']):.2f}s")
+
+
+if __name__ == "__main__":
+	args = [int(a) for a in sys.argv[1:]]
+	main(*(args + [500, 2000][len(args):]))
@@ -10,6 +10,10 @@ Public objects:
   - failure_signature(longrepr)
   - normalize_test_id(raw_id, mode)
   - append_history / load_history / compute_flake_scores
+
+A history path ending in ``/`` (or naming a directory) is a segmented
+:class:`~pytest_snap.history.HistoryStore`; anything else is a single,
+possibly compressed, JSONL file.
 """
 
 import json
@@ -19,7 +23,10 @@ from typing import Iterable, List, Dict, Any, Optional
 from pathlib import Path
 import re
 
+from .compress import open_text
 from .fingerprint import fingerprint
+from .history import HistoryStore, is_history_store
+from .snapio import load_snapshot
 
 
 SNAPSHOT_VERSION = 1
@@ -83,14 +90,14 @@ def write_snapshot(path: str, records: Iterable[TestRecord], collected: int) ->
 		collected=collected,
 		tests=list(records),
 	)
-	with open(path, "w", encoding="utf-8") as f:
+	# A .gz / .xz / .zst path is compressed transparently.
+	with open_text(path, "w") as f:
 		json.dump(snap.to_json(), f, separators=(",", ":"), sort_keys=False)
 
 
 def read_snapshot(path: str) -> dict:
-	with open(path, "r", encoding="utf-8") as f:
-		data = json.load(f)
-	return data
+	# Accepts whole-JSON and (possibly truncated) JSONL streamed snapshots.
+	return load_snapshot(path)
 
 
 # --- Rolling history ---
@@ -106,39 +113,57 @@ def append_history(history_path: str, run_id: str, records: List[TestRecord], ma
 			{"id": r.id, "outcome": r.outcome, "duration": round(float(r.duration), 6)} for r in records
 		],
 	}
+	limit = HISTORY_MAX if max_lines is None else max_lines
+	if is_history_store(history_path):
+		HistoryStore(history_path).append(entry, max_runs=limit)
+		return
 	p = Path(history_path)
 	p.parent.mkdir(parents=True, exist_ok=True)
-	with p.open("a", encoding="utf-8") as f:
+	# Compressed histories (.gz / .xz / .zst) append a new compressed member.
+	with open_text(p, "a") as f:
 		f.write(json.dumps(entry, separators=(",", ":")) + "\n")
 	# Truncate to last HISTORY_MAX (or override) lines
 	try:
-		lines = p.read_text(encoding="utf-8").splitlines()
-		limit = HISTORY_MAX if max_lines is None else max_lines
+		with open_text(p, "r") as f:
+			lines = f.read().splitlines()
 		if len(lines) > limit:
-			p.write_text("\n".join(lines[-limit:]) + "\n", encoding="utf-8")
+			with open_text(p, "w") as f:
+				f.write("\n".join(lines[-limit:]) + "\n")
 	except Exception:
 		pass
 
 
-def load_history(history_path: str) -> List[dict]:
+def load_history(history_path: str, last: int | None = None) -> List[dict]:
+	"""Run records oldest first; ``last`` keeps only the latest N (read newest-first from a store)."""
+	if is_history_store(history_path):
+		store = HistoryStore(history_path)
+		try:
+			return store.runs() if last is None else store.last(last)
+		except (OSError, ValueError):
+			return []
 	p = Path(history_path)
 	if not p.exists():
 		return []
 	out = []
 	try:
-		for line in p.read_text(encoding="utf-8").splitlines():
+		with open_text(p, "r") as f:
+			lines = f.read().splitlines()
+		for line in lines:
 			if not line.strip():
 				continue
 			out.append(json.loads(line))
 	except Exception:
 		return []
-	return out
+	return out if last is None else out[-last:] if last > 0 else []
+
+
+# Weight of the latest run in the flake EWMA (also used by ``rolling.RollingStats``).
+FLAKE_ALPHA = 0.3
 
 
 def compute_flake_scores(history: List[dict]) -> Dict[str, float]:
 	# Exponential weighted measure of outcome flips (pass<->fail) across sequential runs
-	# Use alpha = 0.3
-	alpha = 0.3
+	alpha = FLAKE_ALPHA
 	last_outcome: Dict[str, str] = {}
 	score: Dict[str, float] = {}
 	for run in history:
@@ -1,15 +1,44 @@
 from __future__ import annotations
 
-"""Performance budgets helpers (migrated)."""
+"""Performance budgets helpers (migrated).
 
+A budget file maps budget keys to quantile limits in seconds, any ``p<N>``
+key (``p50``, ``p95``, ``p99``, ``p99.9``)::
+
+    {"budgets": {"tests/test_api.py::test_list": {"p50": 0.2, "p99": 0.8},
+                 "tests/api/*":                  {"p95": 0.2},
+                 "re:^tests/db/.*::test_bulk_":  {"p99": 2.0},
+                 "sum:tests/api/":               {"p95": 30.0}}}
+
+Keys are exact test ids unless they contain ``*`` or ``?`` (``fnmatch``
+globs over the whole id, ``[...]`` classes allowed), start with ``re:`` (a
+regex searched in the id) or start with ``sum:``. A test takes the budget
+of its exact id, else of the first matching pattern in file order.
+``sum:<module>`` / ``sum:<dir>/`` budget the per-run total duration of the
+tests in a module or below a directory.
+
+Patterns are compiled once (:class:`BudgetMatcher`) into a character trie
+over their literal prefixes (``tests/api/`` for ``tests/api/*``): matching an
+id walks the trie only as far as some prefix continues, then tries the few
+patterns collected on the way. Checking a 100k-test snapshot is one pass over
+the results instead of patterns x tests. Patterns without a literal prefix
+(``*slow*``, unanchored regexes) are tried for every id.
+
+Observed durations are either plain lists or mergeable sketches
+(:class:`pytest_snap.sketch.TDigest`, ``--snap-sketches``), which answer any
+quantile over the whole history in constant memory.
+"""
+
+import fnmatch
 import json
-from typing import Dict, List
+import re
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Pattern, Tuple
 
 try:  # pragma: no cover
     import importlib
     yaml = importlib.import_module("yaml")  # type: ignore
 except Exception:  # pragma: no cover
-    yaml = None
+    yaml = None  # type: ignore[assignment]
 
 
 def load_budgets(path: str | None) -> Dict[str, Dict[str, float]]:
@@ -27,34 +56,239 @@ def load_budgets(path: str | None) -> Dict[str, Dict[str, float]]:
         return {}
 
 
+_QUANTILE_KEY = re.compile(r'^p(\d{1,2}(?:\.\d+)?|100)$')
+
+
+def parse_quantile(key: str) -> Optional[float]:
+    """``'p95'`` -> ``0.95``, ``'p99.9'`` -> ``0.999``; ``None`` for other keys."""
+    m = _QUANTILE_KEY.match(key)
+    return float(m.group(1)) / 100 if m else None
+
+
+def quantile(durations: List[float], q: float) -> float:
+    """Nearest-rank ``q``-quantile of a sample (0.0 when empty)."""
+    if not durations:
+        return 0.0
+    sorted_ds = sorted(durations)
+    idx = int(round(q * (len(sorted_ds) - 1)))
+    return float(sorted_ds[idx])
+
+
 def p95(durations: List[float]) -> float:
     if not durations:
         return 0.0
     if len(durations) < 5:
         return max(durations)
-    sorted_ds = sorted(durations)
-    idx = int(round(0.95 * (len(sorted_ds) - 1)))
-    return float(sorted_ds[idx])
+    return quantile(durations, 0.95)
+
+
+def _observed(obs: Any, key: str, q: float) -> Optional[float]:
+    if hasattr(obs, 'quantile'):  # a TDigest sketch
+        return obs.quantile(q)
+    if key == 'p95':
+        return p95(obs)  # keeps the max-of-few-samples rule
+    return quantile(obs, q)
+
+
+GLOB_CHARS = '*?'
+REGEX_PREFIX = 're:'
+SUM_PREFIX = 'sum:'
+_REGEX_META = set('.^$*+?{}[]\\|()')
 
 
-def compute_budget_violations(budgets: Dict[str, Dict[str, float]], observed: Dict[str, List[float]]) -> List[dict]:
-    violations = []
-    for tid, spec in budgets.items():
-        want_p95 = float(spec.get('p95', 0.0))
-        if tid not in observed:
+def _glob_prefix(pattern: str) -> str:
+    cut = min((i for i, ch in enumerate(pattern) if ch in '*?['), default=len(pattern))
+    return pattern[:cut]
+
+
+def _top_level_alternation(pattern: str) -> bool:
+    # An unescaped ``|`` outside groups and character classes.
+    depth = 0
+    in_class = escaped = False
+    for ch in pattern:
+        if escaped:
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif in_class:
+            in_class = ch != ']'
+        elif ch == '[':
+            in_class = True
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == '|' and depth == 0:
+            return True
+    return False
+
+
+def _regex_prefix(pattern: str) -> str:
+    # Literal text right after a leading ``^``; a quantifier makes its atom optional.
+    # With a top-level ``|`` the ``^`` anchors only the first branch.
+    if not pattern.startswith('^') or _top_level_alternation(pattern):
+        return ''
+    out: List[str] = []
+    for ch in pattern[1:]:
+        if ch in _REGEX_META:
+            if ch in '*?{' and out:
+                out.pop()
+            break
+        out.append(ch)
+    return ''.join(out)
+
+
+class BudgetMatcher:
+    """Budget keys of one budget file compiled for fast lookup by test id."""
+
+    def __init__(self, budgets: Mapping[str, Any]):
+        self.exact: Dict[str, str] = {}
+        self.groups: Dict[str, str] = {}
+        self.patterns: List[Tuple[str, Pattern[str]]] = []
+        self._search: set = set()  # indices of re: patterns (searched, globs must match whole ids)
+        # Trie node: [children by character, indices of patterns whose prefix
+        # ends here or at an ancestor, ascending (= file order)].
+        self._root: list = [{}, []]
+        for key in budgets:
+            if key.startswith(SUM_PREFIX):
+                self.groups[key[len(SUM_PREFIX):]] = key
+            elif key.startswith(REGEX_PREFIX):
+                body = key[len(REGEX_PREFIX):]
+                self._add_pattern(key, re.compile(body), _regex_prefix(body), search=True)
+            elif any(ch in key for ch in GLOB_CHARS):
+                self._add_pattern(key, re.compile(fnmatch.translate(key)), _glob_prefix(key), search=False)
+            else:
+                self.exact[key] = key
+
+    def _add_pattern(self, key: str, rx: Pattern[str], prefix: str, *, search: bool) -> None:
+        idx = len(self.patterns)
+        self.patterns.append((key, rx))
+        if search:
+            self._search.add(idx)
+        node = self._root
+        for ch in prefix:
+            child = node[0].get(ch)
+            if child is None:
+                child = node[0][ch] = [{}, node[1]]  # shares the parent's candidates until it gets its own
+            node = child
+        # The new pattern is a candidate at its node and every node below it.
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            n[1] = n[1] + [idx]
+            stack.extend(n[0].values())
+
+    def _candidates(self, tid: str) -> List[int]:
+        node = self._root
+        cands = node[1]
+        children = node[0]
+        for ch in tid:
+            node = children.get(ch)
+            if node is None:
+                break
+            cands = node[1]
+            children = node[0]
+            if not children:
+                break
+        return cands
+
+    def key_for(self, tid: str) -> Optional[str]:
+        """Budget key that applies to ``tid``: its exact id, else the first matching pattern."""
+        key = self.exact.get(tid)
+        if key is not None:
+            return key
+        for idx in self._candidates(tid):
+            k, rx = self.patterns[idx]
+            if (rx.search(tid) if idx in self._search else rx.match(tid)) is not None:
+                return k
+        return None
+
+    def match(self, ids: Iterable[str]) -> Dict[str, str]:
+        """``id -> budget key`` for every id some budget applies to."""
+        out = {}
+        for tid in ids:
+            key = self.key_for(tid)
+            if key is not None:
+                out[tid] = key
+        return out
+
+
+def group_keys(tid: str) -> List[str]:
+    """Aggregate groups of a test id: its module and every enclosing directory (``a/``, ``a/b/``)."""
+    module = tid.split('::', 1)[0]
+    parts = module.split('/')
+    return [module] + ['/'.join(parts[:i]) + '/' for i in range(1, len(parts))]
+
+
+def group_totals(durations: Mapping[str, float]) -> Dict[str, float]:
+    """Per-module / per-directory sums of ``id -> seconds`` (see :func:`group_keys`)."""
+    totals: Dict[str, float] = {}
+    by_module: Dict[str, float] = {}
+    for tid, d in durations.items():
+        module = tid.split('::', 1)[0]
+        by_module[module] = by_module.get(module, 0.0) + d
+    for module, d in by_module.items():
+        for g in group_keys(module):
+            totals[g] = totals.get(g, 0.0) + d
+    return totals
+
+
+def _check(label: str, key: str, spec: Any, obs: Any, out: List[dict]) -> None:
+    if not isinstance(spec, dict):
+        return
+    for qkey, want in spec.items():
+        q = parse_quantile(qkey)
+        if q is None or not isinstance(want, (int, float)):
+            continue
+        want = float(want)
+        got = _observed(obs, qkey, q)
+        if got is None or got <= 0 or want <= 0:
             continue
-        obs_p95 = p95(observed[tid])
-        if obs_p95 > 0 and want_p95 > 0:
-            if obs_p95 >= want_p95 * 1.15 and (obs_p95 - want_p95) >= 0.05:
-                violations.append({
-                    'id': tid,
-                    'budget_p95': round(want_p95, 6),
-                    'observed_p95': round(obs_p95, 6),
-                })
+        if got >= want * 1.15 and (got - want) >= 0.05:
+            v = {
+                'id': label,
+                'quantile': qkey,
+                f'budget_{qkey}': round(want, 6),
+                f'observed_{qkey}': round(got, 6),
+            }
+            if key != label:
+                v['budget'] = key
+            out.append(v)
+
+
+def compute_budget_violations(
+    budgets: Dict[str, Dict[str, float]],
+    observed: Mapping[str, Any],
+    groups: Optional[Mapping[str, Any]] = None,
+    *,
+    matcher: Optional[BudgetMatcher] = None,
+) -> List[dict]:
+    """One violation per test (or aggregate) and quantile whose observed value exceeds the budget.
+
+    ``observed`` maps test ids and ``groups`` module / directory names (see
+    :func:`group_totals`) to duration lists or sketches. A quantile counts as
+    over budget at 15% and at least 0.05s above it. Violations of pattern
+    budgets name the pattern in ``budget``; aggregates use ``sum:<group>`` ids.
+    """
+    matcher = matcher or BudgetMatcher(budgets)
+    violations: List[dict] = []
+    for tid, obs in observed.items():
+        key = matcher.key_for(tid)
+        if key is not None:
+            _check(tid, key, budgets[key], obs, violations)
+    for group, key in matcher.groups.items():
+        obs = (groups or {}).get(group)
+        if obs is not None:
+            _check(key, key, budgets[key], obs, violations)
     return violations
 
 __all__ = [
     'load_budgets',
     'compute_budget_violations',
+    'BudgetMatcher',
+    'group_keys',
+    'group_totals',
+    'parse_quantile',
+    'quantile',
     'p95',
 ]
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+"""Content-hash outcome cache (``--snap-cache``).
+
+A passing test is stored under its node id together with the project files it
+executed or imported (see :class:`pytest_snap.deps.DepTracer`) and a key hashing:
+
+* the interpreter version and every installed distribution's version,
+* the test's own file and each ``conftest.py`` from its directory up to the rootdir,
+* every project file it executed and every project module those files import,
+  so editing a module level constant the test reads invalidates the entry.
+
+On the next run the key is recomputed over the same files; if nothing changed
+the test is reported as a cached pass and its stored record (``dur_ns`` and
+phases) is reused instead of running it.
+
+Entries are one small JSON file each (``<dir>/<ab>/<sha1 of nodeid>.json``),
+written to a temporary name and renamed, so concurrent xdist workers or
+separate runs never see a torn entry. A hit refreshes the entry's mtime and
+:meth:`OutcomeCache.evict` removes least recently used entries until the
+directory fits its size budget.
+
+Not covered by the key: environment variables, data files and anything else
+outside the project's Python sources.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from importlib import metadata
+from typing import Any, Dict, Iterable, List, Optional
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_MB = 256
+
+
+def _env_key() -> str:
+	h = hashlib.sha256(sys.version.encode())
+	dists = sorted(
+		f"{d.metadata['Name']}=={d.version}".lower() for d in metadata.distributions() if d.metadata["Name"]
+	)
+	h.update("\n".join(dists).encode())
+	return h.hexdigest()
+
+
+class OutcomeCache:
+	def __init__(self, root: str, directory: str, *, max_bytes: int = DEFAULT_CACHE_MB * 2**20):
+		self.root = root
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.stored = 0
+		self._env: Optional[str] = None
+		self._hashes: Dict[str, str] = {}
+
+	@property
+	def env(self) -> str:
+		if self._env is None:
+			self._env = _env_key()
+		return self._env
+
+	def _file_hash(self, rel: str) -> str:
+		h = self._hashes.get(rel)
+		if h is None:
+			try:
+				with open(os.path.join(self.root, rel), "rb") as f:
+					h = hashlib.sha256(f.read()).hexdigest()
+			except OSError:
+				h = "missing"
+			self._hashes[rel] = h
+		return h
+
+	def _conftests(self, test_file: str) -> List[str]:
+		out = []
+		d = os.path.dirname(test_file)
+		while True:
+			rel = f"{d}/conftest.py" if d else "conftest.py"
+			if os.path.exists(os.path.join(self.root, rel)):
+				out.append(rel)
+			if not d:
+				return out
+			d = os.path.dirname(d)
+
+	def key(self, nodeid: str, deps: Iterable[str]) -> str:
+		test_file = nodeid.split("::", 1)[0]
+		files = set(deps)
+		files.add(test_file)
+		files.update(self._conftests(test_file))
+		h = hashlib.sha256(self.env.encode())
+		h.update(nodeid.encode())
+		for rel in sorted(files):
+			h.update(f"\0{rel}\0{self._file_hash(rel)}".encode())
+		return h.hexdigest()
+
+	def _entry_path(self, nodeid: str) -> str:
+		digest = hashlib.sha1(nodeid.encode()).hexdigest()
+		return os.path.join(self.directory, digest[:2], digest + ".json")
+
+	def lookup(self, nodeid: str) -> Optional[Dict[str, Any]]:
+		"""Stored record of a passing run whose inputs are unchanged, else ``None``."""
+		path = self._entry_path(nodeid)
+		try:
+			with open(path, encoding="utf-8") as f:
+				entry = json.load(f)
+		except (OSError, ValueError):
+			return None
+		if entry.get("version") != CACHE_VERSION or entry.get("nodeid") != nodeid:
+			return None
+		if entry.get("key") != self.key(nodeid, entry.get("deps", [])):
+			return None
+		try:
+			os.utime(path)  # LRU: mark as recently used
+		except OSError:
+			pass
+		self.hits += 1
+		return entry.get("record")
+
+	def store(self, nodeid: str, deps: Iterable[str], record: Dict[str, Any]) -> None:
+		deps = sorted(deps)
+		entry = {"version": CACHE_VERSION, "nodeid": nodeid, "key": self.key(nodeid, deps), "deps": deps, "record": record}
+		path = self._entry_path(nodeid)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		tmp = f"{path}.tmp{os.getpid()}"
+		with open(tmp, "w", encoding="utf-8") as f:
+			json.dump(entry, f, separators=(",", ":"))
+		os.replace(tmp, path)
+		self.stored += 1
+
+	def evict(self) -> int:
+		"""Delete least recently used entries until the cache fits ``max_bytes``."""
+		entries = []
+		total = 0
+		for dirpath, _dirs, files in os.walk(self.directory):
+			for name in files:
+				p = os.path.join(dirpath, name)
+				try:
+					st = os.stat(p)
+				except OSError:
+					continue
+				entries.append((st.st_mtime, st.st_size, p))
+				total += st.st_size
+		removed = 0
+		entries.sort()
+		for _mtime, size, p in entries:
+			if total <= self.max_bytes:
+				break
+			try:
+				os.remove(p)
+			except OSError:
+				continue
+			total -= size
+			removed += 1
+		return removed
+
+
+__all__ = ["OutcomeCache", "CACHE_VERSION", "DEFAULT_CACHE_MB"]
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+"""Duration change points across a series of runs (``timeline --perf``).
+
+Every test contributes one duration per run it appears in. The series is
+segmented on log durations (a 2x slowdown is the same shift for a 10 ms and
+a 10 s test) by CUSUM binary segmentation: split at the point that most
+reduces the squared error while that reduction exceeds
+``PENALTY * sigma^2 * log(n)``, then recurse into both halves. ``sigma`` is
+estimated robustly from successive differences, so a level shift survives
+but ordinary jitter does not. Each pass is O(n) (O(n log n) overall), unlike
+an optimal partition (PELT), which degrades to O(n^2) on the many series
+without any change.
+
+To scale to thousands of runs times ~100k tests most series never reach the
+segmentation step:
+
+* if ``max / min`` stays below the ratio of interest (or ``max - min`` below
+  the absolute one) no segment level can have moved that much;
+* if the best single split does not pay the penalty there is nothing to
+  segment.
+
+Series are median-of-3 filtered before segmenting (an isolated outlier
+vanishes, a step edge is kept), segments shorter than ``MIN_SEGMENT`` runs
+are not allowed and levels are segment medians, so a one-off slow run is not
+reported as a shift.
+"""
+
+import math
+from array import array
+from functools import lru_cache
+from itertools import accumulate, islice, repeat
+from operator import itemgetter, mul, sub
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+PENALTY = 3.0
+MIN_SEGMENT = 3
+# Log-duration noise floor (about 1%) for series with identical samples.
+MIN_SIGMA = 0.01
+_TINY = 1e-6
+
+Series = Tuple[array, array]  # (run positions, durations in seconds)
+
+
+def add_run(series: Dict[str, Series], pos: int, durations: Dict[str, float]) -> None:
+	"""Append one run's ``id -> seconds`` map at position ``pos`` (the map can be dropped afterwards)."""
+	for tid, d in durations.items():
+		s = series.get(tid)
+		if s is None:
+			s = series[tid] = (array("I"), array("d"))
+		s[0].append(pos)
+		s[1].append(d)
+
+
+def build_series(runs: Iterable[Dict[str, float]]) -> Dict[str, Series]:
+	"""``id -> (positions, durations)`` from per-run ``id -> seconds`` maps, in run order."""
+	series: Dict[str, Series] = {}
+	for pos, durations in enumerate(runs):
+		add_run(series, pos, durations)
+	return series
+
+
+def reindex(series: Dict[str, Series], mapping: Sequence[int]) -> Dict[str, Series]:
+	"""Renumber runs (``mapping[old] -> new``, ``-1`` drops the run) and restore run order."""
+	out: Dict[str, Series] = {}
+	for tid, (positions, durations) in series.items():
+		pairs = sorted((mapping[p], d) for p, d in zip(positions, durations) if mapping[p] >= 0)
+		if pairs:
+			out[tid] = (array("I", [p for p, _ in pairs]), array("d", [d for _, d in pairs]))
+	return out
+
+
+def _median(xs: Sequence[float]) -> float:
+	s = sorted(xs)
+	n = len(s)
+	return s[n // 2] if n % 2 else (s[n // 2 - 1] + s[n // 2]) / 2
+
+
+def robust_sigma(xs: Sequence[float]) -> float:
+	"""Noise standard deviation from the MAD of successive differences (insensitive to level shifts)."""
+	diffs = list(map(abs, map(sub, islice(xs, 1, None), xs)))
+	if not diffs:
+		return MIN_SIGMA
+	return max(_median(diffs) / (0.6745 * math.sqrt(2)), MIN_SIGMA)
+
+
+def median3(xs: Sequence[float]) -> List[float]:
+	"""Running median of three (endpoints kept)."""
+	if len(xs) < 3:
+		return list(xs)
+	mid = map(itemgetter(1), map(sorted, zip(xs, islice(xs, 1, None), islice(xs, 2, None))))
+	return [xs[0], *mid, xs[-1]]
+
+
+@lru_cache(maxsize=256)
+def _split_weights(n: int, min_size: int) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+	ks = range(min_size, n - min_size + 1)
+	return tuple(k / n for k in ks), tuple(n / (k * (n - k)) for k in ks)
+
+
+def best_split(prefix: Sequence[float], a: int, b: int, *, min_size: int = MIN_SEGMENT) -> Tuple[float, int]:
+	"""``(gain, index)`` of the best single split of ``[a, b)``; ``prefix`` holds cumulative sums.
+
+	``gain`` is the squared-error reduction of splitting there (the squared
+	CUSUM statistic). Written as a chain of ``map`` calls: it runs for every
+	series, so it has to stay out of the interpreter loop.
+	"""
+	n = b - a
+	if n < 2 * min_size:
+		return 0.0, a
+	frac, weight = _split_weights(n, min_size)
+	base = prefix[a]
+	targets = map(base.__add__, map((prefix[b] - base).__mul__, frac))
+	devs = map(sub, islice(prefix, a + min_size, b - min_size + 1), targets)
+	gains = list(map(mul, map(pow, devs, repeat(2)), weight))
+	best = max(gains)
+	return best, a + min_size + gains.index(best)
+
+
+def segment(xs: Sequence[float], penalty: float, *, min_size: int = MIN_SEGMENT) -> List[int]:
+	"""Change indices by binary segmentation: split while the best split gains more than ``penalty``."""
+	prefix = list(accumulate(xs, initial=0.0))
+	out: List[int] = []
+	stack = [(0, len(xs))]
+	while stack:
+		a, b = stack.pop()
+		gain, k = best_split(prefix, a, b, min_size=min_size)
+		if gain > penalty:
+			out.append(k)
+			stack += [(a, k), (k, b)]
+	return sorted(out)
+
+
+def detect_shifts(
+	series: Dict[str, Series],
+	*,
+	ratio: float = 1.3,
+	abs_delta: float = 0.05,
+	min_size: int = MIN_SEGMENT,
+) -> List[Dict[str, Any]]:
+	"""Level shifts of at least ``ratio`` (either way) and ``abs_delta`` seconds.
+
+	Each shift has ``id``, ``pos`` (run position where the new level starts),
+	``before`` / ``after`` (segment medians, seconds) and ``ratio``
+	(after / before). Sorted by largest relative change first.
+	"""
+	out: List[Dict[str, Any]] = []
+	for tid, (positions, durations) in series.items():
+		n = len(durations)
+		if n < 2 * min_size:
+			continue
+		lo, hi = min(durations), max(durations)
+		if hi - lo < abs_delta or hi < ratio * max(lo, _TINY):
+			continue
+		logs = list(map(math.log, durations if lo > 0 else map(max, durations, repeat(_TINY))))
+		sigma = robust_sigma(logs)
+		penalty = PENALTY * sigma * sigma * math.log(n)
+		if best_split(list(accumulate(logs, initial=0.0)), 0, n, min_size=min_size)[0] <= penalty:
+			continue
+		bounds = [0, *segment(median3(logs), penalty, min_size=min_size), n]
+		levels = [_median(durations[a:b]) for a, b in zip(bounds, bounds[1:])]
+		for i in range(1, len(levels)):
+			before, after = levels[i - 1], levels[i]
+			r = after / max(before, _TINY)
+			if abs(after - before) >= abs_delta and (r >= ratio or r <= 1 / ratio):
+				out.append({"id": tid, "pos": positions[bounds[i]], "before": before, "after": after, "ratio": r})
+	out.sort(key=lambda c: -abs(math.log(max(c["ratio"], _TINY))))
+	return out
+
+
+def history_runs(history: List[dict]) -> Tuple[List[Dict[str, Any]], List[Dict[str, float]]]:
+	"""Per-run ``label`` / ``git_commit`` / ``created_at`` and ``id -> duration`` maps from a
+	rolling history (``baseline.load_history``)."""
+	meta: List[Dict[str, Any]] = []
+	runs: List[Dict[str, float]] = []
+	for i, run in enumerate(history):
+		if not isinstance(run, dict):
+			continue
+		meta.append({"label": str(run.get("run_id") or i), "git_commit": run.get("git_commit"), "created_at": run.get("ts")})
+		runs.append({
+			t["id"]: float(t["duration"])
+			for t in run.get("tests", [])
+			if isinstance(t, dict) and t.get("id") and isinstance(t.get("duration"), (int, float))
+		})
+	return meta, runs
+
+
+__all__ = [
+	"add_run",
+	"build_series",
+	"reindex",
+	"detect_shifts",
+	"history_runs",
+	"segment",
+	"best_split",
+	"robust_sigma",
+	"median3",
+	"PENALTY",
+	"MIN_SEGMENT",
+]
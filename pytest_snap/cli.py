@@ -10,12 +10,73 @@ import subprocess
 import sys
 import datetime
 from pathlib import Path
-from typing import List, Sequence
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+from .baseline import load_history
+from .budgets import BudgetMatcher, compute_budget_violations, group_totals, load_budgets
+from .changepoint import add_run, detect_shifts, history_runs, reindex
+from .compress import SNAPSHOT_SUFFIXES
+from .history import HistoryStore
+from .hostinfo import HOST_MODES, IncomparableHosts, host_scale, scale_rows
+from .rolling import RollingStats
+from .schedule import plan_shards
+from .sketch import merge_sketch_files
+from .snapio import (
+	FAILED_OUTCOMES, METRICS, NOISE_MADS, PHASES, duration_index, format_metric, load_snapshot, metric_value, noise_floor, normalize_fixtures,
+	normalize_tests, phase_deltas,
+)
+from .stats import STAT_METHODS, compare, history_samples, pair_samples
+from .store import SnapStore, parse_store
+from .summary import COUNT_KEYS as SUMMARY_COUNTS, SummaryIndex, default_jobs, load_summaries, transitions as summary_transitions
 
 
 def _load_json(path: Path):
-	with path.open('r', encoding='utf-8') as f:
-		return json.load(f)
+	# Whole-JSON or streamed JSONL (partial snapshots from killed runs load too).
+	return load_snapshot(path)
+
+
+def _snap_file(art: Path, label: str) -> Path:
+	"""Snapshot for ``label``: snap_<label>.json or a compressed variant (.json.gz/.zst/.xz)."""
+	for suffix in SNAPSHOT_SUFFIXES:
+		p = art / f"snap_{label}{suffix}"
+		if p.exists():
+			return p
+	return art / f"snap_{label}.json"
+
+
+def _snap_files(art: Path) -> List[Path]:
+	found: Set[Path] = set()
+	for suffix in SNAPSHOT_SUFFIXES:
+		found.update(art.glob(f"snap_*{suffix}"))
+	return sorted(found)
+
+
+def _snap_label(p: Path) -> str:
+	name = p.name
+	for suffix in sorted(SNAPSHOT_SUFFIXES, key=len, reverse=True):
+		if name.endswith(suffix):
+			name = name[: -len(suffix)]
+			break
+	return name.replace('snap_', '', 1)
+
+
+def _store_arg(spec: str) -> str:
+	try:
+		return parse_store(spec)
+	except ValueError as exc:
+		raise argparse.ArgumentTypeError(str(exc)) from None
+
+
+def _open_store(args) -> SnapStore | None:
+	"""The ``--store`` database, synced with the snapshot files in ``--artifacts`` (None without --store)."""
+	path = getattr(args, 'store', None)
+	if not path:
+		return None
+	store = SnapStore(path)
+	art = Path(args.artifacts)
+	if art.is_dir():
+		store.sync((_snap_label(p), str(p)) for p in _snap_files(art))
+	return store
 
 
 def _supports_color(disable: bool) -> bool:
@@ -40,7 +101,9 @@ class _Palette:
 
 
 def diff_snapshots(a_path: Path, b_path: Path, *, plain=False, show_all=False, full_ids=False,
-			   perf=False, perf_ratio=1.3, perf_abs=0.05, perf_show_faster=False) -> int:
+			   perf=False, perf_ratio=1.3, perf_abs=0.05, perf_show_faster=False,
+			   perf_metric='duration', perf_fail=False, perf_stat=None, perf_alpha=0.05, perf_history=None,
+			   perf_host='normalize', perf_stats=None, perf_flake=1.0, store: SnapStore | None = None) -> int:
 	"""Diff two snapshot JSON files.
 
 	Supports both the legacy/expanded schema (with top-level 'tests' entries containing
@@ -48,43 +111,48 @@ def diff_snapshots(a_path: Path, b_path: Path, *, plain=False, show_all=False, f
 	'results' entries containing 'nodeid','outcome','dur_ns'. This function normalizes
 	both forms into a common structure so counts like persistent_pass work regardless
 	of which producer created the snapshots.
+
+	``perf_metric`` selects the compared field (wall clock by default, or a
+	resource field such as ``cpu`` / ``ctx_invol``; ``perf_abs`` is in that
+	field's unit). With ``perf_fail`` the return code is 1 when any test is slower.
+
+	``perf_stat`` ("mw" / "bootstrap") replaces the ratio threshold by a
+	significance test (Benjamini-Hochberg adjusted at ``perf_alpha``) for tests
+	with repeated samples on both sides, or with durations in the
+	``perf_history`` file as the baseline distribution.
+
+	Snapshots from different hosts (see ``env.host``) are put on A's scale by
+	the calibration ratio (``perf_host='normalize'``), refused with return
+	code 2 (``'strict'``) or compared raw (``'ignore'``).
+
+	With ``perf_stats`` (a ``--snap-stats`` file) a duration change within
+	3 rolling standard deviations of the test is treated as noise, and slower
+	tests whose flake score there is at least ``perf_flake`` are listed
+	apart and do not fail the ``perf_fail`` gate.
+
+	With ``store`` both snapshots are read from the SQLite store by label.
 	"""
-	A = _load_json(a_path); B = _load_json(b_path)
+	if store is not None:
+		A = store.snapshot(_snap_label(a_path)) or {}; B = store.snapshot(_snap_label(b_path)) or {}
+	else:
+		A = _load_json(a_path) or {}; B = _load_json(b_path) or {}
 	pal = _Palette(_supports_color(plain) )
 
-	def _extract_tests(s: dict):
-		# Preferred rich schema
-		if 'tests' in s:
-			out=[]
-			for t in s.get('tests', []):
-				if not isinstance(t, dict):
-					continue
-				out.append({
-					'id': t.get('id'),
-					'outcome': t.get('outcome'),
-					'duration': t.get('duration') if isinstance(t.get('duration'), (int,float)) else None,
-				})
-			return out
-		# Minimal plugin schema (0.1.0): 'results' with nodeid/dur_ns
-		if 'results' in s:
-			out=[]
-			for r in s.get('results', []):
-				if not isinstance(r, dict):
-					continue
-				dur_ns = r.get('dur_ns')
-				duration = (dur_ns / 1e9) if isinstance(dur_ns, (int, float)) else None
-				out.append({
-					'id': r.get('nodeid'),
-					'outcome': r.get('outcome'),
-					'duration': duration,
-				})
-			return out
-		return []
-
 	def idx(s: dict):
-		return {t['id']: t for t in _extract_tests(s) if t.get('id')}
+		return {t['id']: t for t in normalize_tests(s) if t.get('id')}
 
 	ia, ib = idx(A), idx(B)
+	host_info: Dict[str, Any] = {'differences': [], 'scale': None}
+	if perf:
+		try:
+			host_info = host_scale(A.get('env'), B.get('env'), perf_host)
+		except IncomparableHosts as exc:
+			print(f"Refusing to compare timings: {exc} (use --perf-host normalize or ignore)", file=sys.stderr)
+			return 2
+	# Time-like metrics are CPU bound and follow the calibration; counters do not.
+	scale = host_info['scale'] if perf_metric not in {'ctx_vol', 'ctx_invol', 'rss_peak_delta_kb'} else None
+	if scale:
+		ib = scale_rows(ib, scale)
 
 	regressions=fixes=persistent_fail=persistent_pass=added_pass=added_fail=removed=new_xfails=resolved_xfails=persistent_xfails=xpassed=None  # type: ignore
 	regressions=[]; fixes=[]; persistent_fail=[]; persistent_pass=[]; added_pass=[]; added_fail=[]; removed=[]; new_xfails=[]; resolved_xfails=[]; persistent_xfails=[]; xpassed=[]
@@ -95,11 +163,11 @@ def diff_snapshots(a_path: Path, b_path: Path, *, plain=False, show_all=False, f
 			continue
 		cur = ib[tid]
 		prev_out, cur_out = rec.get('outcome'), cur.get('outcome')
-		if prev_out == 'passed' and cur_out == 'failed':
+		if prev_out == 'passed' and cur_out in FAILED_OUTCOMES:
 			regressions.append(tid)
-		elif prev_out == 'failed' and cur_out == 'passed':
+		elif prev_out in FAILED_OUTCOMES and cur_out == 'passed':
 			fixes.append(tid)
-		elif prev_out == 'failed' and cur_out == 'failed':
+		elif prev_out in FAILED_OUTCOMES and cur_out in FAILED_OUTCOMES:
 			persistent_fail.append(tid)
 		elif prev_out == 'passed' and cur_out == 'passed':
 			persistent_pass.append(tid)
@@ -115,22 +183,50 @@ def diff_snapshots(a_path: Path, b_path: Path, *, plain=False, show_all=False, f
 	for tid, rec in ib.items():
 		if tid in ia:
 			continue
-		if rec.get('outcome') == 'failed':
+		if rec.get('outcome') in FAILED_OUTCOMES:
 			added_fail.append(tid)
 		else:
 			added_pass.append(tid)
 		if rec.get('outcome') in {'xfailed','xfail'}:
 			new_xfails.append(tid)
 
-	slower=[]; faster=[]
+	slower: List[Tuple[Any, ...]] = []; faster: List[Tuple[Any, ...]] = []
+	phase_tot = {ph: [0.0, 0.0] for ph in PHASES}; have_phases = False
+	stat_rows = {}
+	rolling_stats = RollingStats.load(perf_stats) if perf and perf_stats else None
+	rolling = rolling_stats if perf_metric == 'duration' else None
+	flake = rolling_stats.flake_scores() if rolling_stats is not None else {}
+	if perf and perf_stat and perf_metric == 'duration':
+		hist = history_samples(load_history(str(perf_history)), exclude_run=b_path.name) if perf_history else None
+		stat_rows = compare(pair_samples(ia, ib, hist), perf_stat, alpha=perf_alpha)
 	if perf:
 		for tid in sorted(set(ia) & set(ib)):
-			o = ia[tid].get('duration'); n = ib[tid].get('duration')
-			if isinstance(o,(int,float)) and isinstance(n,(int,float)):
+			# Whole-test time: setup + call + teardown when phases were captured.
+			o = metric_value(ia[tid], perf_metric); n = metric_value(ib[tid], perf_metric)
+			deltas = phase_deltas(ia[tid], ib[tid])
+			for ph in deltas:
+				phase_tot[ph][0] += ia[tid][ph]; phase_tot[ph][1] += ib[tid][ph]; have_phases = True
+			# Repeated samples (--snap-repeat): ignore changes within the MAD noise floor.
+			noise = noise_floor(ia[tid], ib[tid]) if perf_metric == 'duration' else 0.0
+			spread = rolling.duration(tid) if rolling is not None else None
+			if spread and spread['n'] >= 3:
+				noise = max(noise, NOISE_MADS * spread['std'])
+			st = stat_rows.get(tid)
+			if st is not None and isinstance(o,(int,float)) and isinstance(n,(int,float)):
+				if st['slower'] and st['delta'] >= perf_abs:
+					slower.append((tid,o,n,n/(o or 1e-9), n-o, deltas, st))
+				elif perf_show_faster and st['faster'] and -st['delta'] >= perf_abs:
+					faster.append((tid,o,n,o/(n or 1e-9), o-n, st))
+			elif isinstance(o,(int,float)) and isinstance(n,(int,float)) and abs(n-o) > noise:
 				if n > o and (n/(o or 1e-9)) >= perf_ratio and (n-o) >= perf_abs:
-					slower.append((tid,o,n,n/(o or 1e-9), n-o))
+					slower.append((tid,o,n,n/(o or 1e-9), n-o, deltas if perf_metric == 'duration' else {}, None))
 				elif perf_show_faster and o>n and (o/(n or 1e-9)) >= perf_ratio and (o-n) >= perf_abs:
-					faster.append((tid,o,n,o/(n or 1e-9), o-n))
+					faster.append((tid,o,n,o/(n or 1e-9), o-n, None))
+
+	# Known-flaky tests are reported but kept out of the gate (same rule as diff.diff_snapshots).
+	flaky_slower = [s for s in slower if flake.get(s[0], 0.0) >= perf_flake] if perf_flake < 1.0 else []
+	if flaky_slower:
+		slower = [s for s in slower if flake.get(s[0], 0.0) < perf_flake]
 
 	total_changed = sum(map(len, [fixes, regressions, added_pass, added_fail, removed, new_xfails, resolved_xfails]))
 	header = f"SNAPSHOT DIFF {a_path.name} -> {b_path.name}"
@@ -142,7 +238,7 @@ def diff_snapshots(a_path: Path, b_path: Path, *, plain=False, show_all=False, f
 		return tid.split('::')[-1]
 
 	if not full_ids:
-		counts={}
+		counts: Dict[str, int] = {}
 		for coll in [regressions, fixes, persistent_fail, persistent_pass, added_pass, added_fail, removed, new_xfails, resolved_xfails]:
 			for entry in coll:
 				tid = entry[0] if isinstance(entry, tuple) else entry
@@ -193,20 +289,78 @@ def diff_snapshots(a_path: Path, b_path: Path, *, plain=False, show_all=False, f
 
 	print()
 	if perf:
+		fm = lambda v: format_metric(perf_metric, v)  # noqa: E731
+		on = '' if perf_metric == 'duration' else f" [{perf_metric}]"
+		b_scale = host_info['scale'] or 1.0  # collection and fixture setup are timed too
+		if host_info['differences']:
+			how = f"B timings divided by {scale:.2f} (calibration)" if scale else 'not normalized (no calibration)'
+			print(pal.c('YELLOW', f"Different hosts ({'; '.join(host_info['differences'])}): {how}"))
+		rule = f"ratio>={perf_ratio}"
+		if stat_rows:
+			rule = f"{'Mann-Whitney' if perf_stat == 'mw' else 'bootstrap'} q<={perf_alpha} ({len(stat_rows)} sampled), else {rule}"
+		def sig(st):
+			if not st:
+				return ''
+			eff = f"d={st['effect']:+.3f}" if perf_stat == 'mw' else f"Δmed {st['ci_low']:+.3f}..{st['ci_high']:+.3f}s"
+			return f" p={st['p']:.2g} q={st['q']:.2g} {eff}"
 		if slower:
-			print(pal.c('YELLOW', f"Slower Tests: {len(slower)} (ratio>={perf_ratio} & +{perf_abs:.3f}s)"))
-			for tid,o,n,r,d in slower[:20]:
-				print(pal.c('YELLOW', f"  SLOWER: {disamb(tid)} +{d:.3f}s x{r:.2f} ({o:.3f}s -> {n:.3f}s)"))
+			print(pal.c('YELLOW', f"Slower Tests{on}: {len(slower)} ({rule} & +{fm(perf_abs)})"))
+			for tid,o,n,r,d,deltas,st in slower[:20]:
+				attr = ''
+				if deltas:
+					ph = max(deltas, key=lambda k: deltas[k])
+					attr = f" [{ph} +{deltas[ph]:.3f}s]"
+				print(pal.c('YELLOW', f"  SLOWER: {disamb(tid)} +{fm(d)} x{r:.2f} ({fm(o)} -> {fm(n)}){attr}{sig(st)}"))
 			if len(slower)>20:
 				print(pal.c('YELLOW', f"  … ({len(slower)-20} more)"))
+		if flaky_slower:
+			print(pal.c('CYAN', f"Slower but flaky{on}: {len(flaky_slower)} (flake score>={perf_flake}, not gated)"))
+			for tid,o,n,r,d,deltas,st in flaky_slower[:20]:
+				print(pal.c('CYAN', f"  FLAKY SLOWER: {disamb(tid)} +{fm(d)} x{r:.2f} ({fm(o)} -> {fm(n)}) flake={flake[tid]:.3f}"))
+			if len(flaky_slower)>20:
+				print(pal.c('CYAN', f"  … ({len(flaky_slower)-20} more)"))
 		if perf_show_faster and faster:
-			print(pal.c('GREEN', f"Faster Tests: {len(faster)} (ratio>={perf_ratio} & -{perf_abs:.3f}s)"))
-			for tid,o,n,r,d in faster[:20]:
-				print(pal.c('GREEN', f"  FASTER: {disamb(tid)} -{d:.3f}s x{r:.2f} ({o:.3f}s -> {n:.3f}s)"))
+			print(pal.c('GREEN', f"Faster Tests{on}: {len(faster)} ({rule} & -{fm(perf_abs)})"))
+			for tid,o,n,r,d,st in faster[:20]:
+				if st:
+					st = dict(st, p=st['p_faster'], q=st['q_faster'])
+				print(pal.c('GREEN', f"  FASTER: {disamb(tid)} -{fm(d)} x{r:.2f} ({fm(o)} -> {fm(n)}){sig(st)}"))
 			if len(faster)>20:
 				print(pal.c('GREEN', f"  … ({len(faster)-20} more)"))
 		if not slower and (not faster or not perf_show_faster):
-			print(pal.c('YELLOW', f"Slower Tests: 0 (no test exceeded ratio>={perf_ratio} and +{perf_abs:.3f}s)"))
+			print(pal.c('YELLOW', f"Slower Tests{on}: 0 (no test exceeded {rule} and +{fm(perf_abs)})"))
+		if have_phases:
+			parts = [f"{ph} {a:.3f}s -> {b:.3f}s ({b-a:+.3f}s)" for ph,(a,b) in phase_tot.items()]
+			print(pal.c('CYAN', "Phase totals (common tests): " + ' | '.join(parts)))
+		ca, cb = A.get('collection') or {}, B.get('collection') or {}
+		if ca.get('total_ns') is not None and cb.get('total_ns') is not None:
+			o, n = ca['total_ns']/1e9, cb['total_ns']/1e9/b_scale
+			color = 'YELLOW' if n > o and (n/(o or 1e-9)) >= perf_ratio and (n-o) >= perf_abs else 'CYAN'
+			print(pal.c(color, f"Collection: {o:.3f}s -> {n:.3f}s ({n-o:+.3f}s)"))
+			fa_ns = {f['path']: f['ns']/1e9 for f in ca.get('files') or []}
+			slower_files = []
+			for f in cb.get('files') or []:
+				o = fa_ns.get(f['path']); n = f['ns']/1e9/b_scale
+				if o is not None and n > o and (n/(o or 1e-9)) >= perf_ratio and (n-o) >= perf_abs:
+					slower_files.append((f['path'], o, n, n-o))
+			slower_files.sort(key=lambda x: x[3], reverse=True)
+			for path,o,n,d in slower_files[:20]:
+				print(pal.c('YELLOW', f"  SLOWER COLLECT: {path} +{d:.3f}s ({o:.3f}s -> {n:.3f}s)"))
+		fa, fb = normalize_fixtures(A), normalize_fixtures(B)
+		if fa or fb:
+			slower_fx = []
+			for key in sorted(set(fa) | set(fb)):
+				o = fa[key]['total'] if key in fa else 0.0
+				n = fb[key]['total']/b_scale if key in fb else 0.0
+				if n > o and (n/(o or 1e-9)) >= perf_ratio and (n-o) >= perf_abs:
+					slower_fx.append((key, o, n, n-o))
+			slower_fx.sort(key=lambda x: x[3], reverse=True)
+			print(pal.c('YELLOW', f"Slower Fixtures: {len(slower_fx)} (total setup time, ratio>={perf_ratio} & +{perf_abs:.3f}s)"))
+			for key,o,n,d in slower_fx[:20]:
+				cnt = f" calls {fa[key]['count'] if key in fa else 0}->{fb[key]['count']}"
+				print(pal.c('YELLOW', f"  SLOWER FIXTURE: {key} +{d:.3f}s ({o:.3f}s -> {n:.3f}s){cnt}"))
+			if len(slower_fx)>20:
+				print(pal.c('YELLOW', f"  … ({len(slower_fx)-20} more)"))
 	metrics=[
 		("new_pass", len(added_pass)), ("new_fail", len(added_fail)), ("fixes", len(fixes)),
 		("regressions", len(regressions)), ("removed", len(removed)), ("new_xfails", len(new_xfails)),
@@ -229,7 +383,7 @@ def diff_snapshots(a_path: Path, b_path: Path, *, plain=False, show_all=False, f
 	print(pal.c('BOLD', 'Summary Metrics:'))
 	for k,v in metrics:
 		print(f"  {k.ljust(width)} : {colorize(k,v)}")
-	return 0
+	return 1 if (perf and perf_fail and slower) else 0
 
 
 def code_version_diff(old: Path, new: Path, *, limit: int = 20, no_color: bool = False) -> int:
@@ -304,15 +458,20 @@ def code_version_diff(old: Path, new: Path, *, limit: int = 20, no_color: bool =
 	return 0
 
 
-def run_tests(label: str, *, tests_dir: Path, artifacts: Path, html: bool, history: bool, extra_pytest: Sequence[str]) -> int:
+def run_tests(label: str, *, tests_dir: Path, artifacts: Path, html: bool, history: bool, extra_pytest: Sequence[str],
+			  compress: str | None = None, repeat: int = 1) -> int:
 	"""Invoke pytest to produce a snapshot using the new minimal plugin.
 
 	NOTE: Legacy flags like --snap-save-baseline / --snap-history-path were
 	removed; we now rely solely on `--snap` + `--snap-out`.
-	The `history` flag is currently ignored (reserved for future use).
+	With `history` the run is appended to the segmented store
+	<artifacts>/history/ (`--snap-history`), which feeds flake scores and
+	`--snap-order risk`. An existing <artifacts>/history.jsonl is imported
+	into it once. Per-test rolling statistics go to <artifacts>/stats.json and
+	duration quantile sketches to <artifacts>/sketches.json.
 	"""
 	artifacts.mkdir(parents=True, exist_ok=True)
-	snap = artifacts / f"snap_{label}.json"
+	snap = artifacts / f"snap_{label}.json{'.' + compress if compress else ''}"
 	html_path = artifacts / f"run_{label}.html"
 	cmd = [
 		sys.executable,
@@ -326,7 +485,15 @@ def run_tests(label: str, *, tests_dir: Path, artifacts: Path, html: bool, histo
 	if html:
 		# Optional dependency; keep old behavior if user has pytest-html installed
 		cmd += ['--html', str(html_path), '--self-contained-html']
-	# history placeholder intentionally not implemented in minimal plugin
+	if history:
+		store = artifacts / 'history'
+		legacy = artifacts / 'history.jsonl'
+		if legacy.exists() and not store.exists():
+			HistoryStore(store).extend(load_history(str(legacy)))
+		cmd += ['--snap-history', f"{store}{os.sep}", '--snap-stats', str(artifacts / 'stats.json'),
+				'--snap-sketches', str(artifacts / 'sketches.json')]
+	if repeat > 1:
+		cmd += ['--snap-repeat', str(repeat)]
 	cmd += list(extra_clean)
 	print("== RUN", label, '==')
 	print(' '.join(cmd))
@@ -340,6 +507,16 @@ def run_tests(label: str, *, tests_dir: Path, artifacts: Path, html: bool, histo
 	return rc
 
 
+def collect_nodeids(tests_dir: Path, extra_pytest: Sequence[str]) -> List[str] | None:
+	"""Node ids from ``pytest --collect-only -q`` (None when collection fails)."""
+	cmd = [sys.executable, '-m', 'pytest', '--collect-only', '-q', str(tests_dir), *extra_pytest]
+	proc = subprocess.run(cmd, capture_output=True, text=True)
+	if proc.returncode != 0:
+		sys.stderr.write(proc.stdout[-2000:] + proc.stderr[-2000:])
+		return None
+	return [line.strip() for line in proc.stdout.splitlines() if '::' in line and not line.startswith(' ')]
+
+
 def discover_tests_dir(explicit: str | None) -> Path:
 	if explicit:
 		return Path(explicit)
@@ -376,6 +553,8 @@ def main(argv: Sequence[str] | None = None) -> int:
 	ap_run.add_argument('--artifacts', default='.artifacts', help='Artifacts directory (default: .artifacts); writes snap_<label>.json')
 	ap_run.add_argument('--html', action='store_true', help='Generate pytest-html report (opt-in)')
 	ap_run.add_argument('--no-history', action='store_true', help='Disable flake history recording')
+	ap_run.add_argument('--compress', choices=('gz', 'xz', 'zst'), help='Write snap_<label>.json.<ext> compressed (zst needs zstandard)')
+	ap_run.add_argument('--repeat', type=int, default=1, help='Run each test N times and record median/min/MAD timings (--snap-repeat)')
 
 	ap_all = sub.add_parser('all', help='Run multiple labels sequentially (default: v1 v2 v3)')
 	ap_all.add_argument('labels', nargs='*')
@@ -383,6 +562,8 @@ def main(argv: Sequence[str] | None = None) -> int:
 	ap_all.add_argument('--artifacts', default='.artifacts', help='Artifacts directory (default: .artifacts)')
 	ap_all.add_argument('--html', action='store_true', help='Generate pytest-html reports for each run')
 	ap_all.add_argument('--no-history', action='store_true')
+	ap_all.add_argument('--compress', choices=('gz', 'xz', 'zst'))
+	ap_all.add_argument('--repeat', type=int, default=1)
 
 	ap_diff = sub.add_parser('diff', help='Diff two labeled snapshots (A -> B). Labels map to .artifacts/snap_<label>.json')
 	sub.add_parser('perf', help='Show performance diff usage (shortcut docs for diff --perf)')
@@ -391,6 +572,11 @@ def main(argv: Sequence[str] | None = None) -> int:
 	ap_timeline.add_argument('--since', help='Git commit hash (short) to start from')
 	ap_timeline.add_argument('--limit', type=int, default=0, help='Max snapshots to display (0 = all)')
 	ap_timeline.add_argument('--json', action='store_true', help='Emit machine-readable JSON array')
+	ap_timeline.add_argument('--perf', action='store_true', help='Detect per-test duration level shifts (change points) across the timeline')
+	ap_timeline.add_argument('--perf-ratio', type=float, default=1.3, help='Minimum level change to report (default 1.3x, either direction)')
+	ap_timeline.add_argument('--perf-abs', type=float, default=0.05, help='Minimum absolute level change in seconds (default 0.05)')
+	ap_timeline.add_argument('--history', help='Read durations for --perf from this history (file or store directory) instead of the snapshots')
+	ap_timeline.add_argument('--top', type=int, default=20, help='Show N largest shifts (default 20, 0 = all)')
 	ap_diff.add_argument('a'); ap_diff.add_argument('b')
 	ap_diff.add_argument('--artifacts', default='.artifacts', help='Artifacts directory to read snapshots from (default: .artifacts)')
 	ap_diff.add_argument('--plain', action='store_true')
@@ -400,12 +586,59 @@ def main(argv: Sequence[str] | None = None) -> int:
 	ap_diff.add_argument('--perf-ratio', type=float, default=1.3)
 	ap_diff.add_argument('--perf-abs', type=float, default=0.05)
 	ap_diff.add_argument('--perf-show-faster', action='store_true')
+	ap_diff.add_argument('--perf-metric', choices=METRICS, default='duration', help='Field compared by --perf (default: duration; resource fields need --snap-resources snapshots)')
+	ap_diff.add_argument('--perf-fail', action='store_true', help='Exit 1 when --perf finds any slower test (CI gate)')
+	ap_diff.add_argument('--perf-stat', choices=STAT_METHODS, help='Significance test for tests with repeated samples or history (mw = Mann-Whitney U, bootstrap = median CI)')
+	ap_diff.add_argument('--perf-alpha', type=float, default=0.05, help='False discovery rate for --perf-stat (Benjamini-Hochberg, default 0.05)')
+	ap_diff.add_argument('--perf-host', choices=HOST_MODES, default='normalize', help='Snapshots from different hosts: normalize by calibration (default), strict = refuse, ignore = compare raw')
+	ap_diff.add_argument('--perf-stats', metavar='FILE', help='Rolling stats file (--snap-stats, e.g. .artifacts/stats.json): ignore changes within 3 standard deviations')
+	ap_diff.add_argument('--perf-flake', type=float, default=1.0, metavar='F', help='With --perf-stats: slower tests with a rolling flake score >= F are listed apart and not gated (default 1.0 = off)')
+	ap_diff.add_argument('--perf-history', help='History (file or store directory) whose durations form the baseline sample for --perf-stat (e.g. .artifacts/history/)')
 	ap_diff.add_argument('--code', action='store_true', help='Also show code-level diff; searches <A>,<B> under --versions-base')
 	ap_diff.add_argument('--code-only', action='store_true', help='Only show code-level diff (suppress snapshot outcomes)')
 	ap_diff.add_argument('--versions-base', default='.', help='Directory containing version subfolders (default .). Used by --code to locate <A> and <B>')
 
+	ap_fix = sub.add_parser('fixtures', help='Show per-fixture setup cost recorded in a snapshot')
+	ap_fix.add_argument('label')
+	ap_fix.add_argument('--artifacts', default='.artifacts')
+	ap_fix.add_argument('--plain', action='store_true')
+	ap_fix.add_argument('--top', type=int, default=20, help='Show N most expensive fixtures (default 20, 0 = all)')
+	ap_fix.add_argument('--sort-by', choices=('total','max','mean','count'), default='total')
+
+	ap_shard = sub.add_parser('shard', help='Print the node ids of one duration-balanced CI shard')
+	ap_shard.add_argument('label', help='Snapshot label (or path) supplying historical durations')
+	ap_shard.add_argument('--total', type=int, required=True, help='Number of shards')
+	ap_shard.add_argument('--index', type=int, required=True, help='Shard to print, 1-based')
+	ap_shard.add_argument('--artifacts', default='.artifacts')
+	ap_shard.add_argument('--tests', help='Collect node ids from this path (default: ./tests if present, else .)')
+	ap_shard.add_argument('--no-collect', action='store_true', help="Shard the snapshot's own node ids instead of collecting (misses new tests)")
+	ap_shard.add_argument('--per-test', action='store_true', help='Balance single tests instead of whole modules')
+
+	ap_stats = sub.add_parser('stats', help='Show tests with the most duration variance and the highest flake scores (--snap-stats)')
+	ap_stats.add_argument('--artifacts', default='.artifacts')
+	ap_stats.add_argument('--file', help='Stats file (default: <artifacts>/stats.json)')
+	ap_stats.add_argument('--top', type=int, default=10, help='Rows per table (default 10, 0 = all)')
+	ap_stats.add_argument('--min-samples', type=int, default=3, help='Ignore tests with fewer durations in the variance table (default 3)')
+	ap_stats.add_argument('--json', action='store_true')
+
+	ap_budgets = sub.add_parser('budgets', help='Check per-test quantile budgets (p50/p95/p99/...) against duration sketches (--snap-sketches)')
+	ap_budgets.add_argument('budget_file', help='JSON / YAML file with {"budgets": {test_id: {"p95": seconds, ...}}}')
+	ap_budgets.add_argument('--artifacts', default='.artifacts')
+	ap_budgets.add_argument('--sketches', nargs='+', metavar='FILE', help='Sketch file(s), merged (default: <artifacts>/sketches.json)')
+	ap_budgets.add_argument('--snapshot', metavar='LABEL', help='Check the durations of one snapshot (label or path) instead of sketches')
+	ap_budgets.add_argument('--json', action='store_true')
+
+	ap_msk = sub.add_parser('merge-sketches', help='Merge duration sketch files of parallel CI shards into one')
+	ap_msk.add_argument('inputs', nargs='+', metavar='FILE')
+	ap_msk.add_argument('-o', '--output', required=True, metavar='FILE')
+
 	ap_list = sub.add_parser('list', help='List available snapshots')
 	ap_list.add_argument('--artifacts', default='.artifacts')
+	ap_list.add_argument('-l', '--long', '--details', dest='long', action='store_true', help='Also show created_at, commit and outcome counts (cached in <artifacts>/.index.json)')
+
+	ap_ingest = sub.add_parser('ingest', help='Index snapshots into an SQLite store for fast timeline/list/show/diff (--store)')
+	ap_ingest.add_argument('--artifacts', default='.artifacts')
+	ap_ingest.add_argument('--store', type=_store_arg, metavar='sqlite:PATH', help='Store database (default: sqlite:<artifacts>/snapshots.db)')
 
 	ap_clean = sub.add_parser('clean', help='Remove artifacts directory')
 	ap_clean.add_argument('--artifacts', default='.artifacts')
@@ -415,11 +648,18 @@ def main(argv: Sequence[str] | None = None) -> int:
 	ap_show.add_argument('--artifacts', default='.artifacts')
 	ap_show.add_argument('--plain', action='store_true')
 	ap_show.add_argument('--top-slowest', type=int, default=10, help='Show N slowest tests (default 10)')
+	ap_show.add_argument('--sort-by', choices=METRICS, default='duration', help='Field ranking the top-N list (default: duration)')
 	ap_show.add_argument('--full', action='store_true', help='List all failed/xfail tests (not truncated)')
 	ap_show.add_argument('--max-id-len', type=int, default=90, help='Max length of displayed test id (default 90)')
 	ap_show.add_argument('--no-trunc', action='store_true', help='Disable test id truncation')
 	ap_show.add_argument('--full-ids', action='store_true', help='Show full path test ids instead of shortened form')
 
+	for ap_cmd in (ap_run, ap_all, ap_diff, ap_timeline, ap_list, ap_show):
+		ap_cmd.add_argument('--store', type=_store_arg, metavar='sqlite:PATH',
+					   help='Query an SQLite snapshot store (see ingest), syncing new/changed snapshot files first')
+	for ap_cmd in (ap_timeline, ap_list):
+		ap_cmd.add_argument('--jobs', '-j', type=int, default=0, metavar='N', help='Parse snapshots in N processes (default: CPU count; 1 = no pool)')
+
 	# Parse known args; anything unrecognized we treat as extra pytest args
 	args, extra_args = ap.parse_known_args(argv)
 
@@ -435,7 +675,12 @@ def main(argv: Sequence[str] | None = None) -> int:
 		if not tests_dir.exists():
 			print(f"Tests directory not found: {tests_dir}", file=sys.stderr)
 			return 2
-		return run_tests(args.label, tests_dir=tests_dir, artifacts=Path(args.artifacts), html=args.html, history=not args.no_history, extra_pytest=extra_args)
+		rc = run_tests(args.label, tests_dir=tests_dir, artifacts=Path(args.artifacts), html=args.html, history=not args.no_history, extra_pytest=extra_args,
+					   compress=args.compress, repeat=args.repeat)
+		store = _open_store(args)
+		if store is not None:
+			store.close()
+		return rc
 
 	if args.cmd == 'all':
 		labels = args.labels or ['v1','v2','v3']
@@ -449,19 +694,32 @@ def main(argv: Sequence[str] | None = None) -> int:
 				print(f"Tests directory not found for {lbl}: {this_dir}", file=sys.stderr)
 				rc = 2
 				continue
-			r = run_tests(lbl, tests_dir=this_dir, artifacts=Path(args.artifacts), html=args.html, history=not args.no_history, extra_pytest=extra_args)
-			rc = r or rc
+			rc = run_tests(lbl, tests_dir=this_dir, artifacts=Path(args.artifacts), html=args.html, history=not args.no_history, extra_pytest=extra_args,
+						   compress=args.compress, repeat=args.repeat) or rc
+		store = _open_store(args)
+		if store is not None:
+			store.close()
 		return rc
 
 	if args.cmd == 'diff':
 		art = Path(args.artifacts)
-		a_file = art / f"snap_{args.a}.json"; b_file = art / f"snap_{args.b}.json"
-		if not a_file.exists() or not b_file.exists():
+		a_file = _snap_file(art, args.a); b_file = _snap_file(art, args.b)
+		store = _open_store(args)
+		if store is not None:
+			missing = [lbl for lbl in (args.a, args.b) if not store.has(lbl)]
+			if missing:
+				print(f"Missing snapshots in {args.store}: {' '.join(missing)}", file=sys.stderr)
+				return 2
+		elif not a_file.exists() or not b_file.exists():
 			print(f"Missing snapshots: {a_file if not a_file.exists() else ''} {b_file if not b_file.exists() else ''}", file=sys.stderr)
 			return 2
+		rc = 0
 		if not args.code_only:
-			diff_snapshots(a_file, b_file, plain=args.plain, show_all=args.show_all, full_ids=args.full_ids,
-					   perf=args.perf, perf_ratio=args.perf_ratio, perf_abs=args.perf_abs, perf_show_faster=args.perf_show_faster)
+			rc = diff_snapshots(a_file, b_file, plain=args.plain, show_all=args.show_all, full_ids=args.full_ids,
+					   perf=args.perf, perf_ratio=args.perf_ratio, perf_abs=args.perf_abs, perf_show_faster=args.perf_show_faster,
+					   perf_metric=args.perf_metric, perf_fail=args.perf_fail, perf_stat=args.perf_stat,
+					   perf_alpha=args.perf_alpha, perf_history=args.perf_history, perf_host=args.perf_host, perf_stats=args.perf_stats,
+					   perf_flake=args.perf_flake, store=store)
 		# Determine if we should perform code diff
 		do_code = args.code or args.code_only
 		if do_code:
@@ -473,7 +731,7 @@ def main(argv: Sequence[str] | None = None) -> int:
 				code_version_diff(old_dir, new_dir)
 			else:
 				print(f"(code diff skipped: missing {old_dir} or {new_dir}; specify --versions-base <dir>)", file=sys.stderr)
-		return 0
+		return rc
 
 	if args.cmd == 'perf':
 		print("Performance Diff Usage:\n")
@@ -483,40 +741,66 @@ def main(argv: Sequence[str] | None = None) -> int:
 		print("  --perf-ratio R       Require at least Rx slowdown (default 1.30)")
 		print("  --perf-abs S         Require at least S seconds added (default 0.05)")
 		print("  --perf-show-faster   Also list significantly faster tests")
+		print("  --perf-metric M      Compare M instead of wall clock (cpu, thread_cpu, ctx_invol, ...)")
+		print("  --perf-fail          Exit 1 if any test is slower (CI gate)")
+		print("  --perf-stat mw|bootstrap  Significance test instead of the ratio where samples exist")
+		print("  --perf-alpha A       False discovery rate for --perf-stat (default 0.05)")
+		print("  --perf-history F     Use the durations in history F (file or store directory) as the baseline sample")
+		print("  --perf-host MODE     Different hosts: normalize (calibration ratio, default), strict, ignore")
+		print("  --perf-stats F       Ignore changes within 3 rolling std devs of the test (--snap-stats file F)")
+		print("  --perf-flake F       With --perf-stats, do not gate on tests whose flake score is >= F")
 		print("\nA test is reported as slower only if BOTH thresholds are exceeded.")
+		print("Durations cover setup + call + teardown when the snapshot recorded phases;")
+		print("each slower test names the phase that grew most, followed by per-phase totals.")
 		print("For gating during runs use: --snap-fail-on slower --snap-slower-threshold-ratio ...")
 		print("See README.md Performance sections for deeper explanation.")
 		return 0
 
 	if args.cmd == 'timeline':
 		art = Path(args.artifacts)
-		if not art.exists():
+		store = _open_store(args)
+		records: List[Dict[str, Any]] = []
+		# --perf: durations are appended to compact per-test series as each
+		# snapshot loads, so no per-snapshot duration map is kept around.
+		series: Dict[str, Any] = {}
+		use_snaps = args.perf and not args.history
+		if store is not None:
+			# Counts and outcome transitions come from indexed queries, no file is parsed.
+			for r in store.runs():
+				records.append({'file': os.path.basename(r['file'] or ''), 'label': r['label'], 'created_at': r['created_at'],
+								'git_commit': r['git_commit'], 'total': r['total'], 'failed': r['failed'], 'passed': r['passed'],
+								'xfailed': r['xfailed'], 'xpassed': r['xpassed'], 'other': r['other'], '__run': r['id']})
+			snaps = []
+		elif not art.exists():
 			print('(no artifacts directory)'); return 0
-		snaps = sorted(art.glob('snap_*.json'))
-		if not snaps:
+		else:
+			snaps = _snap_files(art)
+		if not snaps and not records:
 			print('(no snapshots found)'); return 0
-		records = []
-		def load(p: Path):
-			try:
-				return json.load(p.open('r', encoding='utf-8'))
-			except Exception:
-				return None
+		# Header facts, counts and outcome bitmaps of unchanged files come from
+		# the sidecar .index.json; only new or changed snapshots are parsed.
+		# Files that do need parsing are loaded in a --jobs process pool.
+		index = SummaryIndex(art) if snaps else None
+		cached: Dict[Path, Optional[Dict[str, Any]]] = {}
 		for p in snaps:
-			data = load(p)
-			if not data: continue
-			created = data.get('created_at') or ''
-			commit = data.get('git_commit', 'unknown')
-			tests = data.get('tests', [])
-			outcomes = {t.get('id'): t.get('outcome') for t in tests}
-			counts = {
-				'total': len(tests),
-				'failed': sum(1 for o in outcomes.values() if o == 'failed'),
-				'passed': sum(1 for o in outcomes.values() if o == 'passed'),
-				'xfailed': sum(1 for o in outcomes.values() if o in {'xfailed','xfail'}),
-				'xpassed': sum(1 for o in outcomes.values() if o in {'xpassed','xpass'}),
-			}
-			label = p.stem.replace('snap_','',1)
-			records.append({'file': p.name, 'label': label, 'created_at': created, 'git_commit': commit, **counts, 'outcomes': outcomes})
+			try:
+				cached[p] = index.lookup(p)  # type: ignore[union-attr]  # snaps implies an index
+			except OSError:
+				continue
+		todo = [p for p, summary in cached.items() if summary is None or use_snaps]
+		loaded = load_summaries(todo, args.jobs or default_jobs(), durations=use_snaps)
+		for p, summary in cached.items():
+			if summary is None or use_snaps:
+				fresh, durations = next(loaded)
+				if fresh is None: continue
+				if use_snaps and durations is not None:
+					add_run(series, len(records), durations)
+				if summary is None:
+					summary = index.add(p, fresh)  # type: ignore[union-attr]
+			records.append({'file': p.name, 'label': _snap_label(p), 'created_at': summary['created_at'], 'git_commit': summary['git_commit'],
+							**{k: summary[k] for k in SUMMARY_COUNTS}, '__summary': summary, '__pos': len(records)})
+		if index is not None:
+			index.save(p.name for p in snaps)
 		def parse_ts(s: str):
 			try:
 				return datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%SZ')
@@ -531,43 +815,227 @@ def main(argv: Sequence[str] | None = None) -> int:
 			else:
 				print(f"(commit {args.since} not found; showing all)")
 		view = records[start_idx:]
+		runs_meta: List[Dict[str, Any]] = []
+		if use_snaps and store is not None:
+			series = store.duration_series([r['__run'] for r in view])
+			runs_meta = [{'label': r['label'], 'git_commit': r['git_commit'], 'created_at': r['created_at']} for r in view]
+		elif use_snaps:
+			mapping = [-1] * len(records)
+			for i, r in enumerate(view):
+				mapping[r['__pos']] = i
+			if mapping != list(range(len(records))):
+				series = reindex(series, mapping)
+			runs_meta = [{'label': r['label'], 'git_commit': r['git_commit'], 'created_at': r['created_at']} for r in view]
+		elif args.perf:
+			runs_meta, hist_runs = history_runs(load_history(args.history))
+			for pos, durations in enumerate(hist_runs):
+				add_run(series, pos, durations)
+		for r in records:
+			r.pop('__pos', None)
 		timeline = []
 		prev = None
 		for r in view:
-			outcomes = r.pop('outcomes')
 			delta = {'new_fail':0,'fixes':0,'regressions':0}
-			if prev:
-				for tid,out in outcomes.items():
-					po = prev['__outcomes'].get(tid)
-					if po != 'failed' and out == 'failed':
-						delta['new_fail'] += 1
-					if po == 'failed' and out == 'passed':
-						delta['fixes'] += 1
-					if po == 'passed' and out == 'failed':
-						delta['regressions'] += 1
-			entry = {k:v for k,v in r.items() if k != '__outcomes'}
+			if prev and store is not None:
+				delta = store.transitions(r['__run'], prev['__run'])
+			elif prev:
+				delta = summary_transitions(prev['__summary'], r['__summary'])
+			entry = {k:v for k,v in r.items() if not k.startswith('__')}
 			entry.update(delta)
 			timeline.append(entry)
-			r['__outcomes'] = outcomes
 			prev = r
 		if args.limit > 0:
 			timeline = timeline[-args.limit:]
+		shifts: List[Dict[str, Any]] = []
+		if args.perf:
+			for c in detect_shifts(series, ratio=args.perf_ratio, abs_delta=args.perf_abs):
+				meta = runs_meta[c['pos']]
+				shifts.append({'id': c['id'], 'at': meta['label'], 'git_commit': meta['git_commit'], 'created_at': meta['created_at'],
+							   'before': round(c['before'], 6), 'after': round(c['after'], 6), 'ratio': round(c['ratio'], 3)})
 		if args.json:
-			print(json.dumps(timeline, separators=(',',':')))
+			if args.perf:
+				print(json.dumps({'snapshots': timeline, 'shifts': shifts}, separators=(',',':')))
+			else:
+				print(json.dumps(timeline, separators=(',',':')))
 			return 0
 		print(f"TIMELINE ({len(timeline)} snapshots)")
 		for t in timeline:
 			print(f"{t['created_at'] or '?'} {t['label']} commit={t['git_commit']} total={t['total']} fail={t['failed']} new_fail={t['new_fail']} fixes={t['fixes']} regressions={t['regressions']}")
+		if args.perf:
+			source = args.history or f"{len(runs_meta)} snapshots"
+			print(f"\nDURATION SHIFTS: {len(shifts)} ({source}; x{args.perf_ratio} & {args.perf_abs:.3f}s)")
+			lim = len(shifts) if args.top <= 0 else args.top
+			for c in shifts[:lim]:
+				kind = 'SLOWER' if c['ratio'] > 1 else 'FASTER'
+				factor = c['ratio'] if c['ratio'] > 1 else 1 / max(c['ratio'], 1e-9)
+				commit = f" (commit {c['git_commit']})" if c['git_commit'] and c['git_commit'] != 'unknown' else ''
+				print(f"  {kind} x{factor:.2f}: {c['id']} at {c['at']}{commit} {c['before']:.3f}s -> {c['after']:.3f}s")
+			if len(shifts) > lim:
+				print(f"  … ({len(shifts)-lim} more)")
+		return 0
+
+	if args.cmd == 'ingest':
+		art = Path(args.artifacts)
+		if not art.is_dir():
+			print('(no artifacts directory)'); return 0
+		path = args.store or str(art / 'snapshots.db')
+		snaps = _snap_files(art)
+		with SnapStore(path) as store:
+			n = store.sync((_snap_label(p), str(p)) for p in snaps)
+			for bad, reason in store.errors:
+				print(f"(skipped {bad}: {reason})", file=sys.stderr)
+		print(f"Ingested {n} snapshot(s) into {path} ({len(snaps) - n} unchanged or skipped)")
 		return 0
 
 	if args.cmd == 'list':
+		def long_line(name, r):
+			return f"{name} {r['created_at'] or '?'} commit={r['git_commit']} total={r['total']} fail={r['failed']} pass={r['passed']}"
+		store = _open_store(args)
+		if store is not None:
+			named = sorted((os.path.basename(r['file'] or r['label']), r) for r in store.runs())
+			if not named:
+				print('(no snapshots found)'); return 0
+			for name, r in named: print(long_line(name, r) if args.long else name)
+			return 0
 		art = Path(args.artifacts)
 		if not art.exists():
 			print('(no artifacts directory)'); return 0
-		snaps = sorted(art.glob('snap_*.json'))
+		snaps = _snap_files(art)
 		if not snaps:
 			print('(no snapshots found)'); return 0
-		for s in snaps: print(s.name)
+		if not args.long:
+			for s in snaps: print(s.name)
+			return 0
+		list_index = SummaryIndex(art)
+		cached = {}
+		for p in snaps:
+			try:
+				cached[p] = list_index.lookup(p)
+			except OSError:
+				cached[p] = None
+		loaded = load_summaries([p for p, s in cached.items() if s is None], args.jobs or default_jobs())
+		for p, summary in cached.items():
+			if summary is None:
+				fresh, _ = next(loaded)
+				if fresh is None:
+					print(f"{p.name} (unreadable)"); continue
+				summary = list_index.add(p, fresh)
+			print(long_line(p.name, summary))
+		list_index.save(p.name for p in snaps)
+		return 0
+
+	if args.cmd == 'stats':
+		path = Path(args.file or Path(args.artifacts) / 'stats.json')
+		if not path.exists():
+			print(f"Stats file not found: {path} (record with --snap-stats or pytest-snap run)", file=sys.stderr)
+			return 2
+		stats = RollingStats.load(path)
+		rows = stats.rows()
+		lim = None if args.top <= 0 else args.top
+		min_n = max(args.min_samples, 2)
+		varied = sorted((r for r in rows if r['n'] >= min_n), key=lambda r: -r['std'])[:lim]
+		flaky = sorted((r for r in rows if r['flake'] > 0), key=lambda r: -r['flake'])[:lim]
+		if args.json:
+			print(json.dumps({'runs': stats.runs, 'updated_at': stats.updated_at, 'tests': len(rows),
+							  'variance': varied, 'flaky': flaky}, separators=(',', ':')))
+			return 0
+		print(f"STATS {path.name} ({stats.runs} runs, {len(rows)} tests, updated {stats.updated_at or '?'})")
+		print(f"\nHighest duration variance ({len(varied)} shown, n >= {min_n}):")
+		if varied:
+			print(f"  {'std':>9} {'mean':>9} {'min':>9} {'max':>9} {'n':>5}  test")
+		for r in varied:
+			print(f"  {r['std']:>8.3f}s {r['mean']:>8.3f}s {r['min']:>8.3f}s {r['max']:>8.3f}s {r['n']:>5}  {r['id']}")
+		print(f"\nHighest flake scores ({len(flaky)} shown):")
+		for r in flaky:
+			print(f"  {r['flake']:.3f}  last={r['outcome']}  {r['id']}")
+		return 0
+
+	if args.cmd == 'budgets':
+		if not Path(args.budget_file).exists():
+			print(f"Budget file not found: {args.budget_file}", file=sys.stderr)
+			return 2
+		budgets = load_budgets(args.budget_file)
+		matcher = BudgetMatcher(budgets)
+		if args.snapshot:
+			snap = Path(args.snapshot) if Path(args.snapshot).is_file() else _snap_file(Path(args.artifacts), args.snapshot)
+			if not snap.exists():
+				print(f"Snapshot not found: {snap}", file=sys.stderr)
+				return 2
+			durations = duration_index(_load_json(snap))
+			observed: Mapping[str, Any] = {tid: [d] for tid, d in durations.items()}
+			groups: Mapping[str, Any] = {g: [d] for g, d in group_totals(durations).items()}
+			runs, source = 1, snap.name
+		else:
+			paths = args.sketches or [str(Path(args.artifacts) / 'sketches.json')]
+			missing = [p for p in paths if not Path(p).exists()]
+			if missing:
+				print(f"Sketch file not found: {', '.join(missing)} (record with --snap-sketches or pytest-snap run)", file=sys.stderr)
+				return 2
+			sketches = merge_sketch_files(paths)
+			observed, groups, runs = sketches.tests, sketches.groups, sketches.runs
+			source = ', '.join(Path(p).name for p in paths)
+		violations = compute_budget_violations(budgets, observed, groups, matcher=matcher)
+		if args.json:
+			print(json.dumps({'runs': runs, 'budgets': len(budgets), 'violations': violations}, separators=(',', ':')))
+			return 1 if violations else 0
+		checked = len(matcher.match(observed)) + sum(1 for g in matcher.groups if g in groups)
+		print(f"BUDGETS {Path(args.budget_file).name}: {len(budgets)} keys, {checked} tests/groups checked in {source} ({runs} runs)")
+		for v in violations:
+			key = v['quantile']
+			via = f"  (budget {v['budget']})" if 'budget' in v else ''
+			print(f"  {key:<6} {v[f'observed_{key}']:>8.3f}s > budget {v[f'budget_{key}']:.3f}s  {v['id']}{via}")
+		print(f"Violations: {len(violations)}")
+		return 1 if violations else 0
+
+	if args.cmd == 'merge-sketches':
+		merged = merge_sketch_files(args.inputs)
+		merged.save(args.output)
+		print(f"Merged {len(args.inputs)} sketch file(s): {len(merged.tests)} tests, {merged.runs} runs -> {args.output}")
+		return 0
+
+	if args.cmd == 'fixtures':
+		snap = _snap_file(Path(args.artifacts), args.label)
+		if not snap.exists():
+			print(f"Snapshot not found: {snap}", file=sys.stderr)
+			return 2
+		pal = _Palette(_supports_color(args.plain))
+		rows = sorted(normalize_fixtures(_load_json(snap)).values(), key=lambda r: r[args.sort_by], reverse=True)
+		if not rows:
+			print('(no fixture timings in snapshot)'); return 0
+		if args.top > 0:
+			rows = rows[:args.top]
+		print(pal.c('BOLD', pal.c('CYAN', f"FIXTURES {snap.name} (by {args.sort_by})")))
+		print(f"  {'total':>9} {'max':>9} {'mean':>9} {'count':>6}  scope     name")
+		for r in rows:
+			print(f"  {r['total']:>8.3f}s {r['max']:>8.3f}s {r['mean']:>8.4f}s {r['count']:>6}  {str(r['scope']):<9} {r['name']}")
+			if r['tests']:
+				print(pal.c('CYAN', f"      slowest trigger: {r['tests'][0]}"))
+		return 0
+
+	if args.cmd == 'shard':
+		if args.total < 1 or not 1 <= args.index <= args.total:
+			print(f"--index must be within 1..{args.total}", file=sys.stderr)
+			return 2
+		snap = Path(args.label) if Path(args.label).is_file() else _snap_file(Path(args.artifacts), args.label)
+		if not snap.exists():
+			print(f"Snapshot not found: {snap}", file=sys.stderr)
+			return 2
+		durations = duration_index(_load_json(snap))
+		if args.no_collect:
+			nodeids = list(durations)
+		else:
+			collected = collect_nodeids(discover_tests_dir(args.tests), extra_args)
+			if collected is None:
+				print("Collection failed", file=sys.stderr)
+				return 2
+			nodeids = collected
+		shards, loads = plan_shards(nodeids, durations, args.total, by_module=not args.per_test)
+		picked = [nid for nid, s in zip(nodeids, shards) if s == args.index - 1]
+		for nid in picked:
+			print(nid)
+		known = sum(1 for nid in picked if nid in durations)
+		print(f"shard {args.index}/{args.total}: {len(picked)} tests ({len(picked) - known} new), "
+			f"predicted {loads[args.index - 1]:.2f}s, slowest shard {max(loads):.2f}s", file=sys.stderr)
 		return 0
 
 	if args.cmd == 'clean':
@@ -580,24 +1048,25 @@ def main(argv: Sequence[str] | None = None) -> int:
 
 	if args.cmd == 'show':
 		art = Path(args.artifacts)
-		snap = art / f"snap_{args.label}.json"
-		if not snap.exists():
+		snap = _snap_file(art, args.label)
+		store = _open_store(args)
+		data = store.snapshot(args.label) if store is not None else (_load_json(snap) if snap.exists() else None)
+		if data is None:
 			print(f"Snapshot not found: {snap}", file=sys.stderr)
 			return 2
-		data = _load_json(snap)
 		pal = _Palette(_supports_color(args.plain))
-		tests = data.get('tests', [])
+		tests = [t for t in normalize_tests(data) if t.get('id')]
 		total = len(tests)
 		counts = {'passed': 0, 'failed': 0, 'xfailed': 0, 'xpassed': 0, 'skipped': 0, 'other': 0}
 		for t in tests:
-			o = t.get('outcome')
+			o = 'failed' if t.get('outcome') in FAILED_OUTCOMES else t.get('outcome')
 			if o in counts: counts[o] += 1
 			else: counts['other'] += 1
 		header = f"SNAPSHOT {snap.name} (total {total})"
 		print(pal.c('BOLD', pal.c('CYAN', header)))
 		passed = counts['passed']; failed = counts['failed']; xfailed = counts['xfailed']; xpassed = counts['xpassed']; skipped = counts['skipped']
 		print(f"  passed={passed} failed={failed} xfailed={xfailed} xpassed={xpassed} skipped={skipped} other={counts['other']}")
-		fails = [t for t in tests if t.get('outcome') == 'failed']
+		fails = [t for t in tests if t.get('outcome') in FAILED_OUTCOMES]
 		xfs = [t for t in tests if t.get('outcome') == 'xfailed']
 		xps = [t for t in tests if t.get('outcome') == 'xpassed']
 		passes = [t for t in tests if t.get('outcome') == 'passed']
@@ -628,14 +1097,31 @@ def main(argv: Sequence[str] | None = None) -> int:
 		list_block('XFails', xfs, 'YELLOW')
 		list_block('XPASS', xps, 'GREEN')
 		list_block('Passes', passes, 'GREEN', limit=20)
-		with_dur = [t for t in tests if isinstance(t.get('duration'), (int, float))]
-		with_dur.sort(key=lambda t: t.get('duration') or 0, reverse=True)
+		sort_by = args.sort_by
+		with_dur = [(v, t) for v, t in ((metric_value(t, sort_by), t) for t in tests) if v is not None]
+		with_dur.sort(key=lambda vt: vt[0], reverse=True)
 		if with_dur:
 			top_n = min(args.top_slowest, len(with_dur))
-			print(pal.c('CYAN', f"Slowest {top_n} tests:"))
-			for t in with_dur[:args.top_slowest]:
+			title = f"Slowest {top_n} tests:" if sort_by == 'duration' else f"Top {top_n} tests by {sort_by}:"
+			print(pal.c('CYAN', title))
+			for value, t in with_dur[:args.top_slowest]:
 				disp = _shorten(t['id']); disp = _truncate(disp)
-				print(pal.c('CYAN', f"  {t['duration']:.4f}s {disp}"))
+				val = f"{value:.4f}s" if sort_by == 'duration' else format_metric(sort_by, value)
+				print(pal.c('CYAN', f"  {val} {disp}"))
+		elif sort_by != 'duration':
+			print(pal.c('YELLOW', f"(no '{sort_by}' values recorded; run with --snap-resources)"))
+		coll = data.get('collection') or {}
+		if coll.get('total_ns') is not None:
+			files = coll.get('files') or []
+			print(pal.c('CYAN', f"Collection: {coll['total_ns']/1e9:.3f}s over {len(files)} files"))
+			for f in files[:args.top_slowest]:
+				print(pal.c('CYAN', f"  {f['ns']/1e9:.4f}s {_truncate(f['path'])} ({f.get('items', 0)} items)"))
+			imports = coll.get('imports') or []
+			if imports:
+				print(pal.c('CYAN', "Slowest imports during collection (self / cumulative):"))
+				for im in imports[:args.top_slowest]:
+					where = f" <- {im['file']}" if im.get('file') else ''
+					print(pal.c('CYAN', f"  {im['self_ns']/1e9:.4f}s / {im['cumulative_ns']/1e9:.4f}s {im['module']}{where}"))
 		return 0
 
 	return 1
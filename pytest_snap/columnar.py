@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+"""Compact binary columnar snapshot layout (``--snap-format bin``).
+
+Layout (little endian)::
+
+	MAGIC (8 bytes)
+	u32 header length, header JSON  (started_ns, env, fixtures, ..., column names)
+	u32 string count, u32 blob length, NUL-joined UTF-8 string table
+	u32[n] prefix index     node id = strings[prefix] + strings[name]
+	u32[n] name index       (prefix is everything up to and including the last "::")
+	u8[n]  outcome code     index into header["outcomes"]
+	i64[n] per int column   (dur_ns, setup_ns, ...; INT_NONE when absent)
+	u32[n] worker index     (STR_NONE when absent; only if header["worker"])
+
+Node id prefixes (``tests/.../test_x.py::TestY::``) and test names are interned,
+so a quarter million ids cost a few bytes each. :func:`read_columns` decodes
+the columns into ``array`` objects without creating a dict per test; the
+``results`` sequence of :func:`load_columnar` builds dicts only when indexed.
+"""
+
+import json
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .compress import open_binary
+
+MAGIC = b"PSNAPB1\n"
+INT_NONE = -(2 ** 63)
+STR_NONE = 0xFFFFFFFF
+
+_U32 = struct.Struct("<I")
+
+
+def _le(arr: array) -> array:
+	if sys.byteorder != "little":
+		arr = array(arr.typecode, arr)
+		arr.byteswap()
+	return arr
+
+
+def _split_id(nodeid: str) -> tuple:
+	cut = nodeid.rfind("::")
+	if cut < 0:
+		return "", nodeid
+	return nodeid[: cut + 2], nodeid[cut + 2 :]
+
+
+def write_columnar(path: str, snapshot: Dict[str, Any]) -> None:
+	"""Write a plugin-schema snapshot dict (``results`` of flat records)."""
+	results: List[Dict[str, Any]] = snapshot.get("results", [])
+	strings: List[str] = []
+	intern: Dict[str, int] = {}
+
+	def sid(s: str) -> int:
+		i = intern.get(s)
+		if i is None:
+			i = intern[s] = len(strings)
+			strings.append(s)
+		return i
+
+	outcomes: List[str] = []
+	outcome_ix: Dict[str, int] = {}
+	int_cols: List[str] = []
+	has_worker = False
+	extras: Dict[str, Dict[str, Any]] = {}
+	for r in results:
+		for k, v in r.items():
+			if k in {"nodeid", "outcome"}:
+				continue
+			if k == "worker":
+				has_worker = has_worker or v is not None
+			elif isinstance(v, int) and not isinstance(v, bool):
+				if k not in int_cols:
+					int_cols.append(k)
+	prefix = array("I")
+	name = array("I")
+	codes = array("B")
+	cols = {c: array("q") for c in int_cols}
+	workers = array("I")
+	for i, r in enumerate(results):
+		p, n = _split_id(str(r.get("nodeid")))
+		prefix.append(sid(p))
+		name.append(sid(n))
+		o = str(r.get("outcome"))
+		code = outcome_ix.get(o)
+		if code is None:
+			code = outcome_ix[o] = len(outcomes)
+			outcomes.append(o)
+		codes.append(code)
+		for c, col in cols.items():
+			v = r.get(c)
+			col.append(v if isinstance(v, int) and not isinstance(v, bool) else INT_NONE)
+		if has_worker:
+			w = r.get("worker")
+			workers.append(sid(w) if w is not None else STR_NONE)
+		other = {
+			k: v for k, v in r.items()
+			if k not in {"nodeid", "outcome", "worker"} and v is not None
+			and (k not in cols or not isinstance(v, int) or isinstance(v, bool))
+		}
+		if other:
+			extras[str(i)] = other
+	header = {k: v for k, v in snapshot.items() if k != "results"}
+	header.update({"count": len(results), "outcomes": outcomes, "int_columns": int_cols, "worker": has_worker})
+	if extras:
+		header["extras"] = extras
+	hdr = json.dumps(header, separators=(",", ":")).encode("utf-8")
+	blob = "\0".join(strings).encode("utf-8")
+	with open_binary(path, "wb") as f:
+		f.write(MAGIC)
+		f.write(_U32.pack(len(hdr)))
+		f.write(hdr)
+		f.write(_U32.pack(len(strings)))
+		f.write(_U32.pack(len(blob)))
+		f.write(blob)
+		for arr in [prefix, name, codes, *cols.values()] + ([workers] if has_worker else []):
+			f.write(_le(arr).tobytes())
+
+
+class SnapshotColumns:
+	"""Decoded columns of a binary snapshot; all per-test data lives in arrays."""
+
+	def __init__(self, header: Dict[str, Any], strings: List[str], prefix: array, name: array,
+			codes: array, ints: Dict[str, array], workers: Optional[array]):
+		self.header = header
+		self.strings = strings
+		self.prefix = prefix
+		self.name = name
+		self.codes = codes
+		self.ints = ints
+		self.workers = workers
+		self.outcomes: List[str] = header.get("outcomes", [])
+		self._nodeids: Optional[List[str]] = None
+
+	def __len__(self) -> int:
+		return len(self.codes)
+
+	@property
+	def nodeids(self) -> List[str]:
+		if self._nodeids is None:
+			s = self.strings
+			self._nodeids = [s[p] + s[n] for p, n in zip(self.prefix, self.name)]
+		return self._nodeids
+
+	def column(self, name: str) -> Optional[array]:
+		return self.ints.get(name)
+
+	def durations(self) -> Dict[str, int]:
+		"""``nodeid -> dur_ns`` without materializing records."""
+		dur = self.ints.get("dur_ns")
+		if dur is None:
+			return {}
+		return {nid: d for nid, d in zip(self.nodeids, dur) if d != INT_NONE}
+
+	def record(self, i: int) -> Dict[str, Any]:
+		rec: Dict[str, Any] = {"nodeid": self.nodeids[i], "outcome": self.outcomes[self.codes[i]]}
+		for c, col in self.ints.items():
+			v = col[i]
+			if v != INT_NONE:
+				rec[c] = v
+		if self.workers is not None and self.workers[i] != STR_NONE:
+			rec["worker"] = self.strings[self.workers[i]]
+		extra = self.header.get("extras", {}).get(str(i))
+		if extra:
+			rec.update(extra)
+		return rec
+
+
+class ColumnarResults(Sequence):
+	"""Lazy ``results`` list: dicts are only built for the entries accessed."""
+
+	def __init__(self, cols: SnapshotColumns):
+		self.columns = cols
+
+	def __len__(self) -> int:
+		return len(self.columns)
+
+	def __getitem__(self, i):  # type: ignore[override]
+		if isinstance(i, slice):
+			return [self.columns.record(j) for j in range(*i.indices(len(self)))]
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError(i)
+		return self.columns.record(i)
+
+	def __iter__(self) -> Iterator[Dict[str, Any]]:
+		for i in range(len(self)):
+			yield self.columns.record(i)
+
+
+def is_columnar(head: bytes) -> bool:
+	return head[: len(MAGIC)] == MAGIC
+
+
+def read_columns(buf: bytes) -> SnapshotColumns:
+	mv = memoryview(buf)
+	if not is_columnar(bytes(mv[: len(MAGIC)])):
+		raise ValueError("not a binary pytest-snap snapshot")
+	off = len(MAGIC)
+	(hlen,) = _U32.unpack_from(mv, off); off += 4
+	header = json.loads(bytes(mv[off : off + hlen]).decode("utf-8")); off += hlen
+	(nstr,) = _U32.unpack_from(mv, off); off += 4
+	(blen,) = _U32.unpack_from(mv, off); off += 4
+	strings = bytes(mv[off : off + blen]).decode("utf-8").split("\0") if nstr else []
+	off += blen
+	n = int(header.get("count", 0))
+
+	def take(code: str) -> array:
+		nonlocal off
+		arr = array(code)
+		size = arr.itemsize * n
+		arr.frombytes(mv[off : off + size])
+		off += size
+		return _le(arr)
+
+	prefix = take("I")
+	name = take("I")
+	codes = take("B")
+	ints = {c: take("q") for c in header.get("int_columns", [])}
+	workers = take("I") if header.get("worker") else None
+	return SnapshotColumns(header, strings, prefix, name, codes, ints, workers)
+
+
+def load_columnar(buf: bytes) -> Dict[str, Any]:
+	"""Snapshot dict compatible with the JSON layout (lazy ``results``)."""
+	cols = read_columns(buf)
+	data = {k: v for k, v in cols.header.items() if k not in {"count", "outcomes", "int_columns", "worker", "extras"}}
+	data["results"] = ColumnarResults(cols)
+	return data
+
+
+__all__ = [
+	"MAGIC",
+	"SnapshotColumns",
+	"ColumnarResults",
+	"write_columnar",
+	"read_columns",
+	"load_columnar",
+	"is_columnar",
+]
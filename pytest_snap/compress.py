@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+"""Transparent compression for snapshot and history files.
+
+Writers pick the codec from the file name (``.gz``, ``.xz``, ``.zst``);
+readers sniff magic bytes, so a compressed file is read correctly whatever it
+is called. zstd is used when ``compression.zstd`` (Python 3.14+) or the
+``zstandard`` package is importable.
+"""
+
+import gzip
+import io
+import lzma
+import os
+from typing import IO, Optional
+
+SUFFIXES = {".gz": "gzip", ".xz": "xz", ".zst": "zstd"}
+# Snapshot file name suffixes recognised by the CLI, preferred first.
+SNAPSHOT_SUFFIXES = (".json", ".json.gz", ".json.zst", ".json.xz")
+
+_MAGIC = (
+	(b"\x1f\x8b", "gzip"),
+	(b"\xfd7zXZ\x00", "xz"),
+	(b"\x28\xb5\x2f\xfd", "zstd"),
+)
+
+
+def _zstd():
+	try:  # pragma: no cover - Python 3.14+
+		from compression import zstd  # type: ignore[import-not-found]
+		return zstd
+	except ImportError:
+		pass
+	try:  # pragma: no cover - optional dependency
+		import zstandard  # type: ignore[import-not-found]
+		return zstandard
+	except ImportError:
+		return None
+
+
+def zstd_available() -> bool:
+	return _zstd() is not None
+
+
+def codec_for(path: str | os.PathLike) -> Optional[str]:
+	"""Codec implied by the file name (``None`` for plain files)."""
+	return SUFFIXES.get(os.path.splitext(os.fspath(path))[1].lower())
+
+
+def sniff(path: str | os.PathLike) -> Optional[str]:
+	"""Codec detected from the first bytes of an existing file."""
+	with open(path, "rb") as f:
+		head = f.read(6)
+	for magic, codec in _MAGIC:
+		if head.startswith(magic):
+			return codec
+	return None
+
+
+def open_binary(path: str | os.PathLike, mode: str = "rb") -> IO[bytes]:
+	"""Open ``path`` in binary ``mode`` ('rb', 'wb' or 'ab'), (de)compressing as needed."""
+	codec = sniff(path) if "r" in mode else codec_for(path)
+	if codec is None:
+		return open(path, mode)
+	if codec == "gzip":
+		if "r" in mode:
+			return gzip.open(path, mode)  # type: ignore[return-value]
+		# Level 6 rather than 9: writes sit at the end of the test run.
+		return gzip.open(path, mode, compresslevel=6)  # type: ignore[return-value]
+	if codec == "xz":
+		return lzma.open(path, mode)  # type: ignore[return-value]
+	zstd = _zstd()
+	if zstd is None:
+		raise ImportError(f"{path}: zstd compression needs the 'zstandard' package (or Python 3.14+)")
+	fh = zstd.open(path, mode)
+	if "r" in mode and not hasattr(fh, "peek"):
+		fh = io.BufferedReader(fh)
+	return fh
+
+
+def open_text(path: str | os.PathLike, mode: str = "r", *, line_buffering: bool = False) -> IO[str]:
+	"""Text-mode counterpart of :func:`open_binary` (UTF-8)."""
+	bmode = mode.replace("t", "")[0] + "b"
+	plain = sniff(path) is None if bmode == "rb" else codec_for(path) is None
+	if plain:
+		return open(path, bmode[0], encoding="utf-8", buffering=1 if line_buffering else -1)
+	return io.TextIOWrapper(open_binary(path, bmode), encoding="utf-8", line_buffering=line_buffering)
+
+
+__all__ = [
+	"SUFFIXES",
+	"SNAPSHOT_SUFFIXES",
+	"codec_for",
+	"sniff",
+	"open_binary",
+	"open_text",
+	"zstd_available",
+]
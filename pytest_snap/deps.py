@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+"""Per-test source dependency index (``--snap-record-deps``).
+
+While a test runs (setup, call and teardown) :class:`DepTracer` records which
+project source files had code executed: with ``sys.monitoring`` on Python
+3.12+ (each function reports once per test and is then disabled, so the cost
+is close to zero) or a ``sys.settrace`` call hook on older versions.
+
+Module level code runs once, at import time, so executed functions alone miss
+a test that only reads a constant from another module. The tracer therefore
+also wraps ``builtins.__import__`` for the session and keeps a graph of which
+project file imports which project modules (``import`` statements report even
+when the module is already loaded). A test depends on its executed files plus
+everything they import, transitively.
+
+The index maps node ids to those files (paths relative to the rootdir) and is
+stored compactly with every file name interned::
+
+	{"version": 1, "files": ["src/app.py", "tests/test_app.py"],
+	 "tests": {"tests/test_app.py::test_x": [0, 1]}}
+
+Runs update the entries of the tests they executed and keep the rest, so a
+partial run (``-k``, a shard, an affected-only run) refreshes the index
+incrementally. :func:`select_affected` uses it with ``git diff`` to keep
+only tests whose dependencies changed (``--snap-affected-since``).
+
+Non-Python files are not tracked, nor modules loaded with
+``importlib.import_module``; changes to ``conftest.py`` or to pytest /
+packaging configuration select every test.
+"""
+
+import builtins
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, Iterable, List, Optional, Set
+
+from .compress import open_text
+
+DEPS_VERSION = 1
+# Changing any of these can affect every test.
+ALWAYS_AFFECTS = frozenset({"conftest.py", "pytest.ini", "pyproject.toml", "setup.cfg", "setup.py", "tox.ini"})
+_EXCLUDED_DIRS = frozenset({"site-packages", "dist-packages", ".venv", "venv", ".tox", ".nox", "node_modules"})
+_TOOL_NAME = "pytest-snap"
+
+
+class DepTracer:
+	"""Collects the project files executed between :meth:`start` and :meth:`stop`.
+
+	Import edges are recorded from construction until :meth:`close`, so create
+	the tracer before collection imports the test modules.
+	"""
+
+	def __init__(self, root: str):
+		self.root = os.path.normcase(os.path.abspath(root)) + os.sep
+		self.files: Set[str] = set()
+		self.imports: Dict[str, Set[str]] = {}  # importing file -> imported project files
+		self._paths: Dict[str, Optional[str]] = {}  # co_filename -> relative path (None: not ours)
+		self._mon = getattr(sys, "monitoring", None)
+		self._tool: Optional[int] = None
+		self._prev_trace = None
+		self._orig_import = builtins.__import__
+		builtins.__import__ = self._import
+
+	def _project_path(self, filename: str) -> Optional[str]:
+		try:
+			return self._paths[filename]
+		except KeyError:
+			pass
+		path = os.path.normcase(os.path.abspath(filename))
+		rel = None
+		if path.startswith(self.root) and path.endswith(".py"):
+			parts = path[len(self.root):].split(os.sep)
+			if not _EXCLUDED_DIRS.intersection(parts):
+				rel = "/".join(parts)
+		self._paths[filename] = rel
+		return rel
+
+	def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+		module = self._orig_import(name, globals, locals, fromlist, level)
+		importer = globals.get("__file__") if globals else None
+		src = self._project_path(importer) if isinstance(importer, str) else None
+		if src is not None:
+			try:
+				self._add_edges(src, name, globals, fromlist, level)  # type: ignore[arg-type]
+			except (ImportError, ValueError):  # unresolvable relative import: nothing to record
+				pass
+		return module
+
+	def _add_edges(self, src: str, name: str, globals: Dict[str, object], fromlist, level: int) -> None:
+		if level:
+			package = globals.get("__package__") or str(globals.get("__name__", "")).rpartition(".")[0]
+			name = importlib.util.resolve_name("." * level + name, package)  # type: ignore[arg-type]
+		parts = name.split(".")
+		names = [".".join(parts[:i]) for i in range(1, len(parts) + 1)]
+		names += [f"{name}.{attr}" for attr in fromlist or () if attr != "*"]
+		edges = self.imports.setdefault(src, set())
+		for n in names:
+			filename = getattr(sys.modules.get(n), "__file__", None)
+			rel = self._project_path(filename) if isinstance(filename, str) else None
+			if rel is not None and rel != src:
+				edges.add(rel)
+
+	def _with_imports(self, files: Set[str]) -> Set[str]:
+		out = set(files)
+		todo = list(files)
+		while todo:
+			for dep in self.imports.get(todo.pop(), ()):
+				if dep not in out:
+					out.add(dep)
+					todo.append(dep)
+		return out
+
+	# sys.monitoring (3.12+)
+	def _on_start(self, code, offset):  # pragma: no cover - Python 3.12+
+		rel = self._project_path(code.co_filename)
+		if rel is not None:
+			self.files.add(rel)
+		return self._mon.DISABLE  # type: ignore[union-attr]
+
+	def _claim_tool(self) -> Optional[int]:  # pragma: no cover - Python 3.12+
+		mon = self._mon
+		for tool in (3, 4, mon.PROFILER_ID, mon.OPTIMIZER_ID):  # type: ignore[union-attr]
+			if mon.get_tool(tool) is None:  # type: ignore[union-attr]
+				mon.use_tool_id(tool, _TOOL_NAME)  # type: ignore[union-attr]
+				mon.register_callback(tool, mon.events.PY_START, self._on_start)  # type: ignore[union-attr]
+				return tool
+		return None
+
+	# sys.settrace fallback: only "call" events, no per-line tracing.
+	def _trace(self, frame, event, arg):
+		if event == "call":
+			rel = self._project_path(frame.f_code.co_filename)
+			if rel is not None:
+				self.files.add(rel)
+		return None
+
+	def start(self) -> None:
+		self.files = set()
+		if self._mon is not None:  # pragma: no cover - Python 3.12+
+			if self._tool is None:
+				self._tool = self._claim_tool()
+			if self._tool is not None:
+				self._mon.set_events(self._tool, self._mon.events.PY_START)
+				# Re-arm code objects disabled during the previous test.
+				self._mon.restart_events()
+				return
+		self._prev_trace = sys.gettrace()
+		sys.settrace(self._trace)
+
+	def stop(self) -> Set[str]:
+		"""Files executed since :meth:`start` and the project modules they import."""
+		if self._tool is not None:  # pragma: no cover - Python 3.12+
+			self._mon.set_events(self._tool, 0)  # type: ignore[union-attr]
+		elif sys.gettrace() == self._trace:
+			sys.settrace(self._prev_trace)
+			self._prev_trace = None
+		return self._with_imports(self.files)
+
+	def close(self) -> None:
+		if builtins.__import__ == self._import:
+			builtins.__import__ = self._orig_import
+		if self._tool is not None:  # pragma: no cover - Python 3.12+
+			mon = self._mon
+			mon.set_events(self._tool, 0)  # type: ignore[union-attr]
+			mon.register_callback(self._tool, mon.events.PY_START, None)  # type: ignore[union-attr]
+			mon.free_tool_id(self._tool)  # type: ignore[union-attr]
+			self._tool = None
+
+
+class DepIndex:
+	"""``nodeid -> [relative file paths]`` persisted with interned file names."""
+
+	def __init__(self, tests: Optional[Dict[str, List[str]]] = None):
+		self.tests: Dict[str, List[str]] = tests or {}
+
+	@classmethod
+	def load(cls, path: str) -> "DepIndex":
+		if not os.path.exists(path):
+			return cls()
+		with open_text(path, "r") as f:
+			data = json.load(f)
+		if data.get("version") != DEPS_VERSION:
+			return cls()
+		files: List[str] = data.get("files", [])
+		return cls({nid: [files[i] for i in ix] for nid, ix in data.get("tests", {}).items()})
+
+	def update(self, deps: Dict[str, Iterable[str]]) -> None:
+		for nodeid, files in deps.items():
+			self.tests[nodeid] = sorted(files)
+
+	def save(self, path: str) -> None:
+		files: List[str] = []
+		ids: Dict[str, int] = {}
+		tests: Dict[str, List[int]] = {}
+		for nodeid in sorted(self.tests):
+			row = []
+			for f in self.tests[nodeid]:
+				i = ids.get(f)
+				if i is None:
+					i = ids[f] = len(files)
+					files.append(f)
+				row.append(i)
+			tests[nodeid] = row
+		os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		# Write then rename: an interrupted run never leaves a torn index.
+		tmp = f"{path}.tmp{os.getpid()}"
+		with open_text(tmp, "w") as f:
+			json.dump({"version": DEPS_VERSION, "files": files, "tests": tests}, f, separators=(",", ":"))
+		os.replace(tmp, path)
+
+
+def changed_files(root: str, rev: str) -> Set[str]:
+	"""Paths (relative to ``root``) changed since ``rev``, including uncommitted and untracked files.
+
+	Raises ``OSError`` / ``subprocess.CalledProcessError`` when git is unavailable or ``rev`` is unknown.
+	"""
+	def git(*args: str) -> List[str]:
+		proc = subprocess.run(["git", "-C", root, *args], capture_output=True, text=True, check=True)
+		return proc.stdout.splitlines()
+
+	changed = set(git("diff", "--name-only", "--relative", rev))
+	changed.update(git("ls-files", "--others", "--exclude-standard"))
+	return {p.strip() for p in changed if p.strip()}
+
+
+def select_affected(nodeids: Iterable[str], index: DepIndex, changed: Set[str]) -> List[bool]:
+	"""Whether each test must run: its file or a recorded dependency changed, or it was never recorded.
+
+	Recorded dependencies include imported project modules, so a changed
+	constant or other module level code selects the tests importing it.
+	"""
+	nodeids = list(nodeids)
+	if any(os.path.basename(p) in ALWAYS_AFFECTS for p in changed):
+		return [True] * len(nodeids)
+	out = []
+	for nid in nodeids:
+		deps = index.tests.get(nid)
+		if deps is None:
+			out.append(True)
+			continue
+		out.append(nid.split("::", 1)[0] in changed or not changed.isdisjoint(deps))
+	return out
+
+
+__all__ = [
+	"DepTracer",
+	"DepIndex",
+	"changed_files",
+	"select_affected",
+	"ALWAYS_AFFECTS",
+	"DEPS_VERSION",
+]
@@ -4,6 +4,10 @@ from __future__ import annotations
 
 from typing import Dict, Iterable, List, Optional, Tuple
 
+from .hostinfo import host_scale, scale_rows
+from .snapio import FAILED_OUTCOMES, PHASES, noise_floor, normalize_tests, phase_deltas, total_duration
+from .stats import compare, pair_samples
+
 ImpactTuple = Tuple[int, str]  # (score, id)
 
 
@@ -11,6 +15,36 @@ def build_index(tests: Iterable[dict]) -> Dict[str, dict]:
     return {t["id"]: t for t in tests}
 
 
+def _phase_attribution(btest: dict, ctest: dict) -> dict:
+    """Name the phase (setup/call/teardown) that contributed most of a slowdown."""
+    deltas = phase_deltas(btest, ctest)
+    if not deltas:
+        return {}
+    phase = max(deltas, key=lambda ph: deltas[ph])
+    return {"phase": phase, "phase_deltas": {ph: round(d, 6) for ph, d in deltas.items()}}
+
+
+def _phase_totals(b_index: Dict[str, dict], c_index: Dict[str, dict]) -> Dict[str, dict]:
+    # Summed per-phase time over tests present in both snapshots; a session
+    # fixture that got slower shows up here even when spread over many tests.
+    totals: Dict[str, dict] = {}
+    for ph in PHASES:
+        prev = curr = 0.0
+        seen = False
+        for tid, ctest in c_index.items():
+            btest = b_index.get(tid)
+            if btest is None:
+                continue
+            a, b = btest.get(ph), ctest.get(ph)
+            if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+                prev += a
+                curr += b
+                seen = True
+        if seen:
+            totals[ph] = {"prev": round(prev, 6), "curr": round(curr, 6), "abs_delta": round(curr - prev, 6)}
+    return totals
+
+
 def diff_snapshots(
     baseline: dict | None,
     current: dict,
@@ -21,9 +55,30 @@ def diff_snapshots(
     flake_threshold: float = 1.0,
     min_count: int = 0,
     budgets: Optional[List[dict]] = None,
+    stat: Optional[str] = None,
+    alpha: float = 0.05,
+    history: Optional[Dict[str, List[float]]] = None,
+    host: str = "normalize",
 ) -> dict:
-    b_index = build_index(baseline.get("tests", [])) if baseline else {}
-    c_index = build_index(current.get("tests", []))
+    """Outcome and timing changes from ``baseline`` to ``current``.
+
+    With ``stat`` ("mw" or "bootstrap", see :mod:`pytest_snap.stats`) tests
+    that have samples on both sides (``--snap-repeat`` samples, or ``history``
+    durations as the baseline) count as slower when significant after
+    Benjamini-Hochberg at ``alpha`` and at least ``slower_abs`` slower; other
+    tests keep the ratio / absolute thresholds.
+
+    When the snapshots' ``env`` shows different hosts, ``host="normalize"``
+    divides the current timings by the calibration ratio (reported as
+    ``host``), ``"strict"`` raises :class:`~pytest_snap.hostinfo.IncomparableHosts`
+    and ``"ignore"`` compares raw timings.
+    """
+    b_index = build_index(t for t in normalize_tests(baseline) if t.get("id"))
+    c_index = build_index(t for t in normalize_tests(current) if t.get("id"))
+    host_info = host_scale((baseline or {}).get("env"), (current or {}).get("env"), host)
+    if host_info["scale"]:
+        c_index = scale_rows(c_index, host_info["scale"])
+    stat_rows = compare(pair_samples(b_index, c_index, history), stat, alpha=alpha) if stat else {}
 
     new_failures = []
     new_passes = []  # brand new tests that are passing
@@ -42,7 +97,7 @@ def diff_snapshots(
         btest = b_index.get(cid)
         cout = ctest.get("outcome")
         if btest is None:
-            if cout == "failed":
+            if cout in FAILED_OUTCOMES:
                 new_failures.append({"id": cid, "outcome": cout})
             elif cout == "passed":
                 new_passes.append({"id": cid, "outcome": cout, "duration": ctest.get("duration")})
@@ -50,7 +105,7 @@ def diff_snapshots(
                 new_xfails.append({"id": cid, "outcome": cout})
             continue
         bout = btest.get("outcome")
-        if cout == "failed" and bout not in {"failed", "xfail"}:
+        if cout in FAILED_OUTCOMES and bout not in FAILED_OUTCOMES and bout != "xfail":
             new_failures.append({"id": cid, "from": bout, "to": cout, "sig": ctest.get("sig"), "duration": ctest.get("duration")})
         if cout in {"xfailed", "xfail"} and bout not in {"xfailed", "xfail"}:
             new_xfails.append({"id": cid, "from": bout, "to": cout})
@@ -60,28 +115,40 @@ def diff_snapshots(
             persistent_xfails.append({"id": cid})
         if cout == "xpassed":
             xpassed.append({"id": cid, "from": bout, "to": cout})
-        if (bout != cout) and {bout, cout} & {"failed", "passed", "xfailed", "xpassed", "xfail", "xpass"}:
+        if (bout != cout) and {bout, cout} & (FAILED_OUTCOMES | {"passed", "xfailed", "xpassed", "xfail", "xpass"}):
             fs = flake_scores.get(cid, 0.0) if flake_scores else 0.0
             flaky_suspects.append({"id": cid, "from": bout, "to": cout, "flake_score": round(fs, 4)})
-        try:
-            d0 = float(btest.get("duration", 0.0))
-            d1 = float(ctest.get("duration", 0.0))
-        except Exception:
-            d0 = d1 = 0.0
-        if d0 > 0 and d1 >= max(d0 * slower_ratio, d0 + slower_abs):
+        # Whole-test wall clock (setup + call + teardown when phases were captured);
+        # with --snap-repeat samples the call part is the median and the change
+        # must also clear the MAD noise floor.
+        d0 = total_duration(btest) or 0.0
+        d1 = total_duration(ctest) or 0.0
+        noise = noise_floor(btest, ctest)
+        st = stat_rows.get(cid)
+        if st is not None:
+            is_slower = bool(st["slower"]) and st["delta"] >= slower_abs
+        else:
+            is_slower = d0 > 0 and d1 >= max(d0 * slower_ratio, d0 + slower_abs) and d1 - d0 > noise
+        if is_slower:
             ratio = (d1 / d0) if d0 else 0.0
-            slower_tests.append({"id": cid, "prev": round(d0, 6), "curr": round(d1, 6), "ratio": round(ratio, 3), "abs_delta": round(d1 - d0, 6)})
+            rec = {"id": cid, "prev": round(d0, 6), "curr": round(d1, 6), "ratio": round(ratio, 3), "abs_delta": round(d1 - d0, 6)}
+            if st is not None:
+                rec.update({"stat": stat, "p": st["p"], "q": st["q"], "effect": round(st["effect"], 6)})
+            elif noise:
+                rec["noise"] = round(noise, 6)
+            rec.update(_phase_attribution(btest, ctest))
+            slower_tests.append(rec)
 
     for bid, btest in b_index.items():
         if bid not in c_index:
-            if btest.get("outcome") == "failed":
+            if btest.get("outcome") in FAILED_OUTCOMES:
                 rec = {"id": bid, "sig": btest.get("sig")}
                 vanished_failures.append(rec)
                 removed_failures.append(rec)
         else:
             bout = btest.get("outcome")
             cout = c_index[bid].get("outcome")
-            if bout == "failed" and cout not in {"failed", "xfail"}:
+            if bout in FAILED_OUTCOMES and cout not in FAILED_OUTCOMES and cout != "xfail":
                 rec = {"id": bid, "sig": btest.get("sig")}
                 vanished_failures.append(rec)
                 fixed_failures.append(rec)
@@ -131,6 +198,11 @@ def diff_snapshots(
         "summary": summary,
         "impact_score": impact,
     }
+    phase_totals = _phase_totals(b_index, c_index)
+    if phase_totals:
+        result["phase_totals"] = phase_totals
+    if host_info["differences"]:
+        result["host"] = host_info
     return result
 
 __all__ = ["diff_snapshots", "build_index"]
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+"""Segmented rolling history store (``--snap-history DIR/``).
+
+A single ``history.jsonl`` has to be re-read and rewritten on every append to
+keep only the last runs, and read whole to get the latest ones. A history
+directory instead holds fixed-size JSONL segments and a small manifest::
+
+	history/
+	  manifest.json       {"version": 1, "segment_bytes": 4194304, "next": 4,
+	                       "segments": [{"name": "00000002.jsonl", "runs": 17, "bytes": 3981120},
+	                                    {"name": "00000003.jsonl", "runs": 5, "bytes": 1170950}]}
+	  00000002.jsonl      one run record per line (``baseline.append_history``)
+	  00000003.jsonl
+	  .lock
+
+* append writes one line to the newest segment and rewrites the manifest;
+  its cost does not depend on how much history exists;
+* retention drops whole oldest segments once the remaining ones still hold
+  ``max_runs`` runs (so between ``max_runs`` and ``max_runs`` plus one
+  segment's worth are kept);
+* :meth:`HistoryStore.reverse` memory-maps segments newest first and walks
+  lines backwards, so "last N runs" never touches older data.
+
+Only the manifest's ``bytes`` of each segment count: a line an interrupted
+append left behind is ignored by readers and cut off by the next append.
+Appends take an exclusive ``fcntl`` lock on ``.lock`` and readers a shared
+one, so xdist workers or parallel CI jobs on one machine can share a store
+(no locking where ``fcntl`` is unavailable).
+"""
+
+import contextlib
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterable, Iterator, List, Optional
+
+try:
+	import fcntl
+except ImportError:  # pragma: no cover - Windows
+	fcntl = None  # type: ignore[assignment]
+
+HISTORY_STORE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = ".lock"
+SEGMENT_BYTES = 4 * 1024 * 1024
+
+
+@contextlib.contextmanager
+def file_lock(path: str | os.PathLike, *, exclusive: bool) -> Iterator[None]:
+	"""``fcntl.flock`` on ``path`` (created if needed) for the duration of the block.
+
+	Without ``fcntl`` or when the lock file cannot be created (read-only
+	directory) the block runs unlocked.
+	"""
+	try:
+		fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+	except OSError:
+		yield
+		return
+	try:
+		if fcntl is not None:
+			fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+		yield
+	finally:
+		os.close(fd)  # releases the lock
+
+
+def is_history_store(path: str | os.PathLike) -> bool:
+	"""A history path names a segmented store when it ends with a separator or is a directory."""
+	text = os.fspath(path)
+	return text.endswith(("/", os.sep)) or os.path.isdir(text)
+
+
+class HistoryStore:
+	def __init__(self, path: str | os.PathLike, *, segment_bytes: int = SEGMENT_BYTES):
+		self.path = Path(path)
+		self.segment_bytes = segment_bytes
+
+	def _locked(self, exclusive: bool):
+		return file_lock(self.path / LOCK_NAME, exclusive=exclusive)
+
+	def _manifest(self) -> Dict[str, Any]:
+		try:
+			m = json.loads((self.path / MANIFEST_NAME).read_text(encoding="utf-8"))
+		except (OSError, ValueError):
+			m = None
+		if not isinstance(m, dict) or m.get("version") != HISTORY_STORE_VERSION:
+			return {"version": HISTORY_STORE_VERSION, "segment_bytes": self.segment_bytes, "next": 1, "segments": []}
+		return m
+
+	def _write_manifest(self, m: Dict[str, Any]) -> None:
+		tmp = self.path / f"{MANIFEST_NAME}.{os.getpid()}.tmp"
+		tmp.write_text(json.dumps(m, separators=(",", ":")), encoding="utf-8")
+		os.replace(tmp, self.path / MANIFEST_NAME)
+
+	def append(self, entry: Dict[str, Any], *, max_runs: Optional[int] = None) -> None:
+		"""Append one run record; with ``max_runs`` drop whole segments no longer needed to keep that many."""
+		self.extend([entry], max_runs=max_runs)
+
+	def extend(self, entries: Iterable[Dict[str, Any]], *, max_runs: Optional[int] = None) -> None:
+		self.path.mkdir(parents=True, exist_ok=True)
+		with self._locked(exclusive=True):
+			m = self._manifest()
+			segments: List[Dict[str, Any]] = m["segments"]
+			limit = int(m.get("segment_bytes") or self.segment_bytes)
+			f = None
+			try:
+				for entry in entries:
+					line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+					if not segments or segments[-1]["bytes"] >= limit:
+						if f is not None:
+							f.close()
+							f = None
+						segments.append({"name": f"{m['next']:08d}.jsonl", "runs": 0, "bytes": 0})
+						m["next"] += 1
+					seg = segments[-1]
+					if f is None:
+						f = open(self.path / seg["name"], "ab")
+						size = f.tell()
+						if size > seg["bytes"]:  # left over from an interrupted append
+							f.truncate(seg["bytes"])
+						elif size < seg["bytes"]:  # segment lost data: trust the file
+							seg["bytes"] = size
+					f.write(line)
+					seg["bytes"] += len(line)
+					seg["runs"] += 1
+			finally:
+				if f is not None:
+					f.close()
+			dropped = []
+			if max_runs is not None:
+				total = sum(s["runs"] for s in segments)
+				while len(segments) > 1 and total - segments[0]["runs"] >= max_runs:
+					total -= segments[0]["runs"]
+					dropped.append(segments.pop(0))
+			self._write_manifest(m)
+			for seg in dropped:
+				with contextlib.suppress(OSError):
+					os.unlink(self.path / seg["name"])
+
+	def _segment_reversed(self, seg: Dict[str, Any]) -> Iterator[dict]:
+		try:
+			f = open(self.path / seg["name"], "rb")
+		except OSError:
+			return
+		with f:
+			end = min(int(seg["bytes"]), os.fstat(f.fileno()).st_size)
+			if end <= 0:
+				return
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+				while end > 0:
+					start = mm.rfind(b"\n", 0, end - 1) + 1
+					try:
+						run = json.loads(mm[start:end])
+					except ValueError:
+						run = None
+					if isinstance(run, dict):
+						yield run
+					end = start
+
+	def reverse(self) -> Generator[dict, None, None]:
+		"""Run records newest first; older segments are only mapped once reached."""
+		if not self.path.is_dir():
+			return
+		with self._locked(exclusive=False):
+			segments = list(self._manifest()["segments"])
+			for seg in reversed(segments):
+				yield from self._segment_reversed(seg)
+
+	def last(self, n: int) -> List[dict]:
+		"""The latest ``n`` runs, oldest first."""
+		out: List[dict] = []
+		if n <= 0:
+			return out
+		with contextlib.closing(self.reverse()) as runs:  # releases the read lock on break
+			for run in runs:
+				out.append(run)
+				if len(out) >= n:
+					break
+		out.reverse()
+		return out
+
+	def runs(self) -> List[dict]:
+		"""Every retained run, oldest first."""
+		out = list(self.reverse())
+		out.reverse()
+		return out
+
+	def __len__(self) -> int:
+		with self._locked(exclusive=False):
+			return sum(s["runs"] for s in self._manifest()["segments"]) if self.path.is_dir() else 0
+
+
+__all__ = ["HistoryStore", "is_history_store", "file_lock", "SEGMENT_BYTES", "HISTORY_STORE_VERSION"]
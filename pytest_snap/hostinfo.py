@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+"""Host facts and machine speed calibration (snapshot ``env``).
+
+At session start the plugin records what the run executed on and how fast
+that machine runs a fixed pure-Python workload::
+
+	"env": {"pytest_version": "...",
+	        "host": {"cpu_model": "...", "cpu_count": 8, "cpus_available": 8, "cpu_quota": 2.0,
+	                 "machine": "x86_64", "system": "Linux", "implementation": "CPython",
+	                 "python": "3.11.7", "python_build": "main Dec  8 2023 ..."},
+	        "calibration": {"version": 1, "ns": 3200000, "reps": 5}}
+
+``calibration.ns`` is the fastest of ``reps`` timings of the workload, so it
+tracks single-core interpreter speed (CPU generation, clock, Python build)
+and not how busy the machine was. ``cpu_quota`` is the cgroup CPU limit in
+cores (``None`` when unlimited or unknown).
+
+:func:`compare_hosts` tells whether two snapshots come from the same kind of
+host and, when they do not, the calibration ratio that puts the second
+snapshot's durations on the first one's scale.
+"""
+
+import os
+import platform
+import time
+from typing import Any, Dict, List, Optional
+
+CALIBRATION_VERSION = 1
+CALIBRATION_REPS = 5
+HOST_MODES = ("normalize", "strict", "ignore")
+# Facts that must match for raw durations to be comparable.
+HOST_KEYS = ("cpu_model", "machine", "implementation", "python", "cpus_available", "cpu_quota")
+# Normalized-row fields holding seconds of CPU-bound time (see ``snapio.normalize_tests``).
+TIME_FIELDS = ("duration", "setup", "call", "teardown", "call_min", "call_mad", "cpu_user", "cpu_sys", "thread_cpu")
+
+
+class IncomparableHosts(ValueError):
+	"""Raised in ``strict`` mode when two snapshots come from different hosts."""
+
+	def __init__(self, differences: List[str]):
+		super().__init__("snapshots come from different hosts: " + "; ".join(differences))
+		self.differences = differences
+
+
+def _cpu_model() -> Optional[str]:
+	try:
+		with open("/proc/cpuinfo", encoding="utf-8", errors="replace") as f:
+			for line in f:
+				key, _, value = line.partition(":")
+				if key.strip() in {"model name", "Model", "Hardware", "cpu model"}:
+					return value.strip()
+	except OSError:
+		pass
+	return platform.processor() or None
+
+
+def _cpu_quota() -> Optional[float]:
+	# cgroup v2: "<quota> <period>" or "max <period>"
+	try:
+		with open("/sys/fs/cgroup/cpu.max", encoding="utf-8") as f:
+			quota, period = f.read().split()[:2]
+		return None if quota == "max" else round(int(quota) / int(period), 3)
+	except (OSError, ValueError):
+		pass
+	# cgroup v1
+	try:
+		with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", encoding="utf-8") as f:
+			quota_us = int(f.read())
+		with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", encoding="utf-8") as f:
+			period_us = int(f.read())
+		return None if quota_us <= 0 else round(quota_us / period_us, 3)
+	except (OSError, ValueError):
+		return None
+
+
+def host_facts() -> Dict[str, Any]:
+	sched_getaffinity = getattr(os, "sched_getaffinity", None)
+	return {
+		"cpu_model": _cpu_model(),
+		"cpu_count": os.cpu_count(),
+		"cpus_available": len(sched_getaffinity(0)) if sched_getaffinity else os.cpu_count(),
+		"cpu_quota": _cpu_quota(),
+		"machine": platform.machine(),
+		"system": platform.system(),
+		"implementation": platform.python_implementation(),
+		"python": platform.python_version(),
+		"python_build": " ".join(platform.python_build()),
+	}
+
+
+def _workload() -> int:
+	# Integer arithmetic, dict and list traffic, string formatting: the mix
+	# a typical test spends its interpreter time on. Never change it without
+	# bumping CALIBRATION_VERSION.
+	acc = 0
+	table: Dict[int, int] = {}
+	for i in range(10000):
+		acc = (acc * 31 + i) & 0xFFFFFFFF
+		table[acc & 1023] = i
+	items = sorted(table.items())
+	return len("".join(f"{k}:{v}" for k, v in items)) + acc
+
+
+def calibrate(reps: int = CALIBRATION_REPS) -> Dict[str, int]:
+	"""Fastest of ``reps`` timings of the fixed workload (a few ms each; ~20 ms in total)."""
+	_workload()  # warm-up
+	best = None
+	for _ in range(reps):
+		t0 = time.perf_counter_ns()
+		_workload()
+		dt = time.perf_counter_ns() - t0
+		best = dt if best is None else min(best, dt)
+	return {"version": CALIBRATION_VERSION, "ns": int(best or 0), "reps": reps}
+
+
+def _fact(host: Dict[str, Any], key: str) -> Any:
+	value = host.get(key)
+	if key == "python" and isinstance(value, str):
+		return ".".join(value.split(".")[:2])  # patch releases do not change speed
+	return value
+
+
+def compare_hosts(env_a: Optional[dict], env_b: Optional[dict]) -> Dict[str, Any]:
+	"""``{"differences": [...], "scale": float | None}`` for snapshot ``env`` a -> b.
+
+	``differences`` lists host facts that differ (empty when either snapshot
+	predates host facts). ``scale`` is b's calibration time over a's: dividing
+	b's durations by it expresses them on a's host. It is only set when the
+	hosts differ and both were calibrated with the same workload.
+	"""
+	host_a = (env_a or {}).get("host") or {}
+	host_b = (env_b or {}).get("host") or {}
+	differences: List[str] = []
+	if host_a and host_b:
+		for key in HOST_KEYS:
+			fa, fb = _fact(host_a, key), _fact(host_b, key)
+			if fa != fb:
+				differences.append(f"{key}: {fa} -> {fb}")
+	scale = None
+	cal_a = (env_a or {}).get("calibration") or {}
+	cal_b = (env_b or {}).get("calibration") or {}
+	if differences and cal_a.get("version") == cal_b.get("version") and cal_a.get("ns") and cal_b.get("ns"):
+		scale = cal_b["ns"] / cal_a["ns"]
+	return {"differences": differences, "scale": scale}
+
+
+def host_scale(env_a: Optional[dict], env_b: Optional[dict], mode: str) -> Dict[str, Any]:
+	""":func:`compare_hosts` applied per ``mode`` (one of ``HOST_MODES``).
+
+	``normalize`` keeps the calibration scale, ``ignore`` drops it and
+	``strict`` raises :class:`IncomparableHosts` when the hosts differ.
+	"""
+	if mode not in HOST_MODES:
+		raise ValueError(f"unknown host mode {mode!r}; expected one of {HOST_MODES}")
+	info = compare_hosts(env_a, env_b)
+	if info["differences"] and mode == "strict":
+		raise IncomparableHosts(info["differences"])
+	if mode == "ignore":
+		info["scale"] = None
+	return info
+
+
+def scale_rows(index: Dict[str, Dict[str, Any]], factor: float) -> Dict[str, Dict[str, Any]]:
+	"""Copy of normalized rows with timing fields divided by ``factor``."""
+	out = {}
+	for tid, row in index.items():
+		row = dict(row)
+		for key in TIME_FIELDS:
+			v = row.get(key)
+			if isinstance(v, (int, float)) and not isinstance(v, bool):
+				row[key] = v / factor
+		samples = row.get("call_samples_ns")
+		if isinstance(samples, list):
+			row["call_samples_ns"] = [v / factor for v in samples]
+		out[tid] = row
+	return out
+
+
+__all__ = [
+	"host_facts",
+	"calibrate",
+	"compare_hosts",
+	"host_scale",
+	"scale_rows",
+	"IncomparableHosts",
+	"HOST_MODES",
+	"CALIBRATION_VERSION",
+]
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+"""Import-time profiler used while pytest collects (``--snap-imports``).
+
+Wraps ``builtins.__import__`` and times every import that actually loads a
+module (not already in ``sys.modules``). Like ``python -X importtime`` each
+module gets a cumulative time (including the modules it imported) and a self
+time (cumulative minus nested first-time imports). Each module is also
+attributed to the test file that was being collected when it was first loaded.
+
+Modules loaded through ``importlib.import_module`` directly (pytest does that
+for test modules themselves) are covered by the per-file collection time, but
+their own ``import`` statements are profiled here.
+"""
+
+import builtins
+import importlib.util
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+IMPORTS_MAX = 100
+
+
+class ImportProfiler:
+	def __init__(self) -> None:
+		self.stats: Dict[str, Dict[str, Any]] = {}
+		self.current_file: Optional[str] = None
+		self._stack: List[int] = []  # nested first-time import time per open frame
+		self._orig = None
+		self._hook = None
+
+	def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+		orig = self._orig
+		try:
+			absname = importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__")) if level else name
+		except (ImportError, ValueError):
+			absname = name
+		if absname in sys.modules:
+			return orig(name, globals, locals, fromlist, level)
+		self._stack.append(0)
+		t0 = time.perf_counter_ns()
+		try:
+			return orig(name, globals, locals, fromlist, level)
+		finally:
+			cum = time.perf_counter_ns() - t0
+			nested = self._stack.pop()
+			if self._stack:
+				self._stack[-1] += cum
+			if absname in sys.modules and absname not in self.stats:
+				self.stats[absname] = {
+					"module": absname,
+					"self_ns": max(cum - nested, 0),
+					"cumulative_ns": cum,
+					"file": self.current_file,
+				}
+
+	def start(self) -> None:
+		if self._orig is not None:
+			return
+		self._orig = builtins.__import__
+		# Keep the bound method: a fresh ``self._import`` would not compare ``is``-equal in stop().
+		self._hook = self._import
+		builtins.__import__ = self._hook
+
+	def stop(self) -> None:
+		if self._orig is None:
+			return
+		if builtins.__import__ is self._hook:
+			builtins.__import__ = self._orig
+			self._orig = None
+			self._hook = None
+
+	def to_json(self, limit: int = IMPORTS_MAX) -> List[Dict[str, Any]]:
+		"""Most expensive imports by self time."""
+		rows = sorted(self.stats.values(), key=lambda r: r["self_ns"], reverse=True)
+		return rows[:limit]
+
+
+__all__ = ["ImportProfiler", "IMPORTS_MAX"]
@@ -1,30 +1,88 @@
-"""Minimal pytest-snap plugin.
+"""pytest-snap plugin: snapshot capture and the run-time options built on it.
 
-This intentionally small implementation focuses on deterministic capture of
-per-test outcomes + durations into a JSON snapshot. It is a foundation for
-future perf / diff / gating features but keeps the initial surface area tiny.
+With ``--snap`` each test's outcome and phase timings are written to a JSON
+snapshot (``--snap-out``).
 
 Snapshot schema (0.1.0):
 {
   "started_ns": <int>,
   "finished_ns": <int>,
-  "env": {"pytest_version": "..."},
+  "env": {"pytest_version": "...", "host": {...}, "calibration": {...}},
   "results": [
-	 {"nodeid": "tests/test_x.py::test_foo", "outcome": "passed", "dur_ns": 123456}
+	 {"nodeid": "tests/test_x.py::test_foo", "outcome": "passed", "dur_ns": 123456,
+	  "setup_ns": 2100, "call_ns": 123456, "teardown_ns": 900}
   ]
 }
+
+``dur_ns`` is the call phase (kept for older readers); ``setup_ns`` /
+``call_ns`` / ``teardown_ns`` split the full wall clock of the test. Tests that
+never reach the call phase (setup error / skip) are recorded with
+``dur_ns: 0`` and outcome ``error`` / ``skipped``. Snapshots also carry a
+``fixtures`` table and a ``collection`` section.
+
+Every other option is opt-in and documented in README.md. This module only
+wires them into pytest's hooks; the logic lives in:
+
+* output: ``--snap-format jsonl|bin`` and compressed ``--snap-out``
+  (:mod:`pytest_snap.snapio`, :mod:`pytest_snap.columnar`, :mod:`pytest_snap.compress`);
+* measurement: ``--snap-resources``, ``--snap-imports``
+  (:mod:`pytest_snap.importtime`), ``--snap-repeat`` and the ``env`` host facts
+  (:mod:`pytest_snap.hostinfo`);
+* ordering and selection: ``--snap-order``, ``--snap-shard``
+  (:mod:`pytest_snap.schedule`), ``--snap-record-deps`` /
+  ``--snap-affected-since`` (:mod:`pytest_snap.deps`), ``--snap-cache``
+  (:mod:`pytest_snap.cache`);
+* history: ``--snap-history``, ``--snap-stats`` (:mod:`pytest_snap.rolling`),
+  ``--snap-sketches`` (:mod:`pytest_snap.sketch`);
+* budgets: ``--snap-watchdog`` with ``--snap-budgets``
+  (:mod:`pytest_snap.watchdog`, :mod:`pytest_snap.budgets`).
+
+``--snap-repeat`` and ``--snap-cache`` reach into pytest's fixture setup stack
+only through :mod:`pytest_snap.setupstate`.
 """
 
 from __future__ import annotations
 
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
+import argparse
+import heapq
 import json
 import os
+import signal
+import subprocess
+import sys
 import time
-from typing import Dict, List
+import warnings
+from typing import Dict, List, Optional, Tuple
 
 import pytest
 
+try:  # pragma: no cover - not available on Windows
+	import resource
+except ImportError:  # pragma: no cover
+	resource = None  # type: ignore[assignment]
+
+from .cache import DEFAULT_CACHE_MB, OutcomeCache
+from .importtime import ImportProfiler
+from .columnar import write_columnar
+from .compress import open_text
+from .deps import DepIndex, DepTracer, changed_files, select_affected
+from .hostinfo import calibrate, host_facts
+from .rolling import update_stats_file
+from .sketch import DurationSketches, update_sketch_file
+from .baseline import TestRecord, append_history, load_history
+from .budgets import BudgetMatcher, load_budgets, parse_quantile
+from .schedule import (
+	UNKNOWN_PLACEMENT, lpt_makespan, order_by_duration, order_by_risk, parse_shard, plan_shards,
+)
+from .snapio import (
+	FAILED_OUTCOMES, SnapshotStreamWriter, duration_index, load_snapshot, normalize_tests, sample_summary, total_duration,
+)
+from .setupstate import (
+	can_refresh, can_teardown, refresh_function_fixtures, stash_entries, teardown_exact, warn_unsupported,
+)
+from .watchdog import WATCHDOG_SIGNAL, Watchdog, can_signal
+
 __all__ = [
 	"pytest_addoption",
 ]
@@ -35,6 +93,97 @@ class _SnapResult:
 	nodeid: str
 	outcome: str
 	dur_ns: int
+	setup_ns: Optional[int] = None
+	call_ns: Optional[int] = None
+	teardown_ns: Optional[int] = None
+	cpu_user_ns: Optional[int] = None
+	cpu_sys_ns: Optional[int] = None
+	thread_cpu_ns: Optional[int] = None
+	ctx_vol: Optional[int] = None
+	ctx_invol: Optional[int] = None
+	rss_peak_delta_kb: Optional[int] = None
+	call_min_ns: Optional[int] = None  # --snap-repeat summary
+	call_mad_ns: Optional[int] = None
+	samples: Optional[int] = None
+	call_samples_ns: Optional[List[int]] = None
+	worker: Optional[str] = None  # pytest-xdist worker id (e.g. "gw0")
+	budget_ns: Optional[int] = None  # --snap-watchdog limit and time at expiry ("budget_exceeded")
+	elapsed_ns: Optional[int] = None
+
+	def to_json(self) -> Dict[str, object]:
+		return {k: v for k, v in asdict(self).items() if v is not None}
+
+
+FIXTURE_TESTS_MAX = 10
+
+
+@dataclass
+class _FixtureStat:
+	name: str
+	scope: str
+	count: int = 0
+	total_ns: int = 0
+	max_ns: int = 0
+	# min-heap of (ns, nodeid) keeping the slowest triggering tests
+	tests: List[Tuple[int, str]] = field(default_factory=list)
+
+	def add(self, ns: int, nodeid: Optional[str]) -> None:
+		self.count += 1
+		self.total_ns += ns
+		self.max_ns = max(self.max_ns, ns)
+		if nodeid is None:
+			return
+		entry = (ns, nodeid)
+		if len(self.tests) < FIXTURE_TESTS_MAX:
+			heapq.heappush(self.tests, entry)
+		elif entry > self.tests[0]:
+			heapq.heapreplace(self.tests, entry)
+
+	def merge(self, rec: Dict[str, object]) -> None:
+		"""Fold in a ``to_json()`` table produced by another (xdist worker) process."""
+		self.count += int(rec.get("count", 0))  # type: ignore[arg-type]
+		self.total_ns += int(rec.get("total_ns", 0))  # type: ignore[arg-type]
+		self.max_ns = max(self.max_ns, int(rec.get("max_ns", 0)))  # type: ignore[arg-type]
+		for t in rec.get("tests", []):  # type: ignore[union-attr]
+			entry = (int(t["ns"]), str(t["nodeid"]))
+			if len(self.tests) < FIXTURE_TESTS_MAX:
+				heapq.heappush(self.tests, entry)
+			elif entry > self.tests[0]:
+				heapq.heapreplace(self.tests, entry)
+
+	def to_json(self) -> Dict[str, object]:
+		return {
+			"name": self.name,
+			"scope": self.scope,
+			"count": self.count,
+			"total_ns": self.total_ns,
+			"max_ns": self.max_ns,
+			"tests": [{"nodeid": n, "ns": ns} for ns, n in sorted(self.tests, reverse=True)],
+		}
+
+
+def _fixture_stat(config: pytest.Config, name: str, scope: str) -> _FixtureStat:
+	table: Dict[Tuple[str, str], _FixtureStat] = config._snap_fixtures  # type: ignore[attr-defined]
+	stat = table.get((name, scope))
+	if stat is None:
+		stat = table[(name, scope)] = _FixtureStat(name=name, scope=scope)
+	return stat
+
+
+def _fixtures_json(config: pytest.Config) -> List[Dict[str, object]]:
+	table: Dict[Tuple[str, str], _FixtureStat] = getattr(config, "_snap_fixtures", {})
+	return [st.to_json() for st in sorted(table.values(), key=lambda st: st.total_ns, reverse=True)]
+
+
+# Per-item phase reports collected until teardown emits the combined record.
+_phases_key = pytest.StashKey[Dict[str, pytest.TestReport]]()
+_usage_key = pytest.StashKey[tuple]()
+_cache_hit_key = pytest.StashKey[bool]()
+_samples_key = pytest.StashKey[List[int]]()
+_cacheable_key = pytest.StashKey[Dict[str, object]]()
+
+# ru_maxrss is KiB on Linux/BSD but bytes on macOS.
+_MAXRSS_DIV = 1024 if sys.platform == "darwin" else 1
 
 
 def pytest_addoption(parser: pytest.Parser) -> None:  # pragma: no cover - exercised via help test
@@ -46,11 +195,170 @@ def pytest_addoption(parser: pytest.Parser) -> None:  # pragma: no cover - exerc
 		default=".snap/current.json",
 		help="Path to write current snapshot JSON (default: .snap/current.json)",
 	)
+	group.addoption(
+		"--snap-format",
+		action="store",
+		default="json",
+		choices=("json", "jsonl", "bin"),
+		help=(
+			"Snapshot layout: 'json' (written at session end), 'jsonl' (streamed per test, crash-safe) "
+			"or 'bin' (compact columnar, written at session end)"
+		),
+	)
+	group.addoption(
+		"--snap-resources",
+		action="store_true",
+		default=False,
+		help="Record per-test CPU time, context switches and peak RSS growth (~3us/test)",
+	)
+	group.addoption(
+		"--snap-no-calibrate",
+		action="store_true",
+		default=False,
+		help="Skip the ~20ms machine speed calibration stored in the snapshot env (used to compare hosts)",
+	)
+	group.addoption(
+		"--snap-imports",
+		action="store_true",
+		default=False,
+		help="Profile module imports during collection (like -X importtime) into the snapshot",
+	)
 	group.addoption(
 		"--snap-baseline",
 		action="store",
 		default=None,
-		help="(Reserved) baseline snapshot JSON to compare against (not yet used)",
+		help="Baseline snapshot (any format) supplying historical durations for --snap-order",
+	)
+	group.addoption(
+		"--snap-order",
+		action="store",
+		default="none",
+		choices=("none", "duration", "risk"),
+		help=(
+			"Reorder tests: 'duration' runs the longest (per --snap-baseline) first to balance xdist workers; "
+			"'risk' runs recent failures, outcome flips and flaky tests (per --snap-history) first"
+		),
+	)
+	group.addoption(
+		"--snap-history",
+		action="store",
+		default=None,
+		help="Rolling outcome history read by --snap-order risk; with --snap this run is appended to it. "
+		"A path ending in '/' (or a directory) is a segmented, lock-protected store; otherwise a JSONL file",
+	)
+	group.addoption(
+		"--snap-stats",
+		action="store",
+		default=None,
+		metavar="PATH",
+		help="Per-test rolling statistics (flake EWMA, duration mean/variance/min/max) updated after each --snap run",
+	)
+	group.addoption(
+		"--snap-sketches",
+		action="store",
+		default=None,
+		metavar="PATH",
+		help="Per-test duration quantile sketches (mergeable t-digests for p50/p95/p99 budgets) updated after each --snap run",
+	)
+	group.addoption(
+		"--snap-order-unknown",
+		action="store",
+		default="first",
+		choices=UNKNOWN_PLACEMENT,
+		help="Where --snap-order puts tests missing from the baseline (default: first)",
+	)
+	group.addoption(
+		"--snap-record-deps",
+		action="store_true",
+		default=False,
+		help="Record the project source files each test executes into the dependency index",
+	)
+	group.addoption(
+		"--snap-deps",
+		action="store",
+		default=None,
+		metavar="PATH",
+		help="Dependency index file (default: deps.json next to --snap-out)",
+	)
+	group.addoption(
+		"--snap-affected-since",
+		action="store",
+		default=None,
+		metavar="REV",
+		help="Run only tests whose recorded dependencies changed since git REV (unrecorded tests always run)",
+	)
+	group.addoption(
+		"--snap-repeat",
+		action="store",
+		type=int,
+		default=1,
+		metavar="N",
+		help="Run each test's call phase N times and record median / min / MAD timings (marker: snap(repeat=N))",
+	)
+	group.addoption(
+		"--snap-cache",
+		action="store_true",
+		default=False,
+		help="Skip tests whose source, conftests, executed and imported files and environment are unchanged since they passed (implies --snap)",
+	)
+	group.addoption(
+		"--snap-cache-dir",
+		action="store",
+		default=None,
+		metavar="DIR",
+		help="Outcome cache directory (default: cache/ next to --snap-out)",
+	)
+	group.addoption(
+		"--snap-cache-size",
+		action="store",
+		type=int,
+		default=DEFAULT_CACHE_MB,
+		metavar="MB",
+		help=f"Evict least recently used cache entries beyond this size (default: {DEFAULT_CACHE_MB})",
+	)
+	group.addoption(
+		"--snap-shard",
+		action="store",
+		default=None,
+		type=_shard_arg,
+		metavar="INDEX/TOTAL",
+		help="Run only shard INDEX (1-based) of TOTAL, balanced by --snap-baseline durations and kept module-whole",
+	)
+	group.addoption(
+		"--snap-watchdog",
+		action="store_true",
+		default=False,
+		help="Fail a test (dumping all thread tracebacks) as soon as it exceeds its budget; recorded as 'budget_exceeded'",
+	)
+	group.addoption(
+		"--snap-budgets",
+		action="store",
+		default=None,
+		metavar="FILE",
+		help="Budget file for --snap-watchdog (exact / glob / re: keys; 'timeout' seconds or quantile budgets)",
+	)
+	group.addoption(
+		"--snap-watchdog-factor",
+		action="store",
+		type=float,
+		default=WATCHDOG_FACTOR,
+		metavar="F",
+		help=f"Watchdog limit = F x the largest quantile budget or the --snap-sketches p99 (default: {WATCHDOG_FACTOR})",
+	)
+	group.addoption(
+		"--snap-watchdog-min",
+		action="store",
+		type=float,
+		default=WATCHDOG_MIN_S,
+		metavar="SECONDS",
+		help=f"Never fire the watchdog before this many seconds (default: {WATCHDOG_MIN_S})",
+	)
+	group.addoption(
+		"--snap-watchdog-action",
+		action="store",
+		choices=("test", "session"),
+		default="test",
+		help="On an exceeded budget fail the test and continue (test, default) or also stop the session (session)",
 	)
 	group.addoption(
 		"--snap-fail-on",
@@ -61,43 +369,731 @@ def pytest_addoption(parser: pytest.Parser) -> None:  # pragma: no cover - exerc
 
 
 def _enabled(config: pytest.Config) -> bool:
-	return bool(config.getoption("--snap"))
+	return bool(config.getoption("--snap") or config.getoption("--snap-cache"))
+
+
+def _worker_id(config: pytest.Config) -> Optional[str]:
+	# pytest-xdist sets ``workerinput`` on worker processes only.
+	workerinput = getattr(config, "workerinput", None)
+	return workerinput.get("workerid") if workerinput is not None else None
+
+
+def _env(config: pytest.Config) -> Dict[str, object]:
+	env: Dict[str, object] = {"pytest_version": pytest.__version__, "host": host_facts()}
+	if not config.getoption("--snap-no-calibrate"):
+		env["calibration"] = calibrate()
+	return env
+
+
+def _record(config: pytest.Config, rec: Dict[str, object]) -> None:
+	writer = getattr(config, "_snap_writer", None)
+	if writer is not None:
+		writer.write_result(rec)
+	else:
+		config._snap_results.append(rec)  # type: ignore[attr-defined]
+	# Running per-worker test time, for the achieved makespan.
+	loads: Dict[Optional[str], int] = config._snap_worker_ns  # type: ignore[attr-defined]
+	spent = sum(int(rec.get(k) or 0) for k in ("setup_ns", "call_ns", "teardown_ns"))  # type: ignore[call-overload]
+	w = rec.get("worker")  # type: ignore[assignment]
+	loads[w] = loads.get(w, 0) + spent  # type: ignore[index]
+	if rec.get("outcome") in FAILED_OUTCOMES and config._snap_first_failure is None:  # type: ignore[attr-defined]
+		# Absolute monotonic time: comparable across local xdist workers.
+		config._snap_first_failure = {"nodeid": rec["nodeid"], "at_ns": time.monotonic_ns(), "worker": w}  # type: ignore[attr-defined]
+
+
+def _deps_path(config: pytest.Config) -> str:
+	return config.getoption("--snap-deps") or os.path.join(os.path.dirname(config.getoption("--snap-out")) or ".", "deps.json")
+
+
+def _start_tracer(config: pytest.Config, tracing: bool) -> None:
+	# Dependency recording works with or without --snap; the cache needs it too.
+	if tracing and getattr(config, "_snap_deps_tracer", None) is None:
+		config._snap_deps_tracer = DepTracer(str(config.rootpath))  # type: ignore[attr-defined]
+		config._snap_deps = {}  # type: ignore[attr-defined]
+		# Unhooks builtins.__import__ even when the session never starts (usage errors).
+		config.add_cleanup(config._snap_deps_tracer.close)  # type: ignore[attr-defined]
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_load_initial_conftests(early_config: pytest.Config, parser, args) -> None:  # pragma: no cover - thin
+	# Before the initial conftests load, so the tracer sees the imports they make.
+	ns = early_config.known_args_namespace
+	_start_tracer(early_config, bool(getattr(ns, "snap_record_deps", False) or getattr(ns, "snap_cache", False)))
 
 
 def pytest_configure(config: pytest.Config) -> None:  # pragma: no cover - thin
 	# Avoid double-registration if plugin loaded twice under different entry point names.
 	if getattr(config, "_snap_initialized", False):  # type: ignore[attr-defined]
 		return
+	_start_tracer(config, config.getoption("--snap-record-deps") or config.getoption("--snap-cache"))
+	if config.getoption("--snap-watchdog") and getattr(config, "_snap_watchdog", None) is None:
+		config._snap_watchdog = _WatchdogPlugin(config)  # type: ignore[attr-defined]
+		config.pluginmanager.register(config._snap_watchdog, "pytest-snap-watchdog")  # type: ignore[attr-defined]
 	if not _enabled(config):
 		return
 	config._snap_initialized = True  # type: ignore[attr-defined]
 	config._snap_started_ns = time.monotonic_ns()  # type: ignore[attr-defined]
 	config._snap_results: List[Dict[str, object]] = []  # type: ignore[attr-defined]
-	config.addinivalue_line("markers", "snap: mark test considered by pytest-snap (currently implicit)")
+	config._snap_worker_ns = {}  # type: ignore[attr-defined]
+	config._snap_first_failure = None  # type: ignore[attr-defined]
+	config._snap_writer = None  # type: ignore[attr-defined]
+	config._snap_worker = _worker_id(config)  # type: ignore[attr-defined]
+	# Measured once, before any test loads the machine; workers never write it.
+	config._snap_env = _env(config) if config._snap_worker is None else {}  # type: ignore[attr-defined]
+	config._snap_resources = bool(config.getoption("--snap-resources"))  # type: ignore[attr-defined]
+	config._snap_fixtures = {}  # type: ignore[attr-defined]
+	config._snap_current = None  # type: ignore[attr-defined]
+	config._snap_collection = {"total_ns": None, "files": [], "imports": []}  # type: ignore[attr-defined]
+	config._snap_importer = ImportProfiler() if config.getoption("--snap-imports") else None  # type: ignore[attr-defined]
+	config._snap_cache = None  # type: ignore[attr-defined]
+	config._snap_cache_counts = {"hits": 0, "stored": 0}  # type: ignore[attr-defined]
+	if config.getoption("--snap-cache"):
+		cache_dir = config.getoption("--snap-cache-dir") or os.path.join(
+			os.path.dirname(config.getoption("--snap-out")) or ".", "cache"
+		)
+		config._snap_cache = OutcomeCache(  # type: ignore[attr-defined]
+			str(config.rootpath), cache_dir, max_bytes=config.getoption("--snap-cache-size") * 2**20
+		)
+		config.pluginmanager.register(_CachePlugin(config), "pytest-snap-cache")
+	# xdist workers never touch --snap-out; their results travel back to the
+	# controller in ``workeroutput`` and are written there.
+	if config.getoption("--snap-format") == "jsonl" and config._snap_worker is None:  # type: ignore[attr-defined]
+		config._snap_writer = SnapshotStreamWriter(  # type: ignore[attr-defined]
+			config.getoption("--snap-out"), started_ns=config._snap_started_ns, env=config._snap_env  # type: ignore[attr-defined]
+		)
+	config.addinivalue_line(
+		"markers", "snap(repeat=N): pytest-snap options for this test; repeat runs the call phase N times (with --snap)"
+	)
+
+
+def _shard_arg(spec: str) -> Tuple[int, int]:
+	try:
+		return parse_shard(spec)
+	except ValueError as exc:
+		raise argparse.ArgumentTypeError(str(exc)) from None
+
+
+def _load_baseline(config: pytest.Config) -> Optional[dict]:
+	path = config.getoption("--snap-baseline")
+	if not path:
+		return None
+	try:
+		return load_snapshot(path)
+	except Exception as exc:
+		warnings.warn(pytest.PytestConfigWarning(f"pytest-snap: cannot read baseline {path}: {exc}; ignoring it"))
+		return None
+
+
+def _select_shard(config: pytest.Config, items: List[pytest.Item], durations: Dict[str, float]) -> None:
+	index, total = config.getoption("--snap-shard")
+	shards, loads = plan_shards([it.nodeid for it in items], durations, total)
+	keep = [it for it, s in zip(items, shards) if s == index - 1]
+	dropped = [it for it, s in zip(items, shards) if s != index - 1]
+	if dropped:
+		config.hook.pytest_deselected(items=dropped)
+	items[:] = keep
+	config._snap_shard = {  # type: ignore[attr-defined]
+		"index": index,
+		"total": total,
+		"selected": len(keep),
+		"predicted_ns": int(loads[index - 1] * 1e9),
+		"max_predicted_ns": int(max(loads) * 1e9),
+	}
+
+
+def _select_affected(config: pytest.Config, items: List[pytest.Item], since: str) -> None:
+	path = _deps_path(config)
+	index = DepIndex.load(path)
+	if not index.tests:
+		warnings.warn(pytest.PytestConfigWarning(f"pytest-snap: no dependency index at {path} (run with --snap-record-deps); running all tests"))
+		return
+	try:
+		changed = changed_files(str(config.rootpath), since)
+	except (OSError, subprocess.CalledProcessError) as exc:
+		detail = str(getattr(exc, "stderr", None) or exc).strip().partition("\n")[0]
+		warnings.warn(pytest.PytestConfigWarning(f"pytest-snap: git diff against {since!r} failed: {detail}; running all tests"))
+		return
+	mask = select_affected([it.nodeid for it in items], index, changed)
+	dropped = [it for it, keep in zip(items, mask) if not keep]
+	if dropped:
+		config.hook.pytest_deselected(items=dropped)
+		items[:] = [it for it, keep in zip(items, mask) if keep]
+	config._snap_affected = {  # type: ignore[attr-defined]
+		"since": since,
+		"changed": len(changed),
+		"selected": len(items),
+		"deselected": len(dropped),
+	}
+
+
+def pytest_collection_modifyitems(session: pytest.Session, config: pytest.Config, items: List[pytest.Item]) -> None:
+	since = config.getoption("--snap-affected-since")
+	if since and items:
+		_select_affected(config, items, since)
+	mode = config.getoption("--snap-order")
+	shard = config.getoption("--snap-shard")
+	if (mode == "none" and shard is None) or not items:
+		return
+	baseline = _load_baseline(config)
+	durations = duration_index(baseline) if baseline is not None else {}
+	if shard is not None:
+		# Without a baseline every test weighs the same: balanced by count.
+		_select_shard(config, items, durations)
+	if mode == "none":
+		return
+	history_path = config.getoption("--snap-history")
+	history = load_history(history_path) if mode == "risk" and history_path else []
+	if mode == "risk" and not history:
+		warnings.warn(pytest.PytestConfigWarning("pytest-snap: --snap-order risk found no --snap-history; ordering by duration only"))
+	if not durations and history:
+		durations = {t["id"]: float(t["duration"]) for t in history[-1].get("tests", []) if t.get("id") and isinstance(t.get("duration"), (int, float))}
+	if not durations and not history:
+		warnings.warn(pytest.PytestConfigWarning("pytest-snap: --snap-order needs a readable --snap-baseline; keeping collection order"))
+		return
+	# Deterministic, so every xdist worker derives the same order.
+	nodeids = [it.nodeid for it in items]
+	unknown = config.getoption("--snap-order-unknown")
+	risky = None
+	if mode == "risk":
+		order, risky = order_by_risk(nodeids, durations, history, unknown=unknown)
+	else:
+		order = order_by_duration(nodeids, durations, unknown=unknown)
+	items[:] = [items[i] for i in order]
+	workers = int((getattr(config, "workerinput", None) or {}).get("workercount", 1))
+	known = [durations[it.nodeid] for it in items if it.nodeid in durations]
+	config._snap_order = {  # type: ignore[attr-defined]
+		"mode": mode,
+		"workers": workers,
+		"known": len(known),
+		"unknown": len(items) - len(known),
+		"predicted_makespan_ns": int(lpt_makespan(known, workers) * 1e9),
+	}
+	if risky is not None:
+		config._snap_order["risky"] = risky  # type: ignore[attr-defined]
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_collection(session: pytest.Session):  # pragma: no cover - thin wrapper
+	config = session.config
+	if not _enabled(config):
+		yield
+		return
+	importer: Optional[ImportProfiler] = getattr(config, "_snap_importer", None)
+	if importer is not None:
+		importer.start()
+	t0 = time.perf_counter_ns()
+	try:
+		yield
+	finally:
+		config._snap_collection["total_ns"] = time.perf_counter_ns() - t0  # type: ignore[attr-defined]
+		if importer is not None:
+			importer.stop()
+			config._snap_collection["imports"] = importer.to_json()  # type: ignore[attr-defined]
+		config._snap_collection["files"].sort(key=lambda f: f["ns"], reverse=True)  # type: ignore[attr-defined]
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_make_collect_report(collector: pytest.Collector):  # pragma: no cover - thin wrapper
+	# Files only. This is the collectstart -> collectreport window: module import
+	# plus item collection (pytest_collect_file merely builds the node).
+	config = collector.config
+	if not _enabled(config) or not isinstance(collector, pytest.File):
+		yield
+		return
+	importer: Optional[ImportProfiler] = getattr(config, "_snap_importer", None)
+	if importer is not None:
+		importer.current_file = collector.nodeid
+	t0 = time.perf_counter_ns()
+	outcome = yield
+	ns = time.perf_counter_ns() - t0
+	if importer is not None:
+		importer.current_file = None
+	rep: pytest.CollectReport = outcome.get_result()  # type: ignore[assignment]
+	config._snap_collection["files"].append(  # type: ignore[attr-defined]
+		{"path": collector.nodeid, "ns": ns, "items": len(rep.result), "outcome": rep.outcome}
+	)
+
+
+def _sample_usage() -> tuple:
+	ru = resource.getrusage(resource.RUSAGE_SELF)
+	return (time.thread_time_ns(), ru.ru_utime, ru.ru_stime, ru.ru_nvcsw, ru.ru_nivcsw, ru.ru_maxrss)
+
+
+def _usage_delta(start: tuple, end: tuple) -> Dict[str, int]:
+	return {
+		"thread_cpu_ns": end[0] - start[0],
+		"cpu_user_ns": int((end[1] - start[1]) * 1e9),
+		"cpu_sys_ns": int((end[2] - start[2]) * 1e9),
+		"ctx_vol": end[3] - start[3],
+		"ctx_invol": end[4] - start[4],
+		"rss_peak_delta_kb": (end[5] - start[5]) // _MAXRSS_DIV,
+	}
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item: pytest.Item, nextitem):  # pragma: no cover - thin wrapper
+	tracer: Optional[DepTracer] = getattr(item.config, "_snap_deps_tracer", None)
+	if tracer is None:
+		yield
+		return
+	tracer.start()
+	try:
+		yield
+	finally:
+		files = tracer.stop()
+		if not item.stash.get(_cache_hit_key, False):
+			item.config._snap_deps[item.nodeid] = files  # type: ignore[attr-defined]
+			cache: Optional[OutcomeCache] = getattr(item.config, "_snap_cache", None)
+			rec = item.stash.get(_cacheable_key, None)
+			if cache is not None and rec is not None:
+				cache.store(item.nodeid, files, rec)
+
+
+class _CachePlugin:
+	"""Answers ``pytest_runtest_protocol`` for cache hits, so the test never runs.
+
+	The reports come from the cache, but higher-scoped fixtures that
+	``nextitem`` no longer needs are still finalized (``teardown_exact``), as
+	after a normal run; a failing finalizer is reported as a teardown error.
+	Without the pytest internals for that (:mod:`pytest_snap.setupstate`) the
+	test runs normally.
+	"""
+
+	def __init__(self, config: pytest.Config):
+		self.config = config
+
+	@pytest.hookimpl(tryfirst=True)
+	def pytest_runtest_protocol(self, item: pytest.Item, nextitem) -> Optional[bool]:
+		cache: OutcomeCache = self.config._snap_cache  # type: ignore[attr-defined]
+		rec = cache.lookup(item.nodeid)
+		if rec is None:
+			return None
+		if not can_teardown(item):
+			warn_unsupported(self.config, "--snap-cache", "cached tests run normally")
+			return None
+		item.stash[_cache_hit_key] = True
+		ihook = item.ihook
+		ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+		keywords = {k: 1 for k in item.keywords}
+		teardown = pytest.CallInfo.from_call(lambda: teardown_exact(item, nextitem), when="teardown")
+		for when in ("setup", "call", "teardown"):
+			if when == "teardown" and teardown.excinfo is not None:
+				rep = pytest.TestReport.from_item_and_call(item, teardown)
+			else:
+				rep = pytest.TestReport(
+					item.nodeid, item.location, keywords, "passed", None, when,
+					duration=int(rec.get(f"{when}_ns") or 0) / 1e9, snap_cached=True,
+				)
+			ihook.pytest_runtest_logreport(report=rep)
+		ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+		reused = dict(rec, reused=True)
+		reused.pop("worker", None)
+		if self.config._snap_worker is not None:  # type: ignore[attr-defined]
+			reused["worker"] = self.config._snap_worker  # type: ignore[attr-defined]
+		_record(self.config, reused)
+		return True
+
+
+# Watchdog limits: a multiple of the budget / p99, never below a floor, and
+# sketches need a few runs before their p99 means anything.
+WATCHDOG_FACTOR = 3.0
+WATCHDOG_MIN_S = 1.0
+WATCHDOG_MIN_RUNS = 5
+
+
+class _WatchdogPlugin:
+	"""Arms the watchdog around each test (``--snap-watchdog``) and fails it on expiry."""
+
+	def __init__(self, config: pytest.Config):
+		self.config = config
+		self.budgets = load_budgets(config.getoption("--snap-budgets"))
+		self.matcher = BudgetMatcher(self.budgets)
+		sketches = config.getoption("--snap-sketches")
+		self.sketches = DurationSketches.load(sketches) if sketches else None
+		self.factor = config.getoption("--snap-watchdog-factor")
+		self.min_s = config.getoption("--snap-watchdog-min")
+		self.watchdog = Watchdog()
+		self._phase: Optional[str] = None
+		self._signals = can_signal()
+		if self._signals:
+			self._prev_handler = signal.signal(WATCHDOG_SIGNAL, self._on_signal)  # type: ignore[arg-type]
+
+	def limit(self, item: pytest.Item) -> Optional[float]:
+		"""Seconds ``item`` may take (all phases, all ``--snap-repeat`` runs), or ``None`` to leave it unwatched."""
+		base = None
+		key = self.matcher.key_for(item.nodeid)
+		spec = self.budgets.get(key) if key is not None else None
+		if isinstance(spec, dict):
+			if isinstance(spec.get("timeout"), (int, float)):
+				return float(spec["timeout"])
+			quantiles = [float(v) for k, v in spec.items() if parse_quantile(k) is not None and isinstance(v, (int, float))]
+			base = max(quantiles, default=None)
+		if base is None and self.sketches is not None:
+			digest = self.sketches.tests.get(item.nodeid)
+			if digest is not None and digest.count >= WATCHDOG_MIN_RUNS:
+				base = digest.quantile(0.99)
+		if base is None:
+			return None
+		return max(base * self.factor, self.min_s) * _repeat_count(item)
+
+	def _fail(self, fired) -> None:
+		pytest.fail(
+			f"pytest-snap watchdog: {fired[0]} exceeded its {fired[1]:.2f}s budget ({fired[2]:.2f}s elapsed)",
+			pytrace=True,
+		)
+
+	def _on_signal(self, signum, frame) -> None:
+		# Only raise inside a test phase; otherwise the next phase picks it up.
+		if self._phase is None:
+			return
+		fired = self.watchdog.take()
+		if fired is not None:
+			self._fail(fired)
+
+	@pytest.hookimpl(hookwrapper=True)
+	def pytest_runtest_protocol(self, item: pytest.Item, nextitem):
+		limit = self.limit(item)
+		if limit is None:
+			yield
+			return
+		self.watchdog.arm(item.nodeid, limit)
+		try:
+			yield
+		finally:
+			self.watchdog.disarm()
+		fired = self.watchdog.fired
+		if fired is not None and fired[0] == item.nodeid and self.config.getoption("--snap-watchdog-action") == "session":
+			item.session.shouldstop = f"pytest-snap watchdog: {item.nodeid} exceeded its {fired[1]:.2f}s budget"
+
+	def _phase_wrapper(self, when: str):
+		fired = self.watchdog.take()  # expired between phases
+		if fired is not None:
+			self._fail(fired)
+		self._phase = when
+		try:
+			yield
+		finally:
+			self._phase = None
+
+	@pytest.hookimpl(hookwrapper=True, tryfirst=True)
+	def pytest_runtest_setup(self, item: pytest.Item):
+		yield from self._phase_wrapper("setup")
+
+	@pytest.hookimpl(hookwrapper=True, tryfirst=True)
+	def pytest_runtest_call(self, item: pytest.Item):
+		yield from self._phase_wrapper("call")
+
+	@pytest.hookimpl(hookwrapper=True, tryfirst=True)
+	def pytest_runtest_teardown(self, item: pytest.Item):
+		yield from self._phase_wrapper("teardown")
+
+	def pytest_unconfigure(self, config: pytest.Config) -> None:
+		self.watchdog.close()
+		if self._signals:
+			signal.signal(WATCHDOG_SIGNAL, self._prev_handler or signal.SIG_DFL)  # type: ignore[arg-type]
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_report_teststatus(report, config: pytest.Config):
+	if getattr(report, "snap_cached", False) and report.when == "call":
+		return "passed", "c", "CACHED"
+	return None
+
+
+def _repeat_count(item: pytest.Item) -> int:
+	marker = item.get_closest_marker("snap")
+	if marker is not None and "repeat" in marker.kwargs:
+		return max(1, int(marker.kwargs["repeat"]))
+	return max(1, item.config.getoption("--snap-repeat"))
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item: pytest.Item):  # pragma: no cover - thin wrapper
+	repeat = _repeat_count(item) if _enabled(item.config) else 1
+	if repeat == 1:
+		return (yield)
+	refresh = can_refresh(item)
+	if not refresh:
+		warn_unsupported(item.config, "--snap-repeat", "repeated runs share the first run's fixtures")
+	stashed = stash_entries(item) if refresh else {}
+	t0 = time.perf_counter_ns()
+	result = yield  # a failing first run raises here and is reported as usual
+	samples = [time.perf_counter_ns() - t0]
+	# Every further run gets fresh function fixtures (not timed), so tests that
+	# mutate a fixture see the same state as on the first run. A failure in
+	# any run, fixture setup included, propagates as the test's call failure.
+	# Re-run through item.runtest() so other plugins' pytest_pyfunc_call still apply.
+	for _ in range(repeat - 1):
+		if refresh:
+			refresh_function_fixtures(item, stashed)
+		t0 = time.perf_counter_ns()
+		item.runtest()
+		samples.append(time.perf_counter_ns() - t0)
+	item.stash[_samples_key] = samples
+	return result
+
+
+@pytest.hookimpl(hookwrapper=True, tryfirst=True)
+def pytest_runtest_setup(item: pytest.Item):  # pragma: no cover - thin wrapper
+	# Sample before any fixture runs; the matching sample is taken once teardown has finished.
+	if getattr(item.config, "_snap_resources", False) and resource is not None:
+		item.stash[_usage_key] = _sample_usage()
+	# Fixtures instantiated from here on (including lazy getfixturevalue calls) are charged to this test.
+	item.config._snap_current = item.nodeid  # type: ignore[attr-defined]
+	yield
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_fixture_setup(fixturedef, request):  # pragma: no cover - thin wrapper
+	config = request.config
+	if not _enabled(config):
+		yield
+		return
+	t0 = time.perf_counter_ns()
+	yield
+	ns = time.perf_counter_ns() - t0
+	_fixture_stat(config, fixturedef.argname, fixturedef.scope).add(ns, getattr(config, "_snap_current", None))
 
 
 @pytest.hookimpl(hookwrapper=True)
 def pytest_runtest_makereport(item: pytest.Item, call):  # pragma: no cover - thin wrapper
 	outcome = yield
 	rep: pytest.TestReport = outcome.get_result()  # type: ignore[assignment]
-	if rep.when != "call" or not _enabled(item.config):
+	if not _enabled(item.config):
+		return
+	phases = item.stash.setdefault(_phases_key, {})
+	phases[rep.when] = rep
+	if rep.when != "teardown":
 		return
-	dur_ns = int(rep.duration * 1e9)
-	results: List[Dict[str, object]] = item.config._snap_results  # type: ignore[attr-defined]
-	results.append(asdict(_SnapResult(nodeid=rep.nodeid, outcome=rep.outcome, dur_ns=dur_ns)))
+	del item.stash[_phases_key]
+	usage = None
+	start = item.stash.get(_usage_key, None)
+	if start is not None:
+		del item.stash[_usage_key]
+		usage = _usage_delta(start, _sample_usage())
+	result = _build_result(item.config, rep.nodeid, phases, usage)
+	samples = item.stash.get(_samples_key, None)
+	if samples is not None:
+		del item.stash[_samples_key]
+		summary = sample_summary(samples)
+		result.call_ns = result.dur_ns = summary["call_ns"]
+		result.call_min_ns = summary["call_min_ns"]
+		result.call_mad_ns = summary["call_mad_ns"]
+		result.samples = summary["samples"]
+		result.call_samples_ns = samples
+	watchdog: Optional[_WatchdogPlugin] = getattr(item.config, "_snap_watchdog", None)
+	fired = watchdog.watchdog.fired if watchdog is not None else None
+	if fired is not None and fired[0] == rep.nodeid and any(r.failed for r in phases.values()):
+		result.outcome = "budget_exceeded"
+		result.budget_ns = int(fired[1] * 1e9)
+		result.elapsed_ns = int(fired[2] * 1e9)
+	rec = result.to_json()
+	_record(item.config, rec)
+	call = phases.get("call")
+	if (
+		getattr(item.config, "_snap_cache", None) is not None
+		and call is not None
+		and not hasattr(call, "wasxfail")
+		and all(r.passed for r in phases.values())
+	):
+		item.stash[_cacheable_key] = rec
+
+
+def _build_result(
+	config: pytest.Config,
+	nodeid: str,
+	phases: Dict[str, pytest.TestReport],
+	usage: Optional[Dict[str, int]] = None,
+) -> _SnapResult:
+	ns = {when: int(r.duration * 1e9) for when, r in phases.items()}
+	call = phases.get("call")
+	if call is not None:
+		outcome = call.outcome
+	else:
+		setup = phases.get("setup")
+		outcome = "error" if setup is not None and setup.failed else (setup.outcome if setup is not None else "error")
+	return _SnapResult(
+		nodeid=nodeid,
+		outcome=outcome,
+		dur_ns=ns.get("call", 0),
+		setup_ns=ns.get("setup"),
+		call_ns=ns.get("call"),
+		teardown_ns=ns.get("teardown"),
+		worker=getattr(config, "_snap_worker", None),
+		**(usage or {}),
+	)
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error) -> None:  # pragma: no cover - requires pytest-xdist
+	"""Controller side: merge the results a finished xdist worker shipped back.
+
+	Workers batch their records into ``workeroutput`` once at the end of their
+	session, so there is no per-test serialization on top of xdist's own.
+	"""
+	config = node.config
+	output = getattr(node, "workeroutput", None) or {}
+	if getattr(config, "_snap_deps_tracer", None) is not None:
+		config._snap_deps.update(output.get("snap_deps", {}))  # type: ignore[attr-defined]
+	if not _enabled(config):
+		return
+	for k, v in (output.get("snap_cache") or {}).items():
+		config._snap_cache_counts[k] += v  # type: ignore[attr-defined]
+	for rec in output.get("snap_results", []):
+		_record(config, rec)
+	for fx in output.get("snap_fixtures", []):
+		_fixture_stat(config, fx["name"], fx["scope"]).merge(fx)
+	# Every worker collects the full suite; the controller itself collects
+	# nothing, so keep the first worker's collection profile.
+	collection = output.get("snap_collection")
+	if collection and not config._snap_collection["files"]:  # type: ignore[attr-defined]
+		config._snap_collection = dict(collection, worker=node.gateway.id)  # type: ignore[attr-defined]
+	for key in ("snap_order", "snap_shard", "snap_affected"):
+		if output.get(key) and getattr(config, f"_{key}", None) is None:
+			setattr(config, f"_{key}", dict(output[key]))
+	first = output.get("snap_first_failure")
+	current = config._snap_first_failure  # type: ignore[attr-defined]
+	if first and (current is None or first["at_ns"] < current["at_ns"]):
+		config._snap_first_failure = first  # type: ignore[attr-defined]
+
+
+def _finish_deps(config: pytest.Config) -> None:
+	tracer: Optional[DepTracer] = getattr(config, "_snap_deps_tracer", None)
+	if tracer is None:
+		return
+	tracer.close()
+	if not config.getoption("--snap-record-deps"):
+		return
+	deps = {nid: sorted(files) for nid, files in config._snap_deps.items()}  # type: ignore[attr-defined]
+	workeroutput = getattr(config, "workeroutput", None)
+	if workeroutput is not None:
+		workeroutput["snap_deps"] = deps
+		return
+	if deps:
+		path = _deps_path(config)
+		index = DepIndex.load(path)
+		index.update(deps)
+		index.save(path)
 
 
 def pytest_sessionfinish(session: pytest.Session, exitstatus: int) -> None:  # pragma: no cover - integration semantics
 	config = session.config
+	_finish_deps(config)
 	if not _enabled(config):
 		return
+	workeroutput = getattr(config, "workeroutput", None)
+	if workeroutput is not None:
+		workeroutput["snap_results"] = getattr(config, "_snap_results", [])
+		workeroutput["snap_fixtures"] = _fixtures_json(config)
+		workeroutput["snap_collection"] = config._snap_collection  # type: ignore[attr-defined]
+		workeroutput["snap_order"] = getattr(config, "_snap_order", None)
+		workeroutput["snap_shard"] = getattr(config, "_snap_shard", None)
+		workeroutput["snap_affected"] = getattr(config, "_snap_affected", None)
+		workeroutput["snap_first_failure"] = config._snap_first_failure  # type: ignore[attr-defined]
+		cache = config._snap_cache  # type: ignore[attr-defined]
+		workeroutput["snap_cache"] = {"hits": cache.hits, "stored": cache.stored} if cache is not None else None
+		return
+	finished_ns = time.monotonic_ns()
+	order = getattr(config, "_snap_order", None)
+	if order is not None:
+		loads = getattr(config, "_snap_worker_ns", {})
+		order["achieved_makespan_ns"] = max(loads.values()) if loads else 0
+		order["wall_ns"] = finished_ns - config._snap_started_ns  # type: ignore[attr-defined]
+	first = config._snap_first_failure  # type: ignore[attr-defined]
+	if first is not None:
+		first = {"nodeid": first["nodeid"], "ns": first["at_ns"] - config._snap_started_ns, "worker": first["worker"]}  # type: ignore[attr-defined]
+		config._snap_first_failure_report = first  # type: ignore[attr-defined]
+	cache_info = None
+	cache = config._snap_cache  # type: ignore[attr-defined]
+	if cache is not None:
+		counts = config._snap_cache_counts  # type: ignore[attr-defined]
+		cache_info = {
+			"hits": counts["hits"] + cache.hits,
+			"stored": counts["stored"] + cache.stored,
+			"evicted": cache.evict(),
+		}
+		config._snap_cache_report = cache_info  # type: ignore[attr-defined]
+	plan = {
+		k: v
+		for k, v in (
+			("affected", getattr(config, "_snap_affected", None)),
+			("order", order),
+			("shard", getattr(config, "_snap_shard", None)),
+			("first_failure", first),
+			("cache", cache_info),
+		)
+		if v is not None
+	}
 	snap_path = config.getoption("--snap-out")
+	writer = getattr(config, "_snap_writer", None)
+	if writer is not None:
+		writer.close(
+			finished_ns=finished_ns,
+			fixtures=_fixtures_json(config),
+			collection=config._snap_collection,  # type: ignore[attr-defined]
+			**plan,
+		)
+	else:
+		_write_snapshot(config, snap_path, finished_ns, plan)
+	history_path = config.getoption("--snap-history")
+	stats_path = config.getoption("--snap-stats")
+	sketches_path = config.getoption("--snap-sketches")
+	if history_path or stats_path or sketches_path:
+		_record_run(snap_path, history_path, stats_path, sketches_path)
+
+
+def _write_snapshot(config: pytest.Config, snap_path: str, finished_ns: int, plan: Dict[str, object]) -> None:
 	data = {
 		"started_ns": getattr(config, "_snap_started_ns", None),
-		"finished_ns": time.monotonic_ns(),
-		"env": {"pytest_version": pytest.__version__},
+		"finished_ns": finished_ns,
+		"env": config._snap_env,  # type: ignore[attr-defined]
 		"results": getattr(config, "_snap_results", []),
+		"fixtures": _fixtures_json(config),
+		"collection": getattr(config, "_snap_collection", None),
 	}
+	data.update(plan)
 	os.makedirs(os.path.dirname(snap_path) or ".", exist_ok=True)
-	with open(snap_path, "w", encoding="utf-8") as f:
+	if config.getoption("--snap-format") == "bin":
+		write_columnar(snap_path, data)
+		return
+	with open_text(snap_path, "w") as f:
 		json.dump(data, f, indent=2)
+
+
+def _record_run(
+	snap_path: str, history_path: Optional[str], stats_path: Optional[str], sketches_path: Optional[str]
+) -> None:
+	# Re-read the written snapshot: streamed results are not kept in memory.
+	rows = [
+		{"id": row["id"], "outcome": str(row.get("outcome")), "duration": total_duration(row)}
+		for row in normalize_tests(load_snapshot(snap_path))
+		if row.get("id")
+	]
+	if history_path:
+		records = [TestRecord(id=r["id"], outcome=r["outcome"], duration=r["duration"] or 0.0, sig=None) for r in rows]
+		append_history(history_path, os.path.basename(snap_path), records)
+	if stats_path:
+		update_stats_file(stats_path, rows)
+	if sketches_path:
+		update_sketch_file(sketches_path, rows)
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus: int, config: pytest.Config) -> None:  # pragma: no cover - output only
+	cache_info = getattr(config, "_snap_cache_report", None)
+	if cache_info is not None:
+		terminalreporter.write_line(
+			f"pytest-snap cache: {cache_info['hits']} cached pass(es), {cache_info['stored']} stored, "
+			f"{cache_info['evicted']} evicted"
+		)
+	first = getattr(config, "_snap_first_failure_report", None)
+	if first is not None:
+		terminalreporter.write_line(f"pytest-snap first failure after {first['ns'] / 1e9:.2f}s: {first['nodeid']}")
+	order = getattr(config, "_snap_order", None)
+	if not order or "achieved_makespan_ns" not in order:
+		return
+	pred = order["predicted_makespan_ns"] / 1e9
+	got = order["achieved_makespan_ns"] / 1e9
+	terminalreporter.write_line(
+		f"pytest-snap order={order['mode']}: predicted makespan {pred:.2f}s, achieved {got:.2f}s "
+		f"({order['workers']} worker(s), {order['unknown']} test(s) without history)"
+	)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+"""Per-test rolling statistics, updated in place after every run (``--snap-stats``).
+
+Flake scores would otherwise be rebuilt by replaying the whole history
+(:func:`~pytest_snap.baseline.compute_flake_scores`), and nothing kept a
+test's duration spread beyond the retained runs. The state file holds one
+row per test and is updated in O(tests) per run::
+
+	{"version": 1, "runs": 42, "updated_at": "2025-09-04T19:20:21Z",
+	 "fields": ["outcome", "flake", "n", "mean", "m2", "min", "max"],
+	 "tests": {"tests/test_x.py::test_a": ["passed", 0.09, 41, 0.132, 0.0021, 0.118, 0.171]}}
+
+* ``outcome``: outcome in the latest run that included the test;
+* ``flake``: pass <-> fail flip EWMA, the same recurrence (and ``FLAKE_ALPHA``)
+  as ``compute_flake_scores`` over the runs seen so far;
+* ``n`` / ``mean`` / ``m2``: Welford's running count, mean and sum of squared
+  deviations of the whole-test duration (variance = ``m2 / (n - 1)``);
+* ``min`` / ``max``: extreme durations.
+
+Read-modify-write happens under an ``fcntl`` lock on ``<path>.lock`` and the
+file is replaced atomically, so concurrent runs on one machine do not lose
+updates.
+"""
+
+import json
+import math
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from .baseline import FLAKE_ALPHA
+from .history import file_lock
+
+STATS_VERSION = 1
+FIELDS = ("outcome", "flake", "n", "mean", "m2", "min", "max")
+_OUTCOME, _FLAKE, _N, _MEAN, _M2, _MIN, _MAX = range(len(FIELDS))
+_FLIP_OUTCOMES = {"passed", "failed"}
+
+
+class RollingStats:
+	def __init__(self, tests: Optional[Dict[str, List[Any]]] = None, runs: int = 0, updated_at: Optional[str] = None):
+		self.tests: Dict[str, List[Any]] = tests if tests is not None else {}
+		self.runs = runs
+		self.updated_at = updated_at
+
+	@classmethod
+	def load(cls, path: str | os.PathLike) -> "RollingStats":
+		"""State in ``path``; empty when missing, unreadable or of another version."""
+		try:
+			with open(path, encoding="utf-8") as f:
+				raw = json.load(f)
+		except (OSError, ValueError):
+			return cls()
+		if not isinstance(raw, dict) or raw.get("version") != STATS_VERSION or tuple(raw.get("fields") or ()) != FIELDS:
+			return cls()
+		tests = {tid: row for tid, row in (raw.get("tests") or {}).items() if isinstance(row, list) and len(row) == len(FIELDS)}
+		return cls(tests, int(raw.get("runs") or 0), raw.get("updated_at"))
+
+	def save(self, path: str | os.PathLike) -> None:
+		doc = {"version": STATS_VERSION, "runs": self.runs, "updated_at": self.updated_at, "fields": FIELDS, "tests": self.tests}
+		tmp = f"{os.fspath(path)}.{os.getpid()}.tmp"
+		os.makedirs(os.path.dirname(os.fspath(path)) or ".", exist_ok=True)
+		with open(tmp, "w", encoding="utf-8") as f:
+			json.dump(doc, f, separators=(",", ":"))
+		os.replace(tmp, path)
+
+	def update(self, rows: Iterable[Dict[str, Any]]) -> None:
+		"""Fold one run's ``{"id", "outcome", "duration"}`` rows (seconds) into the state."""
+		tests = self.tests
+		keep = 1 - FLAKE_ALPHA
+		latest = {r.get("id"): r for r in rows}  # a test reported twice counts once, last wins
+		latest.pop(None, None)
+		for tid, r in latest.items():
+			if not tid:
+				continue
+			out = r.get("outcome")
+			st = tests.get(tid)
+			if st is None:
+				st = tests[tid] = [out, 0.0, 0, 0.0, 0.0, None, None]
+			else:
+				prev = st[_OUTCOME]
+				flipped = prev is not None and prev != out and prev in _FLIP_OUTCOMES and out in _FLIP_OUTCOMES
+				st[_FLAKE] = keep * st[_FLAKE] + (FLAKE_ALPHA if flipped else 0.0)
+				st[_OUTCOME] = out
+			d = r.get("duration")
+			if isinstance(d, (int, float)) and not isinstance(d, bool):
+				n = st[_N] + 1
+				delta = d - st[_MEAN]
+				st[_MEAN] += delta / n
+				st[_M2] += delta * (d - st[_MEAN])
+				st[_N] = n
+				st[_MIN] = d if st[_MIN] is None else min(st[_MIN], d)
+				st[_MAX] = d if st[_MAX] is None else max(st[_MAX], d)
+		self.runs += 1
+		self.updated_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+	def flake_scores(self) -> Dict[str, float]:
+		"""``id -> flake score`` (for ``diff.diff_snapshots(flake_scores=...)`` and ``diff --perf-flake``)."""
+		return {tid: st[_FLAKE] for tid, st in self.tests.items()}
+
+	def duration(self, tid: str) -> Optional[Dict[str, float]]:
+		"""``n`` / ``mean`` / ``std`` / ``min`` / ``max`` seconds of one test (``None`` without samples)."""
+		st = self.tests.get(tid)
+		if st is None or not st[_N]:
+			return None
+		n = st[_N]
+		return {
+			"n": n,
+			"mean": st[_MEAN],
+			"std": math.sqrt(st[_M2] / (n - 1)) if n > 1 else 0.0,
+			"min": st[_MIN],
+			"max": st[_MAX],
+		}
+
+	def rows(self) -> List[Dict[str, Any]]:
+		"""One dict per test: ``id``, ``outcome``, ``flake`` and the :meth:`duration` fields."""
+		out = []
+		for tid, st in self.tests.items():
+			row: Dict[str, Any] = {"id": tid, "outcome": st[_OUTCOME], "flake": st[_FLAKE]}
+			row.update(self.duration(tid) or {"n": 0})
+			out.append(row)
+		return out
+
+
+def update_stats_file(path: str | os.PathLike, rows: Iterable[Dict[str, Any]]) -> RollingStats:
+	"""Locked load -> :meth:`RollingStats.update` -> atomic save of ``path``."""
+	os.makedirs(os.path.dirname(os.fspath(path)) or ".", exist_ok=True)
+	with file_lock(f"{os.fspath(path)}.lock", exclusive=True):
+		stats = RollingStats.load(path)
+		stats.update(rows)
+		stats.save(path)
+	return stats
+
+
+__all__ = ["RollingStats", "update_stats_file", "FIELDS", "STATS_VERSION"]
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+"""Test ordering helpers driven by historical durations.
+
+``order_by_duration`` implements longest-processing-time-first (LPT): with
+the longest tests dispatched first, xdist workers pick up the short tail at
+the end and finish at about the same time. ``lpt_makespan`` simulates that
+greedy assignment to predict the wall clock of the slowest worker.
+
+``order_by_risk`` puts likely failures first (recent failures, outcome
+flips, flaky tests; shortest first within a tier) to cut time-to-first-failure.
+
+``plan_shards`` applies the same greedy partition across CI nodes, moving
+whole test modules so module-scoped fixtures are set up on one node only.
+"""
+
+import heapq
+import statistics
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from .baseline import compute_flake_scores
+from .snapio import FAILED_OUTCOMES
+
+UNKNOWN_PLACEMENT = ("first", "last")
+# How many recent history runs count as "recently failed".
+RISK_WINDOW = 3
+
+
+def order_by_duration(
+	nodeids: Sequence[str],
+	durations: Dict[str, float],
+	*,
+	unknown: str = "first",
+) -> List[int]:
+	"""Indices of ``nodeids`` sorted longest first.
+
+	Tests without a recorded duration keep their collection order and go
+	before (``unknown="first"``) or after (``"last"``) all known tests. Ties
+	keep collection order, so the result is deterministic across xdist workers.
+	"""
+	known = [i for i, nid in enumerate(nodeids) if nid in durations]
+	missing = [i for i, nid in enumerate(nodeids) if nid not in durations]
+	known.sort(key=lambda i: -durations[nodeids[i]])
+	return missing + known if unknown == "first" else known + missing
+
+
+def lpt_makespan(durations: Iterable[float], workers: int) -> float:
+	"""Makespan of greedily assigning ``durations`` (in order) to the least loaded worker."""
+	loads = [0.0] * max(1, workers)
+	for d in durations:
+		heapq.heapreplace(loads, loads[0] + d)
+	return max(loads)
+
+
+def risk_tiers(history: List[dict], *, window: int = RISK_WINDOW) -> Dict[str, Tuple[int, float]]:
+	"""``id -> (tier, -flake score)`` for tests worth running early.
+
+	Tier 0 failed in the latest run, tier 1 failed within the last ``window``
+	runs or changed outcome between the last two, tier 2 has a non-zero flake
+	score. Everything else is absent.
+	"""
+	runs = [
+		{t["id"]: t.get("outcome") for t in run.get("tests", []) if isinstance(t, dict) and t.get("id")}
+		for run in history
+		if isinstance(run, dict)
+	]
+	flake = compute_flake_scores(history)
+	tiers: Dict[str, Tuple[int, float]] = {}
+	last = runs[-1] if runs else {}
+	for tid, out in last.items():
+		if out in FAILED_OUTCOMES:
+			tiers[tid] = (0, -flake.get(tid, 0.0))
+	for run in runs[-window:]:
+		for tid, out in run.items():
+			if out in FAILED_OUTCOMES:
+				tiers.setdefault(tid, (1, -flake.get(tid, 0.0)))
+	if len(runs) >= 2:
+		prev = runs[-2]
+		for tid, out in last.items():
+			if tid in prev and prev[tid] != out:
+				tiers.setdefault(tid, (1, -flake.get(tid, 0.0)))
+	for tid, score in flake.items():
+		if score > 0:
+			tiers.setdefault(tid, (2, -score))
+	return tiers
+
+
+def order_by_risk(
+	nodeids: Sequence[str],
+	durations: Dict[str, float],
+	history: List[dict],
+	*,
+	unknown: str = "first",
+) -> Tuple[List[int], int]:
+	"""Risky tests (see :func:`risk_tiers`) first, then the rest longest first.
+
+	Within a tier the higher flake score and then the shorter test runs
+	first, so a likely failure surfaces as early as possible. Returns the
+	indices and how many of them were risky.
+	"""
+	tiers = risk_tiers(history)
+	risky = [i for i, nid in enumerate(nodeids) if nid in tiers]
+	risky.sort(key=lambda i: (tiers[nodeids[i]], durations.get(nodeids[i], 0.0)))
+	rest = [i for i, nid in enumerate(nodeids) if nid not in tiers]
+	tail = order_by_duration([nodeids[i] for i in rest], durations, unknown=unknown)
+	return risky + [rest[j] for j in tail], len(risky)
+
+
+def module_of(nodeid: str) -> str:
+	return nodeid.split("::", 1)[0]
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+	"""``"i/N"`` -> ``(i, N)`` with 1 <= i <= N."""
+	try:
+		i, n = (int(x) for x in spec.split("/"))
+	except ValueError:
+		raise ValueError(f"expected INDEX/TOTAL (e.g. 2/12), got {spec!r}") from None
+	if n < 1 or not 1 <= i <= n:
+		raise ValueError(f"shard index must be within 1..{n}, got {spec!r}")
+	return i, n
+
+
+def plan_shards(
+	nodeids: Sequence[str],
+	durations: Dict[str, float],
+	total: int,
+	*,
+	by_module: bool = True,
+) -> Tuple[List[int], List[float]]:
+	"""Assign every node id to one of ``total`` shards (0-based) balancing duration.
+
+	Groups (modules, or single tests with ``by_module=False``) are placed
+	largest first onto the least loaded shard. Tests missing from
+	``durations`` are weighted with the median known duration (1.0 without
+	any history), so new tests still spread evenly. Ties keep collection
+	order and go to the lowest shard: every CI node computes the same plan
+	from the same collection and baseline. Returns the shard per node id and
+	the predicted load per shard.
+	"""
+	if total < 1:
+		raise ValueError("total must be >= 1")
+	get = durations.get
+	weights: List[float] = [get(nid, -1.0) for nid in nodeids]
+	if -1.0 in weights:
+		fallback = statistics.median(durations.values()) if durations else 1.0
+		weights = [fallback if w == -1.0 else w for w in weights]
+	if by_module:
+		group_ix: Dict[str, int] = {}
+		members: List[int] = []
+		gw: List[float] = []
+		for nid, w in zip(nodeids, weights):
+			mod = nid.partition("::")[0]
+			g = group_ix.get(mod)
+			if g is None:
+				g = group_ix[mod] = len(gw)
+				gw.append(0.0)
+			gw[g] += w
+			members.append(g)
+	else:
+		members, gw = list(range(len(weights))), weights
+	heap = [(0.0, s) for s in range(total)]
+	shard_of = [0] * len(gw)
+	# Stable sort: equal weights keep collection order.
+	for g in sorted(range(len(gw)), key=gw.__getitem__, reverse=True):
+		load, s = heap[0]
+		shard_of[g] = s
+		heapq.heapreplace(heap, (load + gw[g], s))
+	loads = [0.0] * total
+	for load, s in heap:
+		loads[s] = load
+	return [shard_of[g] for g in members], loads
+
+
+__all__ = [
+	"order_by_duration",
+	"order_by_risk",
+	"risk_tiers",
+	"lpt_makespan",
+	"plan_shards",
+	"parse_shard",
+	"module_of",
+	"UNKNOWN_PLACEMENT",
+]
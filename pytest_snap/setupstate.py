@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+"""Guarded access to pytest's private fixture setup stack.
+
+pytest has no public API to finalize fixtures ahead of the runner (outcome
+cache hits, ``--snap-cache``) or to set an item's function fixtures up again
+(``--snap-repeat``). Both go through this module, which only touches
+``Session._setupstate`` (``teardown_exact`` / ``setup``), ``Stash._storage``
+and ``Function._initrequest`` after checking each one exists. When a pytest
+release drops any of them the callers fall back to public behaviour and
+:func:`warn_unsupported` says so once per run.
+
+Tested against pytest 8.0 - 8.4 and 9.0 - 9.1 (:data:`TESTED_PYTEST`).
+"""
+
+import warnings
+from typing import Any, Dict, Optional, Set
+
+import pytest
+
+TESTED_PYTEST = ("8.0", "8.1", "8.2", "8.3", "8.4", "9.0", "9.1")
+
+_warned_key = pytest.StashKey[Set[str]]()
+
+
+def _setupstate(item: pytest.Item) -> Any:
+	return getattr(item.session, "_setupstate", None)
+
+
+def can_teardown(item: pytest.Item) -> bool:
+	"""Whether fixtures of ``item``'s session can be finalized with :func:`teardown_exact`."""
+	return hasattr(_setupstate(item), "teardown_exact")
+
+
+def can_refresh(item: pytest.Item) -> bool:
+	"""Whether :func:`refresh_function_fixtures` can run for ``item``."""
+	state = _setupstate(item)
+	return (
+		hasattr(state, "teardown_exact")
+		and hasattr(state, "setup")
+		and hasattr(item.stash, "_storage")
+		# Python test functions hold their fixture request and funcargs; other items have none.
+		and (hasattr(item, "_initrequest") or not isinstance(item, pytest.Function))
+	)
+
+
+def teardown_exact(item: pytest.Item, nextitem: Optional[pytest.Item]) -> None:
+	"""Finalize every fixture ``nextitem`` does not share with ``item`` (all of them when ``None``)."""
+	_setupstate(item).teardown_exact(nextitem)
+
+
+def stash_entries(item: pytest.Item) -> Dict[object, object]:
+	"""Copy of ``item``'s stash, for :func:`refresh_function_fixtures`."""
+	return dict(getattr(item.stash, "_storage", {}))
+
+
+def refresh_function_fixtures(item: pytest.Item, stashed: Dict[object, object]) -> None:
+	"""Finalize ``item``'s function-scoped fixtures and set them up afresh.
+
+	Only the item is popped off the setup stack (its parent's chain is still
+	needed), so module / class / session fixtures are kept. Finalizers may
+	consume per-phase stash entries written by report hooks (``tmp_path`` does);
+	the entries ``stashed`` at the start of the call phase are put back first.
+	"""
+	storage = getattr(item.stash, "_storage")  # checked by can_refresh()
+	for key, value in stashed.items():
+		storage.setdefault(key, value)
+	state = _setupstate(item)
+	state.teardown_exact(item.parent)
+	init = getattr(item, "_initrequest", None)  # new fixture request and funcargs (python items)
+	if init is not None:
+		init()
+	state.setup(item)
+
+
+def warn_unsupported(config: pytest.Config, feature: str, fallback: str) -> None:
+	"""Warn (once per run and ``feature``) that this pytest lacks the internals ``feature`` needs."""
+	warned = config.stash.setdefault(_warned_key, set())
+	if feature in warned:
+		return
+	warned.add(feature)
+	warnings.warn(pytest.PytestWarning(
+		f"pytest-snap: {feature} needs pytest internals missing from pytest {pytest.__version__} "
+		f"(tested with {', '.join(TESTED_PYTEST)}); {fallback}"
+	))
+
+
+__all__ = [
+	"TESTED_PYTEST",
+	"can_refresh",
+	"can_teardown",
+	"refresh_function_fixtures",
+	"stash_entries",
+	"teardown_exact",
+	"warn_unsupported",
+]
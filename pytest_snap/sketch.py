@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+"""Mergeable per-test duration quantile sketches (``--snap-sketches``).
+
+Budget checks over a long history would otherwise keep every observed
+duration and sort it for each quantile. A merging t-digest summarises any
+number of durations in at most ~``compression`` centroids, answers every
+quantile from them and is accurate where budgets look (relative error is
+smallest near p0 / p100, the centroids there are tiny). Two digests merge by
+recompressing their centroids together, so sketches written by parallel CI
+shards combine into one (``pytest-snap merge-sketches``).
+
+The sketch file holds one digest per test, and one of the per-run total per
+module and directory (for ``sum:`` budgets, see :mod:`pytest_snap.budgets`)::
+
+	{"version": 1, "compression": 100, "runs": 812, "updated_at": "...",
+	 "tests": {"tests/test_x.py::test_a": {"n": 812, "min": 0.11, "max": 0.93,
+	                                       "c": [0.112, 1, 0.118, 3, ...]}},
+	 "groups": {"tests/test_x.py": {...}, "tests/": {...}}}
+
+``c`` lists ``mean, weight`` pairs in ascending order. Updates run under an
+``fcntl`` lock on ``<path>.lock`` and replace the file atomically, like
+:mod:`pytest_snap.rolling`.
+"""
+
+import json
+import math
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .budgets import group_totals
+from .history import file_lock
+
+SKETCH_VERSION = 1
+COMPRESSION = 100
+
+
+class TDigest:
+	"""Merging t-digest (k1 scale function) over float samples."""
+
+	__slots__ = ("compression", "count", "min", "max", "_means", "_weights", "_buffer")
+
+	def __init__(self, compression: int = COMPRESSION):
+		self.compression = compression
+		self.count = 0
+		self.min = math.inf
+		self.max = -math.inf
+		self._means: List[float] = []
+		self._weights: List[int] = []
+		self._buffer: List[float] = []
+
+	def add(self, value: float) -> None:
+		value = float(value)
+		self._buffer.append(value)
+		self.count += 1
+		if value < self.min:
+			self.min = value
+		if value > self.max:
+			self.max = value
+		if len(self._buffer) >= 5 * self.compression:
+			self._compress()
+
+	def update(self, values: Iterable[float]) -> None:
+		for v in values:
+			self.add(v)
+
+	def merge(self, other: "TDigest") -> None:
+		"""Fold ``other`` into this digest (order of merges does not matter beyond rounding)."""
+		if not other.count:
+			return
+		other._compress()
+		self._compress()
+		self._means.extend(other._means)
+		self._weights.extend(other._weights)
+		self.count += other.count
+		self.min = min(self.min, other.min)
+		self.max = max(self.max, other.max)
+		self._compress(force=True)
+
+	def _k_step(self, q: float) -> float:
+		# Largest cumulative fraction one centroid starting at q may reach:
+		# k1(q) = delta / (2 pi) * asin(2q - 1), one unit of k per centroid.
+		k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+		if k >= self.compression / 4:
+			return 1.0
+		return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+	def _compress(self, force: bool = False) -> None:
+		if not self._buffer and not force:
+			return
+		if self._buffer:
+			self._buffer.sort()
+			pairs: List[Tuple[float, int]] = sorted(
+				list(zip(self._means, self._weights)) + [(v, 1) for v in self._buffer]
+			)
+			self._buffer = []
+		else:
+			pairs = sorted(zip(self._means, self._weights))
+		if not pairs:
+			return
+		total = self.count
+		means: List[float] = []
+		weights: List[int] = []
+		cur_mean, cur_w = pairs[0]
+		done = 0
+		limit = self._k_step(0.0) * total
+		for mean, w in pairs[1:]:
+			if done + cur_w + w <= limit:
+				cur_w += w
+				cur_mean += (mean - cur_mean) * w / cur_w
+			else:
+				means.append(cur_mean)
+				weights.append(cur_w)
+				done += cur_w
+				limit = self._k_step(done / total) * total
+				cur_mean, cur_w = mean, w
+		means.append(cur_mean)
+		weights.append(cur_w)
+		self._means, self._weights = means, weights
+
+	def centroids(self) -> List[Tuple[float, int]]:
+		self._compress()
+		return list(zip(self._means, self._weights))
+
+	def quantile(self, q: float) -> Optional[float]:
+		"""Estimated ``q``-quantile (``0 <= q <= 1``); ``None`` when empty."""
+		if not self.count:
+			return None
+		self._compress()
+		if q <= 0:
+			return self.min
+		if q >= 1:
+			return self.max
+		means, weights = self._means, self._weights
+		if len(means) == 1:
+			return means[0]
+		rank = q * self.count
+		# Interpolate between centroid centres; the outer halves reach min / max.
+		if rank < weights[0] / 2:
+			return self.min + (means[0] - self.min) * rank / (weights[0] / 2)
+		cum = weights[0] / 2
+		for i in range(len(means) - 1):
+			step = (weights[i] + weights[i + 1]) / 2
+			if rank < cum + step:
+				return means[i] + (means[i + 1] - means[i]) * (rank - cum) / step
+			cum += step
+		tail = weights[-1] / 2
+		return means[-1] + (self.max - means[-1]) * min(1.0, (rank - cum) / tail)
+
+	def to_json(self) -> Dict[str, Any]:
+		flat: List[float] = []
+		for mean, w in self.centroids():
+			flat += (mean, w)
+		return {"n": self.count, "min": self.min, "max": self.max, "c": flat}
+
+	@classmethod
+	def from_json(cls, raw: Dict[str, Any], compression: int = COMPRESSION) -> "TDigest":
+		d = cls(compression)
+		flat = raw.get("c") or []
+		d._means = [float(m) for m in flat[0::2]]
+		d._weights = [int(w) for w in flat[1::2]]
+		d.count = sum(d._weights)
+		if d.count:
+			d.min = float(raw.get("min", d._means[0]))
+			d.max = float(raw.get("max", d._means[-1]))
+		return d
+
+
+class DurationSketches:
+	"""One :class:`TDigest` of whole-test durations (seconds) per test id."""
+
+	def __init__(self, compression: int = COMPRESSION):
+		self.compression = compression
+		self.tests: Dict[str, TDigest] = {}
+		self.groups: Dict[str, TDigest] = {}
+		self.runs = 0
+		self.updated_at: Optional[str] = None
+
+	@classmethod
+	def load(cls, path: str | os.PathLike) -> "DurationSketches":
+		"""Sketches in ``path``; empty when missing, unreadable or of another version."""
+		try:
+			with open(path, encoding="utf-8") as f:
+				raw = json.load(f)
+		except (OSError, ValueError):
+			return cls()
+		if not isinstance(raw, dict) or raw.get("version") != SKETCH_VERSION:
+			return cls()
+		out = cls(int(raw.get("compression") or COMPRESSION))
+		for section, into in (("tests", out.tests), ("groups", out.groups)):
+			for key, d in (raw.get(section) or {}).items():
+				if isinstance(d, dict):
+					into[key] = TDigest.from_json(d, out.compression)
+		out.runs = int(raw.get("runs") or 0)
+		out.updated_at = raw.get("updated_at")
+		return out
+
+	def save(self, path: str | os.PathLike) -> None:
+		doc = {
+			"version": SKETCH_VERSION,
+			"compression": self.compression,
+			"runs": self.runs,
+			"updated_at": self.updated_at,
+			"tests": {tid: d.to_json() for tid, d in self.tests.items()},
+			"groups": {g: d.to_json() for g, d in self.groups.items()},
+		}
+		tmp = f"{os.fspath(path)}.{os.getpid()}.tmp"
+		os.makedirs(os.path.dirname(os.fspath(path)) or ".", exist_ok=True)
+		with open(tmp, "w", encoding="utf-8") as f:
+			json.dump(doc, f, separators=(",", ":"))
+		os.replace(tmp, path)
+
+	def _digest(self, tid: str, into: Optional[Dict[str, TDigest]] = None) -> TDigest:
+		into = self.tests if into is None else into
+		d = into.get(tid)
+		if d is None:
+			d = into[tid] = TDigest(self.compression)
+		return d
+
+	def update(self, rows: Iterable[Dict[str, Any]]) -> None:
+		"""Add one run's ``{"id", "duration"}`` rows (a test reported twice counts once, last wins).
+
+		Module and directory totals of the run go to :attr:`groups`.
+		"""
+		latest = {r.get("id"): r.get("duration") for r in rows}
+		timed = {tid: d for tid, d in latest.items() if tid and isinstance(d, (int, float)) and not isinstance(d, bool)}
+		for tid, d in timed.items():
+			self._digest(tid).add(d)
+		for g, total in group_totals(timed).items():
+			self._digest(g, self.groups).add(total)
+		self.runs += 1
+		self._touch()
+
+	def merge(self, other: "DurationSketches") -> None:
+		"""Fold another shard's sketches into these (per test)."""
+		for tid, d in other.tests.items():
+			self._digest(tid).merge(d)
+		for g, d in other.groups.items():
+			self._digest(g, self.groups).merge(d)
+		self.runs += other.runs
+		self._touch()
+
+	def _touch(self) -> None:
+		self.updated_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+	def quantile(self, tid: str, q: float) -> Optional[float]:
+		d = self.tests.get(tid)
+		return d.quantile(q) if d is not None else None
+
+
+def update_sketch_file(path: str | os.PathLike, rows: Iterable[Dict[str, Any]]) -> DurationSketches:
+	"""Locked load -> :meth:`DurationSketches.update` -> atomic save of ``path``."""
+	os.makedirs(os.path.dirname(os.fspath(path)) or ".", exist_ok=True)
+	with file_lock(f"{os.fspath(path)}.lock", exclusive=True):
+		sketches = DurationSketches.load(path)
+		sketches.update(rows)
+		sketches.save(path)
+	return sketches
+
+
+def merge_sketch_files(paths: Sequence[str | os.PathLike]) -> DurationSketches:
+	"""Sketch files of parallel shards merged into one (not written)."""
+	merged: Optional[DurationSketches] = None
+	for p in paths:
+		s = DurationSketches.load(p)  # files are replaced atomically, no lock needed to read
+		if merged is None:
+			merged = s
+		else:
+			merged.merge(s)
+	return merged if merged is not None else DurationSketches()
+
+
+__all__ = [
+	"TDigest",
+	"DurationSketches",
+	"update_sketch_file",
+	"merge_sketch_files",
+	"COMPRESSION",
+	"SKETCH_VERSION",
+]
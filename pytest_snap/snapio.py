@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+"""Snapshot file I/O shared by the plugin, baseline helpers and the CLI.
+
+Two on-disk layouts are supported and auto-detected on read:
+
+* whole JSON: a single object (``{"started_ns": ..., "results": [...]}``).
+* JSONL stream: a header line, one line per result and a footer line::
+
+	{"snap": "header", "started_ns": ..., "env": {...}}
+	{"nodeid": "tests/test_x.py::test_foo", "outcome": "passed", "dur_ns": 123}
+	{"snap": "footer", "finished_ns": ..., "count": 1}
+
+A stream without a footer (killed / timed-out run) or with a torn last line
+is still readable; the loaded snapshot is then flagged ``"partial": true``.
+
+:func:`normalize_tests` flattens both the plugin ``results`` schema and the
+legacy ``tests`` schema into uniform rows measured in seconds.
+
+Binary columnar snapshots (``--snap-format bin``, see
+:mod:`pytest_snap.columnar`) are recognised by their magic bytes. Any layout
+may be gzip / xz / zstd compressed (see :mod:`pytest_snap.compress`).
+"""
+
+import datetime
+import io
+import json
+import os
+from typing import IO, Any, Dict, List, Optional
+
+from .columnar import INT_NONE, MAGIC, ColumnarResults, is_columnar, load_columnar
+from .compress import codec_for, open_binary, open_text
+
+KIND_KEY = "snap"
+# Compressed streams are sync-flushed every N records instead of every line,
+# which would ruin the compression ratio; at most N results are lost on a crash.
+COMPRESSED_FLUSH_EVERY = 256
+PHASES = ("setup", "call", "teardown")
+# Outcomes of a failing test: diffs, counts, transitions and scheduling all use this set.
+FAILED_OUTCOMES = frozenset({"failed", "error", "budget_exceeded"})
+
+
+class SnapshotStreamWriter:
+	"""Append-only JSONL snapshot writer.
+
+	The file is opened line buffered so every record reaches the OS as soon as
+	it is written; a crashed run leaves a readable (partial) snapshot behind
+	and nothing accumulates in memory. A ``.gz`` / ``.xz`` / ``.zst`` path is
+	compressed and flushed every ``COMPRESSED_FLUSH_EVERY`` records.
+	"""
+
+	def __init__(self, path: str, *, started_ns: Optional[int], env: Dict[str, Any]):
+		self.path = path
+		self.count = 0
+		os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		self._flush_every = COMPRESSED_FLUSH_EVERY if codec_for(path) else 0
+		self._fh: Optional[IO[str]] = open_text(path, "w", line_buffering=not self._flush_every)
+		self._write({KIND_KEY: "header", "started_ns": started_ns, "env": env})
+
+	def _write(self, obj: Dict[str, Any]) -> None:
+		assert self._fh is not None
+		self._fh.write(json.dumps(obj, separators=(",", ":")) + "\n")
+
+	def write_result(self, record: Dict[str, Any]) -> None:
+		self._write(record)
+		self.count += 1
+		if self._flush_every and self.count % self._flush_every == 0:
+			self._fh.flush()  # type: ignore[union-attr]
+
+	def close(self, *, finished_ns: Optional[int], **extra: Any) -> None:
+		if self._fh is None:
+			return
+		self._write({KIND_KEY: "footer", "finished_ns": finished_ns, "count": self.count, **extra})
+		self._fh.close()
+		self._fh = None
+
+
+def _read_jsonl(header: Dict[str, Any], lines) -> Dict[str, Any]:
+	data: Dict[str, Any] = {k: v for k, v in header.items() if k != KIND_KEY}
+	results: List[Dict[str, Any]] = []
+	footer: Optional[Dict[str, Any]] = None
+	it = iter(lines)
+	while True:
+		try:
+			line = next(it)
+		except StopIteration:
+			break
+		except Exception:
+			# Truncated compressed stream (EOFError / codec error): keep what decoded.
+			break
+		if not line.strip():
+			continue
+		try:
+			obj = json.loads(line)
+		except ValueError:
+			# Torn write at the end of a killed run; everything before it is intact.
+			break
+		if not isinstance(obj, dict):
+			continue
+		if obj.get(KIND_KEY) == "footer":
+			footer = obj
+			break
+		results.append(obj)
+	data["results"] = results
+	if footer is None:
+		data["finished_ns"] = None
+		data["partial"] = True
+	else:
+		data.update({k: v for k, v in footer.items() if k not in {KIND_KEY, "count"}})
+	return data
+
+
+def load_snapshot(path: str | os.PathLike) -> dict:
+	"""Load a snapshot in whole-JSON, JSONL or binary columnar layout.
+
+	Compressed files are decompressed on the fly while parsing.
+	"""
+	with open_binary(path, "rb") as fb:
+		if is_columnar(fb.peek(len(MAGIC))[: len(MAGIC)]):  # type: ignore[attr-defined]
+			return load_columnar(fb.read())
+		f = io.TextIOWrapper(fb, encoding="utf-8")
+		first = f.readline()
+		try:
+			head = json.loads(first)
+		except ValueError:
+			head = None
+		if isinstance(head, dict) and head.get(KIND_KEY) == "header":
+			return _read_jsonl(head, f)
+		return json.loads(first + f.read())
+
+
+def normalize_tests(snapshot: Optional[dict]) -> List[Dict[str, Any]]:
+	"""Return one ``{"id", "outcome", "duration", ...}`` row per test.
+
+	Plugin ``results`` entries are converted: ``nodeid`` becomes ``id``,
+	``dur_ns`` becomes ``duration`` and every other ``<name>_ns`` field becomes
+	``<name>`` in seconds (so ``setup_ns`` -> ``setup``). Legacy ``tests`` entries
+	already use seconds and are passed through.
+	"""
+	if not snapshot:
+		return []
+	out: List[Dict[str, Any]] = []
+	if "tests" in snapshot:
+		for t in snapshot.get("tests", []):
+			if not isinstance(t, dict):
+				continue
+			row = dict(t)
+			if not isinstance(row.get("duration"), (int, float)):
+				row["duration"] = None
+			out.append(row)
+		return out
+	for r in snapshot.get("results", []):
+		if not isinstance(r, dict):
+			continue
+		flat: Dict[str, Any] = {"id": r.get("nodeid"), "outcome": r.get("outcome"), "duration": None}
+		for k, v in r.items():
+			if k in {"nodeid", "outcome"}:
+				continue
+			if k == "dur_ns":
+				flat["duration"] = v / 1e9 if isinstance(v, (int, float)) else None
+			elif k.endswith("_ns") and isinstance(v, (int, float)):
+				flat[k[:-3]] = v / 1e9
+			else:
+				flat[k] = v
+		out.append(flat)
+	return out
+
+
+def snapshot_origin(snapshot: Optional[dict], path: str | os.PathLike) -> Dict[str, str]:
+	"""``created_at`` (ISO, UTC) and ``git_commit`` of a snapshot.
+
+	Plugin snapshots carry neither at the top level: the commit may sit in
+	``env`` and the creation time falls back to the file's modification time.
+	"""
+	data = snapshot or {}
+	created = data.get("created_at")
+	if not created:
+		mtime = os.stat(path).st_mtime
+		created = datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+	commit = data.get("git_commit") or (data.get("env") or {}).get("git_commit") or "unknown"
+	return {"created_at": created, "git_commit": commit}
+
+
+def normalize_fixtures(snapshot: Optional[dict]) -> Dict[str, Dict[str, Any]]:
+	"""Index the ``fixtures`` table by ``"<scope>:<name>"`` with times in seconds."""
+	out: Dict[str, Dict[str, Any]] = {}
+	for fx in (snapshot or {}).get("fixtures", []) or []:
+		if not isinstance(fx, dict) or not fx.get("name"):
+			continue
+		count = int(fx.get("count") or 0)
+		total = float(fx.get("total_ns") or 0) / 1e9
+		out[f"{fx.get('scope')}:{fx['name']}"] = {
+			"name": fx["name"],
+			"scope": fx.get("scope"),
+			"count": count,
+			"total": total,
+			"max": float(fx.get("max_ns") or 0) / 1e9,
+			"mean": total / count if count else 0.0,
+			"tests": [t.get("nodeid") for t in fx.get("tests", []) if isinstance(t, dict)],
+		}
+	return out
+
+
+def duration_index(snapshot: Optional[dict]) -> Dict[str, float]:
+	"""``id -> seconds`` (setup + call + teardown when recorded) for every test.
+
+	Binary snapshots are read straight from their columns, without a dict per test.
+	"""
+	results = (snapshot or {}).get("results")
+	if isinstance(results, ColumnarResults):
+		cols = results.columns
+		phases = []
+		for ph in PHASES:
+			col = cols.column(f"{ph}_ns")
+			if col is not None:
+				phases.append(col)
+		if not phases:
+			dur = cols.column("dur_ns")
+			phases = [dur] if dur is not None else []
+		out: Dict[str, float] = {}
+		for i, nid in enumerate(cols.nodeids):
+			vals = [c[i] for c in phases if c[i] != INT_NONE]
+			if vals:
+				out[nid] = sum(vals) / 1e9
+		return out
+	index: Dict[str, float] = {}
+	for row in normalize_tests(snapshot):
+		d = total_duration(row)
+		if row.get("id") and d is not None:
+			index[row["id"]] = d
+	return index
+
+
+def sample_summary(samples_ns: List[int]) -> Dict[str, int]:
+	"""Median / min / MAD of repeated call timings (``--snap-repeat``), as result fields.
+
+	The median becomes ``call_ns`` (and ``dur_ns``) so every consumer of the
+	plain fields gets the robust value.
+	"""
+	ordered = sorted(samples_ns)
+	n = len(ordered)
+	mid = n // 2
+	median = ordered[mid] if n % 2 else (ordered[mid - 1] + ordered[mid]) // 2
+	dev = sorted(abs(v - median) for v in ordered)
+	mad = dev[mid] if n % 2 else (dev[mid - 1] + dev[mid]) // 2
+	return {"call_ns": median, "call_min_ns": ordered[0], "call_mad_ns": mad, "samples": n}
+
+
+# A slowdown must exceed this many MADs of the noisier side to count.
+NOISE_MADS = 3.0
+
+
+def noise_floor(prev: Dict[str, Any], curr: Dict[str, Any], k: float = NOISE_MADS) -> float:
+	"""Seconds of change explainable by sampling noise (0 unless repeated samples were recorded)."""
+	mads = [row.get("call_mad") for row in (prev, curr)]
+	return k * max((m for m in mads if isinstance(m, (int, float))), default=0.0)
+
+
+def outcome_bucket(outcome: Any) -> str:
+	"""Count bucket of an outcome: ``failed`` (any of :data:`FAILED_OUTCOMES`), ``passed``, ``xfailed``, ``xpassed`` or ``other``."""
+	if outcome in FAILED_OUTCOMES:
+		return "failed"
+	if outcome in ("passed", "xfailed", "xpassed"):
+		return outcome
+	if outcome in ("xfail", "xpass"):  # legacy spelling
+		return outcome + "ed"
+	return "other"
+
+
+def total_duration(row: Dict[str, Any]) -> Optional[float]:
+	"""Setup + call + teardown seconds when phases were captured, else ``duration``."""
+	phases = [row[ph] for ph in PHASES if isinstance(row.get(ph), (int, float))]
+	if phases:
+		return float(sum(phases))
+	d = row.get("duration")
+	return float(d) if isinstance(d, (int, float)) else None
+
+
+# Sortable / gateable per-test fields beyond wall clock (see ``--snap-resources``).
+# ``cpu`` is derived: user + system CPU seconds.
+RESOURCE_METRICS = ("cpu", "cpu_user", "cpu_sys", "thread_cpu", "ctx_vol", "ctx_invol", "rss_peak_delta_kb")
+METRICS = ("duration",) + PHASES + RESOURCE_METRICS
+
+
+def metric_value(row: Dict[str, Any], metric: str) -> Optional[float]:
+	"""Value of ``metric`` for a normalized row (``None`` when not recorded)."""
+	if metric == "duration":
+		return total_duration(row)
+	if metric == "cpu":
+		u, s = row.get("cpu_user"), row.get("cpu_sys")
+		if isinstance(u, (int, float)) and isinstance(s, (int, float)):
+			return float(u + s)
+		return None
+	v = row.get(metric)
+	return float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else None
+
+
+def format_metric(metric: str, value: float) -> str:
+	if metric in {"ctx_vol", "ctx_invol"}:
+		return f"{value:.0f}"
+	if metric == "rss_peak_delta_kb":
+		return f"{value:.0f}KiB"
+	return f"{value:.3f}s"
+
+
+def phase_deltas(prev: Dict[str, Any], curr: Dict[str, Any]) -> Dict[str, float]:
+	"""Per-phase seconds added between two normalized rows (phases present in both)."""
+	out: Dict[str, float] = {}
+	for ph in PHASES:
+		a, b = prev.get(ph), curr.get(ph)
+		if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+			out[ph] = float(b) - float(a)
+	return out
+
+
+__all__ = [
+	"PHASES",
+	"FAILED_OUTCOMES",
+	"outcome_bucket",
+	"METRICS",
+	"RESOURCE_METRICS",
+	"metric_value",
+	"format_metric",
+	"SnapshotStreamWriter",
+	"load_snapshot",
+	"normalize_tests",
+	"normalize_fixtures",
+	"snapshot_origin",
+	"duration_index",
+	"total_duration",
+	"phase_deltas",
+	"sample_summary",
+	"noise_floor",
+	"NOISE_MADS",
+]
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+"""Significance tests for per-test timing changes (``--perf-stat``).
+
+Each test contributes two samples of durations: the baseline and the current
+run. Samples come from ``--snap-repeat`` (``call_samples_ns`` in both
+snapshots) or, for the baseline side, from the rolling history. Two one-sided
+tests ("is the current run slower?") are available:
+
+* ``mw``: Mann-Whitney U (exact distribution for small tie-free samples,
+  normal approximation with tie correction otherwise). Effect size is the
+  rank-biserial correlation: +1 means every current sample is slower.
+* ``bootstrap``: percentile bootstrap of the difference of medians. The
+  bootstrap distribution of a resampled (lower) median follows from binomial
+  order-statistic probabilities, so it is computed exactly instead of by
+  random resampling: deterministic and fast. Effect size is the difference
+  of medians in seconds, with a 95% interval.
+
+With thousands of tests some p-values are small by chance, so the p-values
+of all tests are adjusted with Benjamini-Hochberg and a test counts as
+slower (or faster) only when its adjusted ``q`` is within ``alpha``.
+"""
+
+import math
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .snapio import total_duration
+
+STAT_METHODS = ("mw", "bootstrap")
+# Exact Mann-Whitney distribution up to this many pairs (n1 * n2).
+EXACT_MAX_PAIRS = 400
+
+
+def _median(xs: Sequence[float]) -> float:
+	s = sorted(xs)
+	n = len(s)
+	return s[n // 2] if n % 2 else (s[n // 2 - 1] + s[n // 2]) / 2
+
+
+@lru_cache(maxsize=None)
+def _u_counts(m: int, n: int) -> Tuple[int, ...]:
+	"""Number of orderings of m vs n items giving each U = 0 .. m*n."""
+	if m == 0 or n == 0:
+		return (1,)
+	out = [0] * (m * n + 1)
+	for u, c in enumerate(_u_counts(m - 1, n)):  # largest item from the first sample
+		out[u + n] += c
+	for u, c in enumerate(_u_counts(m, n - 1)):
+		out[u] += c
+	return tuple(out)
+
+
+def mann_whitney(a: Sequence[float], b: Sequence[float]) -> Tuple[float, float, float]:
+	"""``(U, p, effect)`` for the one-sided alternative "``b`` tends to be larger".
+
+	``U`` counts pairs with ``b_j > a_i`` (ties count half).
+	"""
+	n1, n2 = len(a), len(b)
+	pooled = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+	ranks = [0.0] * len(pooled)
+	ties = 0.0
+	i = 0
+	while i < len(pooled):
+		j = i
+		while j + 1 < len(pooled) and pooled[j + 1][0] == pooled[i][0]:
+			j += 1
+		for k in range(i, j + 1):
+			ranks[k] = (i + j) / 2 + 1
+		t = j - i + 1
+		ties += t ** 3 - t
+		i = j + 1
+	rank_b = sum(r for r, (_, side) in zip(ranks, pooled) if side == 1)
+	u = rank_b - n2 * (n2 + 1) / 2
+	effect = 2 * u / (n1 * n2) - 1
+	if not ties and n1 * n2 <= EXACT_MAX_PAIRS:
+		counts = _u_counts(n2, n1)
+		p = sum(counts[int(u):]) / sum(counts)
+		return u, p, effect
+	n = n1 + n2
+	var = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+	if var <= 0:
+		return u, 1.0, effect
+	z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(var)
+	return u, 0.5 * math.erfc(z / math.sqrt(2)), effect
+
+
+def _median_distribution(xs: Sequence[float]) -> List[Tuple[float, float]]:
+	"""Exact bootstrap distribution ``[(value, probability)]`` of the lower median of a resample."""
+	s = sorted(xs)
+	n = len(s)
+	need = (n - 1) // 2 + 1  # draws <= v needed for the lower median to be <= v
+	out = []
+	prev = 0.0
+	for v in sorted(set(s)):
+		q = bisect_right(s, v) / n
+		cdf = sum(math.comb(n, i) * q ** i * (1 - q) ** (n - i) for i in range(need, n + 1))
+		out.append((v, cdf - prev))
+		prev = cdf
+	return out
+
+
+def bootstrap_median_diff(a: Sequence[float], b: Sequence[float]) -> Tuple[float, float, float, float, float]:
+	"""``(delta, ci_low, ci_high, p, p_faster)`` for median(b) - median(a).
+
+	The interval is the 95% percentile interval of the bootstrap distribution;
+	``p`` / ``p_faster`` are its mass at ``<= 0`` / ``>= 0`` (one-sided).
+	"""
+	diffs = sorted(
+		(vb - va, pa * pb) for va, pa in _median_distribution(a) for vb, pb in _median_distribution(b)
+	)
+	lo: Optional[float] = None
+	hi = diffs[-1][0]
+	cum = 0.0
+	for d, w in diffs:
+		cum += w
+		if lo is None and cum >= 0.025:
+			lo = d
+		if cum >= 0.975:
+			hi = d
+			break
+	p = sum(w for d, w in diffs if d <= 0)
+	p_faster = sum(w for d, w in diffs if d >= 0)
+	return _median(b) - _median(a), lo if lo is not None else diffs[0][0], hi, min(p, 1.0), min(p_faster, 1.0)
+
+
+def benjamini_hochberg(pvalues: Sequence[float]) -> List[float]:
+	"""Adjusted q-values (false discovery rate) in the input order."""
+	m = len(pvalues)
+	order = sorted(range(m), key=lambda i: pvalues[i])
+	q = [1.0] * m
+	running = 1.0
+	for rank in range(m, 0, -1):
+		i = order[rank - 1]
+		running = min(running, pvalues[i] * m / rank)
+		q[i] = min(running, 1.0)
+	return q
+
+
+def compare(
+	samples: Mapping[str, Tuple[Sequence[float], Sequence[float]]],
+	method: str,
+	*,
+	alpha: float = 0.05,
+) -> Dict[str, Dict[str, float]]:
+	"""Test every ``id -> (baseline, current)`` pair and adjust across all of them.
+
+	Each result has ``delta`` (median difference, seconds), ``effect``, ``p``
+	(slower), ``p_faster``, ``q`` / ``q_faster`` (Benjamini-Hochberg) and
+	``slower`` / ``faster`` flags at ``alpha``.
+	"""
+	if method not in STAT_METHODS:
+		raise ValueError(f"unknown method {method!r}; expected one of {STAT_METHODS}")
+	ids = [tid for tid, (a, b) in samples.items() if a and b and len(a) + len(b) >= 3]
+	rows: Dict[str, Dict[str, float]] = {}
+	for tid in ids:
+		a, b = samples[tid]
+		delta = _median(b) - _median(a)
+		if method == "mw":
+			_u, p, effect = mann_whitney(a, b)
+			_u, p_faster, _e = mann_whitney(b, a)
+			rows[tid] = {"delta": delta, "effect": effect, "p": p, "p_faster": p_faster}
+		else:
+			delta, lo, hi, p, p_faster = bootstrap_median_diff(a, b)
+			rows[tid] = {"delta": delta, "effect": delta, "ci_low": lo, "ci_high": hi, "p": p, "p_faster": p_faster}
+	for key, qkey, flag in (("p", "q", "slower"), ("p_faster", "q_faster", "faster")):
+		qs = benjamini_hochberg([rows[t][key] for t in ids])
+		for tid, q in zip(ids, qs):
+			rows[tid][qkey] = q
+			rows[tid][flag] = q <= alpha
+	return rows
+
+
+def samples_of(row: Optional[dict]) -> Optional[List[float]]:
+	"""Repeated call samples of a normalized row, in seconds."""
+	raw = (row or {}).get("call_samples_ns")
+	if isinstance(raw, list) and raw:
+		return [v / 1e9 for v in raw if isinstance(v, (int, float))]
+	return None
+
+
+def pair_samples(
+	prev: Dict[str, dict],
+	curr: Dict[str, dict],
+	history: Optional[Dict[str, List[float]]] = None,
+) -> Dict[str, Tuple[List[float], List[float]]]:
+	"""``id -> (baseline, current)`` seconds for every test with data on both sides.
+
+	Without ``history`` both sides are repeated call samples. With it the
+	baseline is the test's whole-test durations in the history and the current
+	side its whole-test duration (one value per repeat sample when recorded).
+	"""
+	out: Dict[str, Tuple[List[float], List[float]]] = {}
+	for tid, row in curr.items():
+		cur = samples_of(row)
+		if history is not None:
+			base = history.get(tid)
+			total = total_duration(row)
+			if not base or total is None:
+				continue
+			if cur:
+				fixed = sum(float(row[ph]) for ph in ("setup", "teardown") if isinstance(row.get(ph), (int, float)))
+				out[tid] = (base, [fixed + s for s in cur])
+			else:
+				out[tid] = (base, [total])
+			continue
+		base = samples_of(prev.get(tid))
+		if base and cur:
+			out[tid] = (base, cur)
+	return out
+
+
+def history_samples(history: List[dict], *, exclude_run: Optional[str] = None) -> Dict[str, List[float]]:
+	"""``id -> durations`` over the runs of a rolling history (``baseline.load_history``)."""
+	out: Dict[str, List[float]] = {}
+	for run in history:
+		if exclude_run is not None and run.get("run_id") == exclude_run:
+			continue
+		for t in run.get("tests", []):
+			if not isinstance(t, dict):
+				continue
+			d = t.get("duration")
+			if t.get("id") and isinstance(d, (int, float)):
+				out.setdefault(t["id"], []).append(float(d))
+	return out
+
+
+__all__ = [
+	"STAT_METHODS",
+	"mann_whitney",
+	"bootstrap_median_diff",
+	"benjamini_hochberg",
+	"compare",
+	"samples_of",
+	"pair_samples",
+	"history_samples",
+]
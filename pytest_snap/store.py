@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+"""SQLite snapshot store (``pytest-snap ingest``, ``--store sqlite:PATH``).
+
+Snapshot files stay the source of record; the store is an index over them.
+Each ingested snapshot becomes one ``runs`` row (label, origin, outcome
+counts and its non-result sections as JSON) plus one ``results`` row per
+test, keyed by an interned test id. ``failed`` counts every outcome in
+:data:`~pytest_snap.snapio.FAILED_OUTCOMES`; ``other`` counts skips and the
+like::
+
+	runs(id, label UNIQUE, file, size, mtime_ns, created_at, git_commit,
+	     total, passed, failed, xfailed, xpassed, other, meta)
+	tests(id, nodeid UNIQUE)
+	results(run_id, test_id, outcome, duration, fields)   -- PK (run_id, test_id)
+	transitions(run_id, prev_id, new_fail, fixes, regressions)
+
+``results`` is clustered by run (``show`` / ``diff`` read one range) and
+indexed by test (duration series for ``timeline --perf``). ``duration`` is
+the whole-test time in seconds; ``fields`` keeps the rest of the normalized
+row (phases, resources, samples) as JSON, so :meth:`SnapStore.snapshot`
+returns a dict every snapshot consumer accepts. Outcome transitions between
+two runs are computed once with a join and cached in ``transitions``.
+
+:meth:`SnapStore.sync` re-ingests a file only when its size or mtime changed,
+so keeping the store current costs one ``stat`` per snapshot file. Runs stay
+in the store after their file is deleted (archive the JSON, keep the index).
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .snapio import FAILED_OUTCOMES, load_snapshot, normalize_tests, outcome_bucket, snapshot_origin, total_duration
+
+STORE_VERSION = 1
+STORE_SCHEME = "sqlite:"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+	id INTEGER PRIMARY KEY,
+	label TEXT NOT NULL UNIQUE,
+	file TEXT,
+	size INTEGER,
+	mtime_ns INTEGER,
+	created_at TEXT,
+	git_commit TEXT,
+	total INTEGER, passed INTEGER, failed INTEGER, xfailed INTEGER, xpassed INTEGER, other INTEGER,
+	meta TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_time ON runs(created_at, label);
+CREATE TABLE IF NOT EXISTS tests (id INTEGER PRIMARY KEY, nodeid TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS results (
+	run_id INTEGER NOT NULL,
+	test_id INTEGER NOT NULL,
+	outcome TEXT,
+	duration REAL,
+	fields TEXT,
+	PRIMARY KEY (run_id, test_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_by_test ON results(test_id, run_id);
+CREATE TABLE IF NOT EXISTS transitions (
+	run_id INTEGER NOT NULL,
+	prev_id INTEGER NOT NULL,
+	new_fail INTEGER, fixes INTEGER, regressions INTEGER,
+	PRIMARY KEY (run_id, prev_id)
+) WITHOUT ROWID;
+"""
+
+_RUN_COLUMNS = ("id", "label", "file", "created_at", "git_commit", "total", "passed", "failed", "xfailed", "xpassed", "other")
+_FAILED_SQL = "(" + ", ".join(f"'{o}'" for o in sorted(FAILED_OUTCOMES)) + ")"
+
+
+def parse_store(spec: str) -> str:
+	"""``"sqlite:PATH"`` -> ``PATH``."""
+	if not spec.startswith(STORE_SCHEME) or not spec[len(STORE_SCHEME):]:
+		raise ValueError(f"expected sqlite:PATH, got {spec!r}")
+	return spec[len(STORE_SCHEME):]
+
+
+class SnapStore:
+	def __init__(self, path: str):
+		self.path = path
+		os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		self.db = sqlite3.connect(path)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("PRAGMA synchronous=NORMAL")
+		self.db.execute("PRAGMA cache_size=-65536")  # 64 MiB: keeps the by-test index hot while ingesting
+		version = self.db.execute("PRAGMA user_version").fetchone()[0]
+		if version not in (0, STORE_VERSION):
+			raise ValueError(f"{path}: unsupported store version {version}")
+		self.db.executescript(_SCHEMA)
+		self.db.execute(f"PRAGMA user_version = {STORE_VERSION}")
+		self._test_ids: Optional[Dict[str, int]] = None
+		self.errors: List[Tuple[str, str]] = []  # (path, reason) of files sync could not read
+		self._in_batch = False
+
+	def close(self) -> None:
+		self.db.close()
+
+	def __enter__(self) -> "SnapStore":
+		return self
+
+	def __exit__(self, *exc: Any) -> None:
+		self.close()
+
+	def _intern(self, nodeids: Iterable[str]) -> Dict[str, int]:
+		if self._test_ids is None:
+			self._test_ids = {nid: i for i, nid in self.db.execute("SELECT id, nodeid FROM tests")}
+		ids = self._test_ids
+		for nid in nodeids:
+			if nid not in ids:
+				test_id = self.db.execute("INSERT INTO tests(nodeid) VALUES (?)", (nid,)).lastrowid
+				assert test_id is not None  # set by every successful INSERT
+				ids[nid] = test_id
+		return ids
+
+	def _batch(self):
+		# Inside sync() the surrounding transaction commits; alone, ingest commits itself.
+		return contextlib.nullcontext() if self._in_batch else self.db
+
+	def _delete_run(self, run_id: int) -> None:
+		self.db.execute("DELETE FROM results WHERE run_id = ?", (run_id,))
+		self.db.execute("DELETE FROM transitions WHERE run_id = ? OR prev_id = ?", (run_id, run_id))
+		self.db.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+	def ingest(self, label: str, path: str) -> bool:
+		"""Load ``path`` as run ``label`` unless it is unchanged since the last ingest."""
+		st = os.stat(path)
+		row = self.db.execute("SELECT id, file, size, mtime_ns FROM runs WHERE label = ?", (label,)).fetchone()
+		if row is not None and tuple(row[1:]) == (os.path.abspath(path), st.st_size, st.st_mtime_ns):
+			return False
+		data = load_snapshot(path)
+		rows = [t for t in normalize_tests(data) if t.get("id")]
+		counts = {k: 0 for k in ("passed", "failed", "xfailed", "xpassed", "other")}
+		for t in rows:
+			counts[outcome_bucket(t.get("outcome"))] += 1
+		meta = {k: v for k, v in data.items() if k not in {"results", "tests"}}
+		origin = snapshot_origin(data, path)
+		with self._batch():
+			if row is not None:
+				self._delete_run(row[0])
+			run_id = self.db.execute(
+				"INSERT INTO runs(label, file, size, mtime_ns, created_at, git_commit, total, passed, failed, xfailed, xpassed, other, meta)"
+				" VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+				(label, os.path.abspath(path), st.st_size, st.st_mtime_ns, origin["created_at"], origin["git_commit"],
+				 len(rows), counts["passed"], counts["failed"], counts["xfailed"], counts["xpassed"], counts["other"],
+				 json.dumps(meta, separators=(",", ":"), default=str)),
+			).lastrowid
+			assert run_id is not None
+			ids = self._intern(t["id"] for t in rows)
+			self.db.executemany(
+				"INSERT OR REPLACE INTO results(run_id, test_id, outcome, duration, fields) VALUES (?, ?, ?, ?, ?)",
+				((run_id, ids[t["id"]], t.get("outcome"), total_duration(t), _fields(t)) for t in rows),
+			)
+		return True
+
+	def sync(self, snapshots: Iterable[Tuple[str, str]]) -> int:
+		"""Ingest every ``(label, path)`` that is new or changed; returns how many were loaded.
+
+		Unreadable files are skipped and listed in ``errors``.
+		"""
+		loaded = 0
+		# One transaction for the whole sync: a commit per snapshot dominates otherwise.
+		with self.db:
+			self._in_batch = True
+			try:
+				for label, path in snapshots:
+					try:
+						loaded += self.ingest(label, path)
+					except (OSError, ValueError) as exc:
+						self.errors.append((path, str(exc)))
+			finally:
+				self._in_batch = False
+		return loaded
+
+	def runs(self) -> List[Dict[str, Any]]:
+		"""Every run in timeline order (``created_at``, then label)."""
+		cur = self.db.execute(f"SELECT {', '.join(_RUN_COLUMNS)} FROM runs ORDER BY created_at, label")
+		return [dict(zip(_RUN_COLUMNS, r)) for r in cur]
+
+	def has(self, label: str) -> bool:
+		return self.db.execute("SELECT 1 FROM runs WHERE label = ?", (label,)).fetchone() is not None
+
+	def snapshot(self, label: str) -> Optional[dict]:
+		"""Stored run as a snapshot dict (legacy ``tests`` rows, seconds) or ``None``."""
+		row = self.db.execute("SELECT id, meta FROM runs WHERE label = ?", (label,)).fetchone()
+		if row is None:
+			return None
+		data = json.loads(row[1] or "{}")
+		tests = []
+		cur = self.db.execute(
+			"SELECT t.nodeid, r.outcome, r.duration, r.fields FROM results r JOIN tests t ON t.id = r.test_id"
+			" WHERE r.run_id = ? ORDER BY r.test_id",
+			(row[0],),
+		)
+		for nodeid, outcome, duration, fields in cur:
+			t = json.loads(fields) if fields else {}
+			t.update(id=nodeid, outcome=outcome)
+			t.setdefault("duration", duration)
+			tests.append(t)
+		data["tests"] = tests
+		return data
+
+	def transitions(self, run_id: int, prev_id: int) -> Dict[str, int]:
+		"""``new_fail`` / ``fixes`` / ``regressions`` from run ``prev_id`` to ``run_id`` (cached)."""
+		row = self.db.execute(
+			"SELECT new_fail, fixes, regressions FROM transitions WHERE run_id = ? AND prev_id = ?", (run_id, prev_id)
+		).fetchone()
+		if row is None:
+			row = self.db.execute(
+				"SELECT"
+				f" COALESCE(SUM(c.outcome IN {_FAILED_SQL} AND (p.outcome IS NULL OR p.outcome NOT IN {_FAILED_SQL})), 0),"
+				f" COALESCE(SUM(c.outcome = 'passed' AND p.outcome IN {_FAILED_SQL}), 0),"
+				f" COALESCE(SUM(c.outcome IN {_FAILED_SQL} AND p.outcome = 'passed'), 0)"
+				" FROM results c LEFT JOIN results p ON p.run_id = ? AND p.test_id = c.test_id"
+				" WHERE c.run_id = ?",
+				(prev_id, run_id),
+			).fetchone()
+			with self.db:
+				self.db.execute("INSERT OR REPLACE INTO transitions VALUES (?, ?, ?, ?, ?)", (run_id, prev_id, *row))
+		return dict(zip(("new_fail", "fixes", "regressions"), row))
+
+	def duration_series(self, run_ids: Sequence[int]) -> Dict[str, Tuple[array, array]]:
+		"""Per-test ``(positions, durations)`` over ``run_ids`` (position = index in ``run_ids``)."""
+		pos_of = {rid: i for i, rid in enumerate(run_ids)}
+		series: Dict[str, Tuple[array, array]] = {}
+		unsorted = []
+		cur = self.db.execute(
+			"SELECT t.nodeid, r.run_id, r.duration FROM results r JOIN tests t ON t.id = r.test_id"
+			" WHERE r.duration IS NOT NULL ORDER BY r.test_id, r.run_id"
+		)
+		for nodeid, run_id, duration in cur:
+			pos = pos_of.get(run_id)
+			if pos is None:
+				continue
+			s = series.get(nodeid)
+			if s is None:
+				s = series[nodeid] = (array("I"), array("d"))
+			elif s[0][-1] > pos:
+				unsorted.append(nodeid)
+			s[0].append(pos)
+			s[1].append(duration)
+		# Run ids follow ingest order, which can differ from timeline order.
+		for nodeid in set(unsorted):
+			positions, durations = series[nodeid]
+			pairs = sorted(zip(positions, durations))
+			series[nodeid] = (array("I", [p for p, _ in pairs]), array("d", [d for _, d in pairs]))
+		return series
+
+
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def _fields(row: Dict[str, Any]) -> Optional[str]:
+	extra = {k: v for k, v in row.items() if k not in {"id", "outcome"} and v is not None}
+	return _encode(extra) if extra else None
+
+
+__all__ = ["SnapStore", "parse_store", "STORE_VERSION"]
@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+"""Sidecar summary cache for ``timeline`` and ``list`` (``<artifacts>/.index.json``).
+
+Listing a large artifacts directory would otherwise parse every snapshot on
+every invocation. The cache keeps, per snapshot file (keyed by name, size
+and mtime), its header facts and outcome counts plus two outcome bitmaps
+(``failed`` covers every outcome in :data:`~pytest_snap.snapio.FAILED_OUTCOMES`,
+``other`` skips and the like)::
+
+	{"version": 1,
+	 "ids": ["t.py::test_a", "t.py::test_b", ...],
+	 "snapshots": {"snap_v1.json": {"size": 812, "mtime_ns": ..., "created_at": "...", "git_commit": "...",
+	                                "total": 2, "passed": 1, "failed": 1, "xfailed": 0, "xpassed": 0, "other": 0,
+	                                "failed_bits": "<base64>", "passed_bits": "<base64>"}}}
+
+Bit ``i`` of a bitmap stands for ``ids[i]``; ids are interned across all
+snapshots and only ever appended, so existing bitmaps stay valid. Outcome
+transitions between two snapshots (:func:`transitions`) are popcounts of
+bitmap AND / AND NOT, no per-test dict is built. Only new or changed files
+are parsed; entries of deleted files are dropped on save. The cache is a
+plain optimisation: a missing, corrupt or foreign-version file is rebuilt,
+and a read-only artifacts directory just means it is not written.
+
+Snapshots that do need parsing are loaded by :func:`load_summaries` in a
+process pool (``--jobs``); workers send back only the compact summary (and,
+for ``timeline --perf``, the ``id -> seconds`` map), never the parsed
+snapshot.
+"""
+
+import base64
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .snapio import duration_index, load_snapshot, normalize_tests, outcome_bucket, snapshot_origin
+
+INDEX_NAME = ".index.json"
+INDEX_VERSION = 1
+COUNT_KEYS = ("total", "failed", "passed", "xfailed", "xpassed", "other")
+# Fewer files than this are parsed in-process: starting workers would cost more.
+POOL_MIN_FILES = 8
+
+
+def _pack(bits: int) -> str:
+	return base64.b64encode(bits.to_bytes((bits.bit_length() + 7) // 8, "little")).decode("ascii")
+
+
+def _unpack(text: str) -> int:
+	return int.from_bytes(base64.b64decode(text), "little")
+
+
+def _popcount(bits: int) -> int:
+	return bin(bits).count("1")
+
+
+def _bitmap(positions: List[int]) -> int:
+	# Digits set by a C-level map, then one base-2 parse: OR-ing bits into a
+	# growing int is quadratic and a Python loop dominates the parent's time.
+	if not positions:
+		return 0
+	digits = bytearray(b"0") * (max(positions) + 1)
+	deque(map(digits.__setitem__, positions, repeat(0x31)), maxlen=0)
+	digits.reverse()
+	return int(digits, 2)
+
+
+def _bits_lsb_first(bits: int, width: int) -> str:
+	return format(bits, f"0{width}b")[::-1]
+
+
+def default_jobs() -> int:
+	"""CPUs this process may run on."""
+	sched_getaffinity = getattr(os, "sched_getaffinity", None)
+	return len(sched_getaffinity(0)) if sched_getaffinity else os.cpu_count() or 1
+
+
+def summarize(snapshot: dict, path: str | os.PathLike, st: Optional[os.stat_result] = None) -> Dict[str, Any]:
+	"""Compact summary of a loaded snapshot: file key, origin, counts and failed / passed ids."""
+	st = st or os.stat(path)
+	tests = normalize_tests(snapshot)
+	outcomes = {t.get("id"): t.get("outcome") for t in tests}
+	counts = dict.fromkeys(COUNT_KEYS, 0)
+	counts["total"] = len(tests)
+	failed: List[Any] = []
+	passed: List[Any] = []
+	for tid, o in outcomes.items():
+		bucket = outcome_bucket(o)
+		if bucket == "failed":
+			failed.append(tid)
+		elif bucket == "passed":
+			passed.append(tid)
+		else:
+			counts[bucket] += 1
+	counts["failed"], counts["passed"] = len(failed), len(passed)
+	return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, **snapshot_origin(snapshot, path), **counts,
+			"failed_ids": failed, "passed_ids": passed}
+
+
+def _summarize_file(job: Tuple[str, bool]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, float]]]:
+	path, durations = job
+	try:
+		st = os.stat(path)  # before reading: a concurrent rewrite leaves a stale key and is re-read next time
+		data = load_snapshot(path)
+		if not data:
+			return None, None
+		return summarize(data, path, st), duration_index(data) if durations else None
+	except Exception:
+		return None, None
+
+
+def load_summaries(
+	paths: Sequence[str | os.PathLike], jobs: int = 1, *, durations: bool = False
+) -> Iterator[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, float]]]]:
+	"""``(summary, id -> seconds)`` per path, in order; ``(None, None)`` for unreadable files.
+
+	With ``jobs > 1`` (and at least ``POOL_MIN_FILES`` files) they are parsed
+	in that many worker processes. Durations are only computed when
+	``durations`` is set.
+	"""
+	work = [(os.fspath(p), durations) for p in paths]
+	jobs = min(jobs, len(work))
+	if jobs > 1 and len(work) >= POOL_MIN_FILES:
+		try:
+			pool = ProcessPoolExecutor(max_workers=jobs)
+		except (OSError, NotImplementedError):  # no working multiprocessing on this platform
+			pool = None
+		if pool is not None:
+			with pool:
+				yield from pool.map(_summarize_file, work, chunksize=max(1, len(work) // (jobs * 4)))
+			return
+	for job in work:
+		yield _summarize_file(job)
+
+
+def transitions(prev: Dict[str, Any], curr: Dict[str, Any]) -> Dict[str, int]:
+	"""``new_fail`` / ``fixes`` / ``regressions`` between two summaries (see ``timeline``)."""
+	pf, pp = prev["failed_bits"], prev["passed_bits"]
+	cf, cp = curr["failed_bits"], curr["passed_bits"]
+	return {
+		"new_fail": _popcount(cf & ~pf),
+		"fixes": _popcount(cp & pf),
+		"regressions": _popcount(cf & pp),
+	}
+
+
+class SummaryIndex:
+	"""Summaries of the snapshot files in one artifacts directory."""
+
+	def __init__(self, artifacts: str | os.PathLike):
+		self.path = Path(artifacts) / INDEX_NAME
+		self.ids: List[Any] = []
+		self._id_of: Dict[Any, int] = {}
+		self.entries: Dict[str, Dict[str, Any]] = {}
+		self._seen: set = set()
+		self._dirty = False
+		try:
+			raw = json.loads(self.path.read_text(encoding="utf-8"))
+		except (OSError, ValueError):
+			return
+		if not isinstance(raw, dict) or raw.get("version") != INDEX_VERSION:
+			return
+		try:
+			ids = list(raw.get("ids") or [])
+			entries = {}
+			for name, e in (raw.get("snapshots") or {}).items():
+				e = dict(e)
+				e["failed_bits"] = _unpack(e["failed_bits"])
+				e["passed_bits"] = _unpack(e["passed_bits"])
+				entries[name] = e
+		except (TypeError, ValueError, KeyError, AttributeError):
+			return
+		self.ids = ids
+		self._id_of = {tid: i for i, tid in enumerate(ids)}
+		self.entries = entries
+
+	def _intern(self, tid: Any) -> int:
+		i = self._id_of.get(tid)
+		if i is None:
+			i = self._id_of[tid] = len(self.ids)
+			self.ids.append(tid)
+		return i
+
+	def lookup(self, path: str | os.PathLike) -> Optional[Dict[str, Any]]:
+		"""Cached summary of ``path`` when its size and mtime are unchanged."""
+		p = Path(path)
+		st = p.stat()
+		self._seen.add(p.name)
+		e = self.entries.get(p.name)
+		if e is not None and e.get("size") == st.st_size and e.get("mtime_ns") == st.st_mtime_ns:
+			return e
+		return None
+
+	def add(self, path: str | os.PathLike, summary: Dict[str, Any]) -> Dict[str, Any]:
+		"""Cache the :func:`summarize` result for ``path``; returns its index entry."""
+		name = Path(path).name
+		e = {k: v for k, v in summary.items() if k not in {"failed_ids", "passed_ids"}}
+		for key in ("failed", "passed"):
+			ids = summary[f"{key}_ids"]
+			id_of = self._id_of
+			positions = [id_of[tid] if tid in id_of else self._intern(tid) for tid in ids]
+			e[f"{key}_bits"] = _bitmap(positions)
+		self.entries[name] = e
+		self._seen.add(name)
+		self._dirty = True
+		return e
+
+	def save(self, present: Optional[Iterable[str]] = None) -> None:
+		"""Write the cache if anything changed, dropping files not in ``present`` (default: looked up or added)."""
+		keep = set(present) if present is not None else self._seen
+		stale = [name for name in self.entries if name not in keep]
+		for name in stale:
+			del self.entries[name]
+		if not (self._dirty or stale):
+			return
+		if stale:
+			self._compact()
+		doc = {
+			"version": INDEX_VERSION,
+			"ids": self.ids,
+			"snapshots": {
+				name: {**e, "failed_bits": _pack(e["failed_bits"]), "passed_bits": _pack(e["passed_bits"])}
+				for name, e in sorted(self.entries.items())
+			},
+		}
+		tmp = self.path.with_name(f"{INDEX_NAME}.{os.getpid()}.tmp")
+		try:
+			tmp.write_text(json.dumps(doc, separators=(",", ":")), encoding="utf-8")
+			os.replace(tmp, self.path)
+		except OSError:
+			try:
+				tmp.unlink()
+			except OSError:
+				pass
+			return
+		self._dirty = False
+
+	def _compact(self) -> None:
+		# Drop ids no remaining snapshot refers to once they are the majority.
+		used = 0
+		for e in self.entries.values():
+			used |= e["failed_bits"] | e["passed_bits"]
+		if 2 * _popcount(used) >= len(self.ids):
+			return
+		width = len(self.ids)
+		keep = [i for i, c in enumerate(_bits_lsb_first(used, width)) if c == "1"]
+		for e in self.entries.values():
+			for key in ("failed_bits", "passed_bits"):
+				bits = _bits_lsb_first(e[key], width)
+				e[key] = int("".join(bits[i] for i in reversed(keep)) or "0", 2)
+		ids = [self.ids[i] for i in keep]
+		self.ids = ids
+		self._id_of = {tid: i for i, tid in enumerate(ids)}
+
+
+__all__ = [
+	"SummaryIndex",
+	"summarize",
+	"load_summaries",
+	"default_jobs",
+	"transitions",
+	"COUNT_KEYS",
+	"INDEX_NAME",
+	"INDEX_VERSION",
+]
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+"""In-run budget watchdog (``--snap-watchdog``).
+
+Budgets are otherwise only checked after the run, so a test stuck in a retry
+loop holds a CI job until its global timeout. The watchdog is one daemon
+thread that sleeps until the running test's deadline. When a deadline passes
+it
+
+* dumps every thread's traceback with :func:`faulthandler.dump_traceback`
+  (to stderr, so it lands in the test's captured output), and
+* interrupts the main thread: ``SIGUSR2`` via :func:`signal.pthread_kill`,
+  whose handler (installed by the plugin) fails the test; where that is
+  unavailable, ``KeyboardInterrupt`` stops the session.
+
+Arming and disarming are two condition-variable updates, so watching every
+test costs nothing measurable. A signal that arrives after its test already
+finished is ignored (:meth:`Watchdog.take` finds nothing pending).
+"""
+
+import faulthandler
+import signal
+import sys
+import threading
+import time
+import _thread
+from typing import IO, Optional, Tuple
+
+# pytest-timeout's signal method uses SIGALRM; stay out of its way.
+WATCHDOG_SIGNAL = getattr(signal, "SIGUSR2", None)
+
+
+def can_signal() -> bool:
+	"""Whether the main thread can be interrupted with :data:`WATCHDOG_SIGNAL` (else ``KeyboardInterrupt``)."""
+	return WATCHDOG_SIGNAL is not None and hasattr(signal, "pthread_kill")
+
+
+class Watchdog:
+	"""Deadline thread for the test currently running on the main thread."""
+
+	def __init__(self, *, dump_file: Optional[IO[str]] = None):
+		self._cond = threading.Condition()
+		self._main = threading.main_thread().ident
+		self._dump_file = dump_file
+		self._nodeid: Optional[str] = None
+		self._limit = 0.0
+		self._started = 0.0
+		self._deadline: Optional[float] = None
+		self._pending = False
+		self._stop = False
+		# (nodeid, limit seconds, elapsed seconds) of the last expiry, until the next arm()
+		self.fired: Optional[Tuple[str, float, float]] = None
+		self._thread = threading.Thread(target=self._run, name="pytest-snap-watchdog", daemon=True)
+		self._thread.start()
+
+	def arm(self, nodeid: str, limit_s: float) -> None:
+		with self._cond:
+			self._nodeid = nodeid
+			self._limit = limit_s
+			self._started = time.monotonic()
+			self._deadline = self._started + limit_s
+			self._pending = False
+			self.fired = None
+			self._cond.notify()
+
+	def disarm(self) -> None:
+		with self._cond:
+			self._deadline = None
+			self._pending = False
+			self._cond.notify()
+
+	def take(self) -> Optional[Tuple[str, float, float]]:
+		"""The expiry the main thread should act on now (once), or ``None``."""
+		with self._cond:
+			if not self._pending:
+				return None
+			self._pending = False
+			return self.fired
+
+	def close(self) -> None:
+		with self._cond:
+			self._stop = True
+			self._cond.notify()
+		self._thread.join(timeout=1.0)
+
+	def _run(self) -> None:
+		with self._cond:
+			while not self._stop:
+				if self._deadline is None:
+					self._cond.wait()
+					continue
+				remaining = self._deadline - time.monotonic()
+				if remaining > 0:
+					self._cond.wait(remaining)
+					continue
+				self._deadline = None
+				self.fired = (self._nodeid or "", self._limit, time.monotonic() - self._started)
+				self._pending = True
+				self._dump()
+				self._interrupt()
+
+	def _dump(self) -> None:
+		out = self._dump_file or sys.__stderr__
+		try:
+			out.write(
+				f"\npytest-snap watchdog: {self.fired[0]} exceeded its {self._limit:.2f}s budget; thread tracebacks:\n"  # type: ignore[index]
+			)
+			out.flush()
+			faulthandler.dump_traceback(file=out, all_threads=True)
+		except (AttributeError, OSError, ValueError):  # no usable file descriptor (captured / closed stderr)
+			pass
+
+	def _interrupt(self) -> None:
+		if can_signal():
+			signal.pthread_kill(self._main, WATCHDOG_SIGNAL)  # type: ignore[arg-type]
+		else:  # pragma: no cover - Windows
+			_thread.interrupt_main()
+
+
+__all__ = ["Watchdog", "WATCHDOG_SIGNAL", "can_signal"]
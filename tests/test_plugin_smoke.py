@@ -24,3 +24,918 @@ def test_snapshot_creation(pytester, tmp_path: Path):
     data = json.loads(out.read_text())
     assert "results" in data and isinstance(data["results"], list)
     assert any(r.get("outcome") == "passed" for r in data["results"])
+
+
+def test_snapshot_jsonl_stream(pytester, tmp_path: Path):
+    from pytest_snap.snapio import load_snapshot
+
+    pytester.makepyfile(
+        test_sample="""
+        def test_a():
+            pass
+
+        def test_b():
+            assert 0
+        """
+    )
+    out = tmp_path / "snap.jsonl"
+    result = pytester.runpytest("--snap", "--snap-out", str(out), "--snap-format", "jsonl")
+    result.assert_outcomes(passed=1, failed=1)
+
+    lines = out.read_text().splitlines()
+    assert json.loads(lines[0])["snap"] == "header"
+    assert json.loads(lines[-1])["snap"] == "footer"
+    data = load_snapshot(out)
+    assert [r["outcome"] for r in data["results"]] == ["passed", "failed"]
+    assert "partial" not in data
+
+    # Simulate a killed run: drop the footer and tear the last record.
+    out.write_text("\n".join(lines[:-2]) + "\n" + lines[-2][:10])
+    data = load_snapshot(out)
+    assert data["partial"] is True
+    assert [r["outcome"] for r in data["results"]] == ["passed"]
+
+
+def test_snapshot_xdist_merge(pytester, tmp_path: Path):
+    import pytest
+
+    pytest.importorskip("xdist")
+    pytester.makepyfile(
+        test_sample="""
+        import pytest
+
+        @pytest.mark.parametrize("i", range(6))
+        def test_p(i):
+            pass
+        """
+    )
+    out = tmp_path / "snap.json"
+    result = pytester.runpytest_subprocess("-n", "2", "--snap", "--snap-out", str(out))
+    result.assert_outcomes(passed=6)
+
+    data = json.loads(out.read_text())
+    assert len(data["results"]) == 6
+    assert {r["worker"] for r in data["results"]} <= {"gw0", "gw1"}
+
+
+def test_snapshot_phase_timings(pytester, tmp_path: Path):
+    pytester.makepyfile(
+        test_sample="""
+        import pytest, time
+
+        @pytest.fixture
+        def slow():
+            time.sleep(0.02)
+            yield
+
+        def test_fixture(slow):
+            pass
+
+        @pytest.mark.skip
+        def test_skipped():
+            pass
+        """
+    )
+    out = tmp_path / "snap.json"
+    pytester.runpytest("--snap", "--snap-out", str(out)).assert_outcomes(passed=1, skipped=1)
+
+    by_id = {r["nodeid"].split("::")[-1]: r for r in json.loads(out.read_text())["results"]}
+    rec = by_id["test_fixture"]
+    assert rec["setup_ns"] >= 20_000_000 > rec["call_ns"]
+    assert rec["dur_ns"] == rec["call_ns"] and "teardown_ns" in rec
+    assert by_id["test_skipped"]["outcome"] == "skipped"
+
+
+def test_snapshot_fixture_table(pytester, tmp_path: Path):
+    pytester.makepyfile(
+        test_sample="""
+        import pytest, time
+
+        @pytest.fixture(scope="module")
+        def schema():
+            time.sleep(0.02)
+
+        def test_a(schema):
+            pass
+
+        def test_b(schema):
+            pass
+        """
+    )
+    out = tmp_path / "snap.json"
+    pytester.runpytest("--snap", "--snap-out", str(out)).assert_outcomes(passed=2)
+
+    fixtures = {f["name"]: f for f in json.loads(out.read_text())["fixtures"]}
+    schema = fixtures["schema"]
+    assert schema["scope"] == "module" and schema["count"] == 1
+    assert schema["max_ns"] >= 20_000_000
+    assert schema["tests"][0]["nodeid"].endswith("test_a")
+
+
+def test_snapshot_collection_profile(pytester, tmp_path: Path):
+    import builtins
+
+    pytester.makepyfile(
+        test_sample="""
+        import time
+        time.sleep(0.02)
+
+        def test_ok():
+            pass
+        """
+    )
+    before = builtins.__import__
+    out = tmp_path / "snap.json"
+    pytester.runpytest("--snap", "--snap-imports", "--snap-out", str(out)).assert_outcomes(passed=1)
+    assert builtins.__import__ is before, "import hook must be removed after collection"
+
+    coll = json.loads(out.read_text())["collection"]
+    assert coll["total_ns"] >= 20_000_000
+    (entry,) = coll["files"]
+    assert entry["path"] == "test_sample.py" and entry["items"] == 1
+    assert isinstance(coll["imports"], list)
+
+
+def test_snapshot_resource_metrics(pytester, tmp_path: Path, capsys):
+    from pytest_snap.cli import main
+
+    pytester.makepyfile(test_sample="def test_busy():\n    sum(i * i for i in range(200000))\n")
+    snap = tmp_path / "snap_r1.json"
+    pytester.runpytest("--snap", "--snap-out", str(snap), "--snap-resources").assert_outcomes(passed=1)
+    [row] = json.loads(snap.read_text())["results"]
+    for field in ("cpu_user_ns", "thread_cpu_ns", "ctx_vol", "rss_peak_delta_kb"):
+        assert isinstance(row[field], int) and row[field] >= 0, field
+    assert row["thread_cpu_ns"] > 0
+    capsys.readouterr()
+    assert main(["show", "r1", "--artifacts", str(tmp_path), "--plain", "--sort-by", "thread_cpu"]) == 0
+    assert "Top 1 tests by thread_cpu:" in capsys.readouterr().out
+
+
+def test_diff_perf_metric_gate(tmp_path: Path, capsys):
+    from pytest_snap.cli import main
+
+    def write(label, ctx_vol):
+        rows = [{"nodeid": "t.py::test_io", "outcome": "passed", "dur_ns": 100_000_000, "ctx_vol": ctx_vol}]
+        (tmp_path / f"snap_{label}.json").write_text(json.dumps({"results": rows}))
+
+    for label, ctx_vol in (("v1", 10), ("v2", 80), ("v3", 11)):
+        write(label, ctx_vol)
+    gate = ["--artifacts", str(tmp_path), "--plain", "--perf", "--perf-metric", "ctx_vol", "--perf-fail"]
+    # Same wall clock, more context switches: only the chosen metric regresses.
+    assert main(["diff", "v1", "v2", *gate]) == 1
+    assert "SLOWER: test_io +70 x8.00 (10 -> 80)" in capsys.readouterr().out
+    assert main(["diff", "v1", "v3", *gate]) == 0
+    assert main(["diff", "v1", "v2", "--artifacts", str(tmp_path), "--plain", "--perf", "--perf-fail"]) == 0
+
+
+def test_snapshot_binary_format(pytester, tmp_path: Path):
+    from pytest_snap.snapio import load_snapshot
+
+    pytester.makepyfile(
+        test_sample="""
+        import pytest
+
+        class TestK:
+            @pytest.mark.parametrize("i", range(3))
+            def test_p(self, i):
+                assert i != 1
+        """
+    )
+    out = tmp_path / "snap.json"
+    pytester.runpytest("--snap", "--snap-out", str(out), "--snap-format", "bin").assert_outcomes(passed=2, failed=1)
+    assert out.read_bytes().startswith(b"PSNAPB1")
+
+    data = load_snapshot(out)
+    results = list(data["results"])
+    assert [r["nodeid"] for r in results] == [f"test_sample.py::TestK::test_p[{i}]" for i in range(3)]
+    assert [r["outcome"] for r in results] == ["passed", "failed", "passed"]
+    assert all(r["dur_ns"] == r["call_ns"] for r in results)
+    assert data["fixtures"] and data["collection"]["files"]
+
+
+def test_snapshot_compressed_output(pytester, tmp_path: Path):
+    import gzip
+
+    from pytest_snap.snapio import load_snapshot
+
+    pytester.makepyfile(test_sample="def test_ok():\n    pass\n")
+    out = tmp_path / "snap.json.gz"
+    pytester.runpytest("--snap", "--snap-out", str(out), "--snap-format", "jsonl").assert_outcomes(passed=1)
+
+    assert out.read_bytes()[:2] == b"\x1f\x8b"
+    assert gzip.decompress(out.read_bytes()).startswith(b'{"snap":"header"')
+    data = load_snapshot(out)
+    assert [r["outcome"] for r in data["results"]] == ["passed"] and "partial" not in data
+
+
+def test_snapshot_duration_order(pytester, tmp_path: Path):
+    pytester.makepyfile(test_sample="def test_a():\n    pass\n\ndef test_b():\n    pass\n\ndef test_c():\n    pass\n\ndef test_new():\n    pass\n")
+    base = pytester.path / "base.json"  # inside rootdir, so node ids match
+    base.write_text(json.dumps({"results": [
+        {"nodeid": "test_sample.py::test_a", "outcome": "passed", "dur_ns": 1_000_000},
+        {"nodeid": "test_sample.py::test_b", "outcome": "passed", "dur_ns": 3_000_000},
+        {"nodeid": "test_sample.py::test_c", "outcome": "passed", "dur_ns": 2_000_000},
+    ]}))
+    out = tmp_path / "snap.json"
+    res = pytester.runpytest(
+        "--snap", "--snap-out", str(out), "--snap-baseline", str(base),
+        "--snap-order", "duration", "--snap-order-unknown", "last",
+    )
+    res.assert_outcomes(passed=4)
+    res.stdout.fnmatch_lines(["*order=duration: predicted makespan*achieved*1 test(s) without history*"])
+
+    data = json.loads(out.read_text())
+    assert [r["nodeid"].split("::")[1] for r in data["results"]] == ["test_b", "test_c", "test_a", "test_new"]
+    order = data["order"]
+    assert order["predicted_makespan_ns"] == 6_000_000 and order["known"] == 3 and order["unknown"] == 1
+    assert 0 < order["achieved_makespan_ns"] <= order["wall_ns"]
+
+
+def test_snapshot_shard(pytester, tmp_path: Path):
+    pytester.makepyfile(
+        test_slow="def test_s():\n    pass\n",
+        test_mix="def test_a():\n    pass\n\ndef test_b():\n    pass\n",
+        test_new="def test_n():\n    pass\n",
+    )
+    base = pytester.path / "base.json"
+    base.write_text(json.dumps({"results": [
+        {"nodeid": "test_slow.py::test_s", "outcome": "passed", "dur_ns": 5_000_000},
+        {"nodeid": "test_mix.py::test_a", "outcome": "passed", "dur_ns": 2_000_000},
+        {"nodeid": "test_mix.py::test_b", "outcome": "passed", "dur_ns": 2_000_000},
+    ]}))
+    seen = []
+    for i in (1, 2):
+        out = tmp_path / f"shard{i}.json"
+        res = pytester.runpytest("--snap", "--snap-out", str(out), "--snap-baseline", str(base), "--snap-shard", f"{i}/2")
+        assert res.ret == 0
+        data = json.loads(out.read_text())
+        seen.append(sorted(r["nodeid"] for r in data["results"]))
+        assert data["shard"]["index"] == i and data["shard"]["max_predicted_ns"] == 6_000_000
+    # slow module alone; test_mix stays whole and the new test (median weight) joins it
+    assert seen == [["test_slow.py::test_s"], ["test_mix.py::test_a", "test_mix.py::test_b", "test_new.py::test_n"]]
+
+
+def test_snapshot_risk_order(pytester, tmp_path: Path):
+    pytester.makepyfile(test_sample="def test_a():\n    pass\n\ndef test_b():\n    pass\n\ndef test_z():\n    assert 0\n")
+    history = pytester.path / "history.jsonl"  # inside rootdir, so node ids match
+    first = tmp_path / "first.json"
+    pytester.runpytest("--snap", "--snap-out", str(first), "--snap-history", str(history)).assert_outcomes(passed=2, failed=1)
+    assert json.loads(first.read_text())["first_failure"]["nodeid"] == "test_sample.py::test_z"
+    assert len(history.read_text().splitlines()) == 1
+
+    out = tmp_path / "risk.json"
+    res = pytester.runpytest("--snap", "--snap-out", str(out), "--snap-history", str(history), "--snap-order", "risk")
+    res.assert_outcomes(passed=2, failed=1)
+    res.stdout.fnmatch_lines(["*first failure after*test_sample.py::test_z*"])
+    data = json.loads(out.read_text())
+    assert data["results"][0]["nodeid"] == "test_sample.py::test_z"
+    assert data["order"]["risky"] == 1
+    assert 0 < data["first_failure"]["ns"] < data["order"]["wall_ns"]
+
+
+def test_snapshot_affected_since(pytester, tmp_path: Path):
+    import shutil
+    import subprocess
+
+    import pytest
+
+    if shutil.which("git") is None:
+        pytest.skip("git not available")
+    pytester.makepyfile(
+        lib_a="def fa():\n    return 1\n",
+        lib_b="def fb():\n    return 2\n",
+        test_a="import lib_a\n\ndef test_a():\n    assert lib_a.fa() == 1\n",
+        test_b="import lib_b\n\ndef test_b():\n    assert lib_b.fb() == 2\n",
+        lib_c="LIMIT = 3\n",
+        test_c="from lib_c import LIMIT\n\ndef test_c():\n    assert LIMIT == 3\n",
+    )
+    pytester.syspathinsert()
+    deps = pytester.path / "deps.json"  # inside rootdir, the git work tree
+    pytester.runpytest("--snap-record-deps", "--snap-deps", str(deps)).assert_outcomes(passed=3)
+    index = json.loads(deps.read_text())
+    files = index["files"]
+    assert sorted(files[i] for i in index["tests"]["test_a.py::test_a"]) == ["lib_a.py", "test_a.py"]
+    # lib_c only has module level code; importing it is the dependency.
+    assert sorted(files[i] for i in index["tests"]["test_c.py::test_c"]) == ["lib_c.py", "test_c.py"]
+
+    git = ["git", "-c", "user.name=t", "-c", "user.email=t@t"]
+    subprocess.run(git + ["init", "-q"], cwd=pytester.path, check=True)
+    subprocess.run(git + ["add", "."], cwd=pytester.path, check=True)
+    subprocess.run(git + ["commit", "-qm", "base"], cwd=pytester.path, check=True)
+    (pytester.path / "lib_b.py").write_text("def fb():\n    return 2  # changed\n")
+    (pytester.path / "lib_c.py").write_text("LIMIT = 4\n")
+
+    out = pytester.path / "snap.json"
+    res = pytester.runpytest("--snap", "--snap-out", str(out), "--snap-deps", str(deps), "--snap-affected-since", "HEAD")
+    res.assert_outcomes(passed=1, failed=1, deselected=1)
+    data = json.loads(out.read_text())
+    assert [r["nodeid"] for r in data["results"]] == ["test_b.py::test_b", "test_c.py::test_c"]
+    assert data["affected"] == {"since": "HEAD", "changed": 2, "selected": 2, "deselected": 1}
+
+
+def test_snapshot_outcome_cache(pytester, tmp_path: Path):
+    pytester.makepyfile(
+        lib_a="def fa():\n    return 1\n",
+        test_a="import lib_a\n\ndef test_a():\n    assert lib_a.fa() == 1\n",
+        test_b="def test_b():\n    pass\n\ndef test_fail():\n    assert 0\n",
+    )
+    pytester.syspathinsert()
+    cache = pytester.path / "cache"
+    out = pytester.path / "snap.json"
+    args = ("--snap-cache", "--snap-cache-dir", str(cache), "--snap-out", str(out))
+    pytester.runpytest(*args).assert_outcomes(passed=2, failed=1)
+    assert json.loads(out.read_text())["cache"] == {"hits": 0, "stored": 2, "evicted": 0}
+
+    (pytester.path / "lib_a.py").write_text("def fa():\n    return 1  # touched\n")
+    res = pytester.runpytest(*args, "-v")
+    res.assert_outcomes(passed=2, failed=1)
+    res.stdout.fnmatch_lines(["*test_b.py::test_b CACHED*"])
+    data = json.loads(out.read_text())
+    reused = {r["nodeid"]: r.get("reused", False) for r in data["results"]}
+    assert reused == {"test_a.py::test_a": False, "test_b.py::test_b": True, "test_b.py::test_fail": False}
+    assert data["cache"]["hits"] == 1
+
+
+def test_outcome_cache_hit_tears_down(pytester):
+    log = pytester.path / "log.txt"
+    go = pytester.path / "go.txt"
+    pytester.makepyfile(
+        lib_b="def flag():\n    return True\n",
+        test_m1=f"""
+import os
+import pytest
+
+@pytest.fixture(scope="module")
+def res():
+    yield 1
+    with open({str(log)!r}, "a") as f:
+        f.write("m1 teardown\\n")
+
+def test_real(res):
+    assert os.path.exists({str(go)!r})  # fails until go.txt exists, so never cached
+
+def test_cached():
+    pass
+""",
+        test_m2=f"""
+import lib_b
+
+def test_two():
+    with open({str(log)!r}, "a") as f:
+        f.write("m2 run\\n")
+    assert lib_b.flag()
+""",
+    )
+    pytester.syspathinsert()
+    args = ("--snap-cache", "--snap-cache-dir", str(pytester.path / "cache"), "--snap-out", str(pytester.path / "snap.json"))
+    pytester.runpytest(*args).assert_outcomes(passed=2, failed=1)
+    log.write_text("")
+    go.write_text("")
+    (pytester.path / "lib_b.py").write_text("def flag():\n    return True  # touched\n")
+    res = pytester.runpytest(*args, "-v")
+    res.assert_outcomes(passed=3)
+    res.stdout.fnmatch_lines(["*test_m1.py::test_cached CACHED*"])
+    # The cached last test of test_m1 still tears the module fixture down before test_m2 runs.
+    assert log.read_text().splitlines() == ["m1 teardown", "m2 run"]
+    results = json.loads((pytester.path / "snap.json").read_text())["results"]
+    assert sorted(r["nodeid"] for r in results) == ["test_m1.py::test_cached", "test_m1.py::test_real", "test_m2.py::test_two"]
+
+
+def test_outcome_cache_tracks_imported_constants(pytester):
+    pytester.makepyfile(
+        lib="LIMIT = 3\n",
+        helpers="from lib import LIMIT\n\ndef limit():\n    return LIMIT\n",
+        test_const="from lib import LIMIT\n\ndef test_const():\n    assert LIMIT == 3\n",
+        test_nested="import helpers\n\ndef test_nested():\n    assert helpers.limit() == 3\n",
+        test_other="def test_other():\n    pass\n",
+    )
+    pytester.syspathinsert()
+    args = ("--snap-cache", "--snap-cache-dir", str(pytester.path / "cache"), "--snap-out", str(pytester.path / "snap.json"))
+    pytester.runpytest(*args).assert_outcomes(passed=3)
+    # Only module level code reads LIMIT; no function of lib.py ever runs.
+    (pytester.path / "lib.py").write_text("LIMIT = 4\n")
+    res = pytester.runpytest(*args, "-v")
+    res.assert_outcomes(passed=1, failed=2)
+    res.stdout.fnmatch_lines(["*test_other.py::test_other CACHED*"])
+
+
+def test_snapshot_repeat_samples(pytester, tmp_path: Path):
+    from pytest_snap.diff import diff_snapshots
+
+    pytester.makepyfile(
+        test_sample="""
+        import pytest
+
+        calls = []
+
+        @pytest.mark.snap(repeat=5)
+        def test_marked():
+            calls.append(1)
+
+        def test_plain():
+            pass
+
+        def test_count():
+            assert len(calls) == 5
+        """
+    )
+    out = tmp_path / "snap.json"
+    pytester.runpytest("--snap", "--snap-out", str(out)).assert_outcomes(passed=3)
+    recs = {r["nodeid"].split("::")[1]: r for r in json.loads(out.read_text())["results"]}
+    marked = recs["test_marked"]
+    assert marked["samples"] == 5 and marked["dur_ns"] == marked["call_ns"]
+    assert marked["call_min_ns"] <= marked["call_ns"] and marked["call_mad_ns"] >= 0
+    assert "samples" not in recs["test_plain"]
+
+    def snap(call_ns, mad_ns):
+        return {"results": [{"nodeid": "t::x", "outcome": "passed", "dur_ns": call_ns, "call_ns": call_ns,
+                             "call_min_ns": call_ns, "call_mad_ns": mad_ns, "samples": 9}]}
+
+    # +40% on a 1s test exceeds ratio/abs thresholds but not 3 MADs of 0.2s
+    noisy = diff_snapshots(snap(10**9, 2 * 10**8), snap(14 * 10**8, 2 * 10**8), slower_ratio=1.3, slower_abs=0.05)
+    assert noisy["slower_tests"] == []
+    stable = diff_snapshots(snap(10**9, 10**7), snap(14 * 10**8, 10**7), slower_ratio=1.3, slower_abs=0.05)
+    assert stable["slower_tests"][0]["noise"] == 0.03
+    assert "call_samples_ns" in marked and len(marked["call_samples_ns"]) == 5
+
+
+def test_snapshot_repeat_fresh_fixtures(pytester, tmp_path: Path):
+    pytester.makepyfile(
+        test_sample="""
+        import pytest
+
+        runs = []
+
+        @pytest.fixture
+        def items():
+            return []
+
+        @pytest.mark.snap(repeat=3)
+        def test_mutates(items, tmp_path):
+            items.append(1)
+            assert items == [1]
+            assert not (tmp_path / "f").exists()
+            (tmp_path / "f").write_text("x")
+
+        @pytest.mark.snap(repeat=3)
+        def test_second_run_fails():
+            runs.append(1)
+            assert len(runs) < 2
+        """
+    )
+    out = tmp_path / "snap.json"
+    res = pytester.runpytest("--snap", "--snap-out", str(out), "-W", "error::pluggy.PluggyTeardownRaisedWarning")
+    res.assert_outcomes(passed=1, failed=1)
+    res.stdout.fnmatch_lines(["*assert 2 < 2*"])
+    recs = {r["nodeid"].split("::")[1]: r for r in json.loads(out.read_text())["results"]}
+    assert recs["test_mutates"]["samples"] == 3
+    assert recs["test_second_run_fails"]["outcome"] == "failed" and "samples" not in recs["test_second_run_fails"]
+
+
+def test_private_pytest_api_fallback(pytester, monkeypatch):
+    pytester.makepyfile(
+        test_sample="""
+        import pytest
+
+        @pytest.fixture
+        def items():
+            return []
+
+        @pytest.mark.snap(repeat=3)
+        def test_shared(items):
+            items.append(1)
+            assert len(items) <= 3
+
+        def test_seen():
+            pass
+        """
+    )
+    out = pytester.path / "snap.json"
+    args = ("--snap-cache", "--snap-cache-dir", str(pytester.path / "cache"), "--snap-out", str(out))
+    pytester.runpytest(*args).assert_outcomes(passed=2)
+    # A pytest without the setup stack internals: cache hits run, repeats share fixtures.
+    monkeypatch.setattr("pytest_snap.plugin.can_teardown", lambda item: False)
+    monkeypatch.setattr("pytest_snap.plugin.can_refresh", lambda item: False)
+    res = pytester.runpytest(*args, "-v")
+    res.assert_outcomes(passed=2, warnings=2)
+    res.stdout.no_fnmatch_line("*CACHED*")
+    res.stdout.fnmatch_lines([
+        "*--snap-cache needs pytest internals missing from pytest*cached tests run normally",
+        "*--snap-repeat needs pytest internals missing from pytest*share the first run's fixtures",
+    ])
+    recs = {r["nodeid"].split("::")[1]: r for r in json.loads(out.read_text())["results"]}
+    assert recs["test_shared"]["samples"] == 3 and not recs["test_seen"].get("reused")
+
+
+def test_perf_stat_significance():
+    from pytest_snap.diff import diff_snapshots
+    from pytest_snap.stats import benjamini_hochberg, mann_whitney
+
+    def snap(samples_by_test):
+        return {"results": [
+            {"nodeid": f"t::{tid}", "outcome": "passed", "dur_ns": sorted(s)[len(s) // 2], "call_samples_ns": s}
+            for tid, s in samples_by_test.items()
+        ]}
+
+    ms = 10**6
+    base = {"shifted": [100 * ms + i * ms for i in range(8)], "noisy": [50 * ms, 300 * ms, 80 * ms, 250 * ms, 60 * ms]}
+    curr = {"shifted": [200 * ms + i * ms for i in range(8)], "noisy": [240 * ms, 70 * ms, 290 * ms, 55 * ms, 260 * ms]}
+    _u, p, effect = mann_whitney([1, 2, 3], [4, 5, 6])
+    assert effect == 1.0 and abs(p - 1 / 20) < 1e-12
+    assert benjamini_hochberg([0.01, 0.04, 0.03]) == [0.03, 0.04, 0.04]
+    for method in ("mw", "bootstrap"):
+        res = diff_snapshots(snap(base), snap(curr), slower_ratio=1.3, slower_abs=0.05, stat=method)
+        assert [s["id"] for s in res["slower_tests"]] == ["t::shifted"]
+        assert res["slower_tests"][0]["stat"] == method and res["slower_tests"][0]["q"] <= 0.05
+
+
+def test_timeline_perf_change_points(tmp_path: Path, capsys):
+    import os
+
+    from pytest_snap.cli import main
+
+    for i in range(12):
+        slow = 0.25 if i >= 7 else 0.12
+        jitter = 1 + (i % 3 - 1) * 0.02
+        results = [
+            {"nodeid": "t.py::test_ingest", "outcome": "passed", "dur_ns": int(slow * jitter * 1e9)},
+            {"nodeid": "t.py::test_stable", "outcome": "passed", "dur_ns": int(0.2 * jitter * 1e9)},
+        ]
+        path = tmp_path / f"snap_r{i:02d}.json"
+        path.write_text(json.dumps({"results": results, "git_commit": f"c{i:02d}"}))
+        os.utime(path, (1e9 + i, 1e9 + i))
+    assert main(["timeline", "--artifacts", str(tmp_path), "--perf", "--json"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert [s["total"] for s in out["snapshots"]] == [2] * 12
+    [shift] = out["shifts"]
+    assert shift["id"] == "t.py::test_ingest" and shift["git_commit"] == "c07"
+    assert 2.0 < shift["ratio"] < 2.2
+
+
+def test_host_calibration_normalizes_diff(pytester, tmp_path: Path):
+    import pytest
+
+    from pytest_snap.diff import diff_snapshots
+    from pytest_snap.hostinfo import IncomparableHosts
+
+    pytester.makepyfile(test_sample="def test_ok():\n    pass\n")
+    out = tmp_path / "snap.json"
+    pytester.runpytest("--snap", "--snap-out", str(out)).assert_outcomes(passed=1)
+    env = json.loads(out.read_text())["env"]
+    assert env["host"]["cpu_count"] and env["calibration"]["ns"] > 0
+
+    def snap(model, calibration_ns, dur):
+        host = dict(env["host"], cpu_model=model)
+        return {"env": {"host": host, "calibration": {"version": 1, "ns": calibration_ns}},
+                "results": [{"nodeid": "t::x", "outcome": "passed", "dur_ns": int(dur * 1e9)}]}
+
+    # Twice the duration on a host that runs the calibration twice as slow: not slower.
+    a, b = snap("fast", 1_000_000, 1.0), snap("slow", 2_000_000, 2.0)
+    res = diff_snapshots(a, b, slower_ratio=1.3, slower_abs=0.05)
+    assert res["slower_tests"] == [] and res["host"]["scale"] == 2.0
+    assert diff_snapshots(a, b, slower_ratio=1.3, slower_abs=0.05, host="ignore")["summary"]["n_slower"] == 1
+    with pytest.raises(IncomparableHosts):
+        diff_snapshots(a, b, slower_ratio=1.3, slower_abs=0.05, host="strict")
+    same = diff_snapshots(a, snap("fast", 1_100_000, 2.0), slower_ratio=1.3, slower_abs=0.05)
+    assert same["summary"]["n_slower"] == 1 and "host" not in same
+
+
+def test_sqlite_store_matches_files(tmp_path: Path, capsys):
+    import os
+
+    from pytest_snap.cli import main
+
+    for i, (outcome, setup) in enumerate([("passed", "passed"), ("failed", "error"), ("passed", "skipped")]):
+        results = [
+            {"nodeid": "t.py::test_a", "outcome": outcome, "dur_ns": 100_000_000 * (i + 1), "call_ns": 90_000_000},
+            {"nodeid": "t.py::test_b", "outcome": "passed", "dur_ns": 50_000_000},
+            {"nodeid": "t.py::test_c", "outcome": setup, "dur_ns": 10_000_000},
+        ]
+        path = tmp_path / f"snap_v{i}.json"
+        path.write_text(json.dumps({"results": results, "git_commit": f"c{i}"}))
+        os.utime(path, (1e9 + i, 1e9 + i))
+    store = f"sqlite:{tmp_path / 'snaps.db'}"
+    assert main(["ingest", "--artifacts", str(tmp_path), "--store", store]) == 0
+    assert "Ingested 3 snapshot(s)" in capsys.readouterr().out
+    assert main(["ingest", "--artifacts", str(tmp_path), "--store", store]) == 0
+    assert "Ingested 0 snapshot(s)" in capsys.readouterr().out
+
+    assert main(["timeline", "--artifacts", str(tmp_path), "--json"]) == 0
+    from_files = json.loads(capsys.readouterr().out)
+    assert main(["timeline", "--artifacts", str(tmp_path), "--json", "--store", store]) == 0
+    assert json.loads(capsys.readouterr().out) == from_files
+    assert [r["regressions"] for r in from_files] == [0, 2, 0]
+    # Setup errors count as failures; skips land in "other".
+    assert [(r["failed"], r["other"]) for r in from_files] == [(0, 0), (2, 0), (0, 1)]
+
+    # Served from the store even after the snapshot file is gone.
+    (tmp_path / "snap_v1.json").unlink()
+    assert main(["show", "v1", "--artifacts", str(tmp_path), "--store", store]) == 0
+    assert "Failures: 2" in capsys.readouterr().out
+    assert main(["diff", "v0", "v1", "--artifacts", str(tmp_path), "--store", store]) == 0
+    assert "regressions       : 2" in capsys.readouterr().out
+
+
+def test_timeline_summary_index(tmp_path: Path, capsys):
+    import os
+
+    from pytest_snap.cli import main
+
+    def write(i, outcomes):
+        results = [{"nodeid": f"t.py::test_{k}", "outcome": o, "dur_ns": 1000} for k, o in enumerate(outcomes)]
+        path = tmp_path / f"snap_v{i}.json"
+        path.write_text(json.dumps({"results": results, "git_commit": f"c{i}"}))
+        os.utime(path, (1e9 + i, 1e9 + i))
+        return path
+
+    write(0, ["passed", "passed", "failed"])
+    v1 = write(1, ["failed", "passed", "passed"])
+    write(2, ["failed", "failed", "passed"])
+
+    def timeline():
+        assert main(["timeline", "--artifacts", str(tmp_path), "--json"]) == 0
+        return [(r["label"], r["failed"], r["new_fail"], r["fixes"], r["regressions"]) for r in json.loads(capsys.readouterr().out)]
+
+    expected = [("v0", 1, 0, 0, 0), ("v1", 1, 1, 1, 1), ("v2", 2, 1, 0, 1)]
+    assert timeline() == expected
+    index = json.loads((tmp_path / ".index.json").read_text())
+    assert sorted(index["snapshots"]) == ["snap_v0.json", "snap_v1.json", "snap_v2.json"]
+
+    # Unchanged size and mtime: served from the index without parsing the file.
+    st = v1.stat()
+    v1.write_text("x" * st.st_size)
+    os.utime(v1, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert timeline() == expected
+    # A rewritten or deleted file is picked up.
+    os.utime(write(1, ["passed", "passed", "passed"]), (1e9 + 1.5, 1e9 + 1.5))
+    assert timeline() == [("v0", 1, 0, 0, 0), ("v1", 0, 0, 1, 0), ("v2", 2, 2, 0, 2)]
+    (tmp_path / "snap_v0.json").unlink()
+    assert [r[0] for r in timeline()] == ["v1", "v2"]
+    assert sorted(json.loads((tmp_path / ".index.json").read_text())["snapshots"]) == ["snap_v1.json", "snap_v2.json"]
+    assert main(["list", "--artifacts", str(tmp_path), "--long"]) == 0
+    assert "snap_v2.json 2001-09-09T01:46:42Z commit=c2 total=3 fail=2 pass=1" in capsys.readouterr().out
+
+
+def test_timeline_jobs_matches_serial(tmp_path: Path, capsys):
+    import os
+
+    from pytest_snap.cli import main
+
+    for i in range(10):
+        results = [{"nodeid": f"t.py::test_{k}", "outcome": "failed" if (i + k) % 4 == 0 else "passed",
+                    "dur_ns": (300_000_000 if i >= 5 and k == 0 else 100_000_000) + i * 1000} for k in range(4)]
+        path = tmp_path / f"snap_r{i}.json"
+        path.write_text(json.dumps({"results": results}))
+        os.utime(path, (1e9 + i, 1e9 + i))
+
+    def timeline(jobs):
+        (tmp_path / ".index.json").unlink(missing_ok=True)
+        assert main(["timeline", "--artifacts", str(tmp_path), "--json", "--perf", "--jobs", str(jobs)]) == 0
+        return json.loads(capsys.readouterr().out)
+
+    serial = timeline(1)
+    assert timeline(3) == serial
+    assert [s["at"] for s in serial["shifts"]] == ["r5"]
+
+
+def test_segmented_history_store(pytester, tmp_path: Path):
+    from pytest_snap.baseline import load_history
+    from pytest_snap.history import HistoryStore
+
+    pytester.makepyfile(test_sample="def test_a():\n    pass\n\ndef test_z():\n    assert 0\n")
+    hist = pytester.path / "hist"
+    for i in range(2):
+        args = ["--snap", "--snap-out", str(tmp_path / f"s{i}.json"), "--snap-history", f"{hist}/"]
+        pytester.runpytest(*args).assert_outcomes(passed=1, failed=1)
+    runs = load_history(str(hist))
+    assert [r["run_id"] for r in runs] == ["s0.json", "s1.json"]
+    assert {t["id"]: t["outcome"] for t in runs[-1]["tests"]} == {"test_sample.py::test_a": "passed", "test_sample.py::test_z": "failed"}
+
+    store = HistoryStore(tmp_path / "h", segment_bytes=200)
+    for i in range(40):
+        store.append({"run_id": i, "tests": [{"id": "t::x", "outcome": "passed", "duration": 0.01}]}, max_runs=10)
+    manifest = json.loads((tmp_path / "h" / "manifest.json").read_text())
+    assert 10 <= len(store) < 10 + manifest["segments"][0]["runs"]
+    assert len(list((tmp_path / "h").glob("*.jsonl"))) == len(manifest["segments"]) > 1
+    assert [r["run_id"] for r in store.last(3)] == [37, 38, 39]
+    # A torn line from an interrupted append is ignored, then overwritten.
+    with open(tmp_path / "h" / manifest["segments"][-1]["name"], "ab") as f:
+        f.write(b'{"run_id": 99, "te')
+    assert store.last(1)[0]["run_id"] == 39
+    store.append({"run_id": 40})
+    assert [r["run_id"] for r in load_history(str(tmp_path / "h"), last=2)] == [39, 40]
+
+
+def test_rolling_stats(pytester, tmp_path: Path, capsys):
+    import statistics
+
+    from pytest_snap.baseline import compute_flake_scores, load_history
+    from pytest_snap.cli import main
+    from pytest_snap.rolling import RollingStats
+
+    counter = tmp_path / "n"
+    counter.write_text("0")
+    pytester.makepyfile(test_sample=f"""
+from pathlib import Path
+
+def test_flip():
+    p = Path({str(counter)!r})
+    n = int(p.read_text())
+    p.write_text(str(n + 1))
+    assert n % 2 == 0
+
+def test_ok():
+    pass
+""")
+    stats_path, hist = pytester.path / "stats.json", pytester.path / "hist"  # inside rootdir, so node ids match
+    for i in range(4):
+        pytester.runpytest("--snap", "--snap-out", str(tmp_path / f"s{i}.json"), "--snap-history", f"{hist}/",
+                           "--snap-stats", str(stats_path))
+    stats = RollingStats.load(stats_path)
+    assert stats.runs == 4
+    expected = compute_flake_scores(load_history(str(hist)))
+    assert stats.flake_scores() == expected and expected["test_sample.py::test_flip"] > 0.5
+    ok = stats.duration("test_sample.py::test_ok")
+    assert ok is not None and ok["n"] == 4
+
+    durations = [0.1, 0.4, 0.25, 0.3, 0.12]
+    rolling = RollingStats()
+    for d in durations:
+        rolling.update([{"id": "t::x", "outcome": "passed", "duration": d}])
+    spread = rolling.duration("t::x")
+    assert spread is not None
+    assert abs(spread["std"] - statistics.stdev(durations)) < 1e-12 and (spread["min"], spread["max"]) == (0.1, 0.4)
+
+    capsys.readouterr()  # drop the pytester runs' output
+    assert main(["stats", "--file", str(stats_path), "--json", "--min-samples", "2"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert out["runs"] == 4 and out["flaky"][0]["id"] == "test_sample.py::test_flip"
+    assert {r["id"] for r in out["variance"]} == {"test_sample.py::test_flip", "test_sample.py::test_ok"}
+
+    # diff --perf reads the precomputed flake scores: a known-flaky slowdown is listed but not gated.
+    art = tmp_path / "art"
+    art.mkdir()
+    for label, flip_s in (("a", 0.1), ("b", 0.5)):
+        rows = [{"nodeid": "test_sample.py::test_flip", "outcome": "passed", "dur_ns": int(flip_s * 1e9)},
+                {"nodeid": "test_sample.py::test_ok", "outcome": "passed", "dur_ns": 10**8}]
+        (art / f"snap_{label}.json").write_text(json.dumps({"results": rows}))
+    gate = ["diff", "a", "b", "--artifacts", str(art), "--plain", "--perf", "--perf-fail", "--perf-stats", str(stats_path)]
+    assert main(gate) == 1
+    capsys.readouterr()
+    assert main([*gate, "--perf-flake", "0.5"]) == 0
+    assert "FLAKY SLOWER: test_flip +0.400s" in capsys.readouterr().out
+
+
+def test_duration_sketches(pytester, tmp_path: Path, capsys):
+    import random
+
+    from pytest_snap.budgets import compute_budget_violations
+    from pytest_snap.cli import main
+    from pytest_snap.sketch import DurationSketches, TDigest
+
+    rng = random.Random(7)
+    xs = [rng.lognormvariate(0, 0.5) for _ in range(20000)]
+    shards = [TDigest() for _ in range(4)]
+    for i, x in enumerate(xs):
+        shards[i % 4].add(x)
+    merged = TDigest()
+    for d in shards:
+        merged.merge(d)
+    ordered = sorted(xs)
+    for q in (0.5, 0.95, 0.99):
+        exact = ordered[int(q * (len(xs) - 1))]
+        est = merged.quantile(q)
+        assert est is not None and abs(est / exact - 1) < 0.02
+    assert merged.count == len(xs) and len(merged.centroids()) <= 100
+    assert compute_budget_violations({"t": {"p50": 10.0, "p99": 0.5}}, {"t": merged})[0]["quantile"] == "p99"
+
+    pytester.makepyfile(test_sample="def test_ok():\n    pass\n")
+    parts = [pytester.path / f"sketch{i}.json" for i in range(2)]
+    for i in range(3):
+        pytester.runpytest("--snap", "--snap-out", str(tmp_path / f"s{i}.json"), "--snap-sketches", str(parts[i % 2]))
+    capsys.readouterr()  # drop the pytester runs' output
+    out = tmp_path / "merged.json"
+    assert main(["merge-sketches", *map(str, parts), "-o", str(out)]) == 0
+    sketches = DurationSketches.load(out)
+    assert sketches.runs == 3 and sketches.tests["test_sample.py::test_ok"].count == 3
+
+    budgets = tmp_path / "budgets.json"
+    budgets.write_text(json.dumps({"budgets": {"test_sample.py::test_ok": {"p50": 5.0, "p99.9": 5.0}}}))
+    capsys.readouterr()
+    assert main(["budgets", str(budgets), "--sketches", str(out), "--json"]) == 0
+    assert json.loads(capsys.readouterr().out)["violations"] == []
+    for _ in range(10):
+        sketches.update([{"id": "test_sample.py::test_ok", "duration": 1.0}])
+    sketches.save(out)
+    budgets.write_text(json.dumps({"budgets": {"test_sample.py::test_ok": {"p50": 0.2}}}))
+    assert main(["budgets", str(budgets), "--sketches", str(out)]) == 1
+    assert "p50" in capsys.readouterr().out
+
+
+def test_pattern_budgets(pytester, tmp_path: Path, capsys):
+    from pytest_snap.budgets import BudgetMatcher, compute_budget_violations, group_totals
+    from pytest_snap.cli import main
+
+    budgets = {
+        "tests/api/test_a.py::test_x[1]": {"p95": 9.0},  # exact (brackets alone are no glob)
+        "tests/api/*": {"p95": 0.2},
+        "re:^tests/(db|api)/.*::test_bulk": {"p99": 1.0},
+        "*::test_slow_*": {"p50": 2.0},
+        "sum:tests/api/": {"p95": 0.5},
+    }
+    m = BudgetMatcher(budgets)
+    assert m.match([
+        "tests/api/test_a.py::test_x[1]", "tests/api/test_a.py::test_bulk", "tests/db/test_b.py::test_bulk_load",
+        "tests/db/test_b.py::test_slow_io", "tests/ui/test_c.py::test_bulk", "other.py::test_y",
+    ]) == {
+        "tests/api/test_a.py::test_x[1]": "tests/api/test_a.py::test_x[1]",
+        "tests/api/test_a.py::test_bulk": "tests/api/*",  # first matching pattern in file order
+        "tests/db/test_b.py::test_bulk_load": "re:^tests/(db|api)/.*::test_bulk",
+        "tests/db/test_b.py::test_slow_io": "*::test_slow_*",
+    }
+    # The ^ anchors only the first branch: ids matching the second must still be tried.
+    alt = BudgetMatcher({"re:^tests/api/|test_slow": {"p95": 1.0}, "re:^tests/[|]x": {"p95": 1.0}})
+    assert alt.key_for("tests/db/test_x.py::test_slow") == "re:^tests/api/|test_slow"
+    assert alt.key_for("tests/|x.py::test_y") == "re:^tests/[|]x"
+    durations = {"tests/api/test_a.py::test_x[1]": 0.4, "tests/api/test_a.py::test_bulk": 0.3, "tests/ui/test_c.py::test_z": 1.0}
+    totals = group_totals(durations)
+    assert totals["tests/api/"] == 0.7 and totals["tests/"] == 1.7 and totals["tests/api/test_a.py"] == 0.7
+    got = compute_budget_violations(budgets, {t: [d] for t, d in durations.items()}, {g: [d] for g, d in totals.items()})
+    assert [(v["id"], v.get("budget")) for v in got] == [
+        ("tests/api/test_a.py::test_bulk", "tests/api/*"), ("sum:tests/api/", None),
+    ]
+
+    pytester.makepyfile(test_sample="import time\n\ndef test_sleepy():\n    time.sleep(0.12)\n\ndef test_ok():\n    pass\n")
+    snap = tmp_path / "snap.json"
+    pytester.runpytest("--snap", "--snap-out", str(snap))
+    capsys.readouterr()
+    bfile = tmp_path / "budgets.json"
+    bfile.write_text(json.dumps({"budgets": {"test_sample.py::test_s*": {"p95": 0.01}, "sum:test_sample.py": {"p50": 0.01}}}))
+    assert main(["budgets", str(bfile), "--snapshot", str(snap), "--json"]) == 1
+    out = json.loads(capsys.readouterr().out)
+    assert sorted(v["id"] for v in out["violations"]) == ["sum:test_sample.py", "test_sample.py::test_sleepy"]
+
+
+def test_budget_exceeded_counts_as_failure(tmp_path: Path, capsys):
+    import os
+
+    from pytest_snap.cli import main
+    from pytest_snap.diff import diff_snapshots
+
+    snaps = [
+        {"results": [{"nodeid": "t.py::test_a", "outcome": "passed", "dur_ns": 1000}]},
+        {"results": [
+            {"nodeid": "t.py::test_a", "outcome": "budget_exceeded", "dur_ns": 9000, "budget_ns": 5000, "elapsed_ns": 9000},
+            {"nodeid": "t.py::test_new", "outcome": "budget_exceeded", "dur_ns": 9000, "budget_ns": 5000, "elapsed_ns": 9000},
+        ]},
+    ]
+    for i, data in enumerate(snaps):
+        path = tmp_path / f"snap_v{i}.json"
+        path.write_text(json.dumps(data))
+        os.utime(path, (1e9 + i, 1e9 + i))
+
+    d = diff_snapshots(snaps[0], snaps[1], slower_ratio=1.3, slower_abs=0.05)
+    assert sorted(f["id"] for f in d["new_failures"]) == ["t.py::test_a", "t.py::test_new"]
+    assert d["summary"]["n_new_passes"] == 0
+
+    assert main(["diff", "v0", "v1", "--artifacts", str(tmp_path)]) == 0
+    out = capsys.readouterr().out
+    assert "ADDED FAIL: test_new" in out and "ADDED PASS" not in out
+    assert "regressions       : 1" in out
+    assert main(["timeline", "--artifacts", str(tmp_path), "--json"]) == 0
+    assert [(r["failed"], r["regressions"]) for r in json.loads(capsys.readouterr().out)] == [(0, 0), (2, 1)]
+
+
+def test_budget_watchdog(pytester):
+    import time
+
+    pytester.makepyfile(test_sample="""
+import time
+
+def test_runaway():
+    for _ in range(3000):  # a retry loop that (nearly) never gives up
+        time.sleep(0.01)
+
+def test_fast():
+    pass
+
+def test_unbudgeted():
+    time.sleep(0.3)
+""")
+    budgets = pytester.path / "budgets.json"  # inside rootdir, so node ids match
+    budgets.write_text(json.dumps({"budgets": {"test_sample.py::test_r*": {"timeout": 0.3}, "test_sample.py::test_fast": {"p95": 0.1}}}))
+    out = pytester.path / "snap.json"
+    t0 = time.monotonic()
+    result = pytester.runpytest("--snap", "--snap-out", str(out), "--snap-watchdog", "--snap-budgets", str(budgets))
+    assert time.monotonic() - t0 < 10
+    result.assert_outcomes(passed=2, failed=1)
+    result.stdout.fnmatch_lines(["*pytest-snap watchdog: test_sample.py::test_runaway exceeded its 0.30s budget*"])
+    recs = {r["nodeid"].split("::")[-1]: r for r in json.loads(out.read_text())["results"]}
+    runaway = recs["test_runaway"]
+    assert runaway["outcome"] == "budget_exceeded" and runaway["budget_ns"] == 300_000_000
+    assert 0.3 <= runaway["elapsed_ns"] / 1e9 < 5
+    assert recs["test_fast"]["outcome"] == recs["test_unbudgeted"]["outcome"] == "passed"
+
+    result = pytester.runpytest("--snap", "--snap-out", str(out), "--snap-watchdog", "--snap-budgets", str(budgets),
+                                "--snap-watchdog-action", "session")
+    result.assert_outcomes(failed=1)